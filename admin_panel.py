@@ -4,9 +4,12 @@ from functools import wraps
 import hashlib
 import logging
 import asyncio
+import time
+from datetime import datetime
 from database import Database
 from config import Config
 from bot_manager import check_bot_connection, is_bot_running, get_bot_pid, restart_bot
+from background_loop import run_coroutine
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 db = Database()
@@ -351,6 +354,7 @@ BASE_TEMPLATE = """
             <a href="{{ url_for('admin.dashboard') }}" class="{% if active_page == 'dashboard' %}active{% endif %}">Дашборд</a>
             <a href="{{ url_for('admin.users') }}" class="{% if active_page == 'users' %}active{% endif %}">Пользователи</a>
             <a href="{{ url_for('admin.broadcasts') }}" class="{% if active_page == 'broadcasts' %}active{% endif %}">Рассылки</a>
+            <a href="{{ url_for('admin.sync_status') }}" class="{% if active_page == 'sync' %}active{% endif %}">Синхронизация</a>
             <a href="{{ url_for('admin.settings_general') }}" class="{% if active_page == 'settings' %}active{% endif %}">Настройки</a>
         </div>
     </div>
@@ -444,6 +448,68 @@ USERS_TEMPLATE = BASE_TEMPLATE.replace('{% block content %}{% endblock %}', '''
 {% endblock %}
 ''')
 
+SYNC_TEMPLATE = BASE_TEMPLATE.replace('{% block content %}{% endblock %}', '''
+{% block content %}
+<div class="stats">
+    <div class="stat-card">
+        <h3>Подключений</h3>
+        <div class="value">{{ summary.total }}</div>
+    </div>
+    <div class="stat-card">
+        <h3>Ожидают синхронизации</h3>
+        <div class="value">{{ summary.due }}</div>
+    </div>
+    <div class="stat-card">
+        <h3>С ошибками</h3>
+        <div class="value">{{ summary.failing }}</div>
+    </div>
+    <div class="stat-card">
+        <h3>Средняя длительность</h3>
+        <div class="value">{{ summary.avg_duration_ms }} мс</div>
+    </div>
+</div>
+
+<div class="section">
+    <h2>Состояние синхронизации</h2>
+    <table>
+        <tr>
+            <th>Пользователь</th>
+            <th>Календарь</th>
+            <th>Последний успех</th>
+            <th>Длительность</th>
+            <th>Изменений</th>
+            <th>Ошибок подряд</th>
+            <th>Интервал</th>
+            <th>Следующая синхронизация</th>
+        </tr>
+        {% for state in states %}
+        <tr>
+            <td>
+                <a href="{{ url_for('admin.user_details', user_id=state.user_id) }}" class="user-link">
+                    {{ state.first_name or state.user_id }}
+                </a>
+                {% if state.username %}@{{ state.username }}{% endif %}
+            </td>
+            <td>{{ state.calendar_type }}{% if state.calendar_name %}: {{ state.calendar_name }}{% endif %}</td>
+            <td>{{ state.last_success or 'N/A' }}</td>
+            <td>{% if state.last_duration_ms is not none %}{{ state.last_duration_ms }} мс{% else %}N/A{% endif %}</td>
+            <td><span class="badge badge-info">{{ state.last_change_count or 0 }}</span></td>
+            <td>
+                {% if state.error_streak %}
+                    <span class="badge badge-secondary" style="background: #e74c3c;" title="{{ state.last_error or '' }}">{{ state.error_streak }}</span>
+                {% else %}
+                    <span class="badge badge-success">0</span>
+                {% endif %}
+            </td>
+            <td>{% if state.interval_seconds %}{{ state.interval_seconds // 60 }} мин{% else %}N/A{% endif %}</td>
+            <td>{{ state.next_due }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+</div>
+{% endblock %}
+''')
+
 # Базовый шаблон для страниц настроек с боковым меню
 SETTINGS_BASE_TEMPLATE = BASE_TEMPLATE.replace('{% block content %}{% endblock %}', '''
 {% block content %}
@@ -915,6 +981,30 @@ def users():
     language_names = SUPPORTED_LANGUAGES
     return render_template_string(USERS_TEMPLATE, users=users_list, language_names=language_names, active_page='users')
 
+def _format_unix_time(value) -> str:
+    """Форматирование unix time (UTC) для отображения в админ панели"""
+    if not value:
+        return None
+    return datetime.utcfromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+
+@admin_bp.route('/sync')
+@login_required
+def sync_status():
+    """Состояние синхронизации подключенных календарей"""
+    now_ts = int(time.time())
+    states = db.get_sync_states()
+    for state in states:
+        state['last_success'] = _format_unix_time(state.get('last_success_at'))
+        state['next_due'] = 'сейчас' if state['next_due_at'] <= now_ts else _format_unix_time(state['next_due_at'])
+    
+    durations = [s['last_duration_ms'] for s in states if s.get('last_duration_ms') is not None]
+    summary = {
+        'total': len(states),
+        'due': sum(1 for s in states if s['next_due_at'] <= now_ts),
+        'failing': sum(1 for s in states if s.get('error_streak')),
+        'avg_duration_ms': int(sum(durations) / len(durations)) if durations else 0
+    }
+    return render_template_string(SYNC_TEMPLATE, states=states, summary=summary, active_page='sync')
 
 # Редирект со старого маршрута на новый
 @admin_bp.route('/settings')
@@ -1098,25 +1188,33 @@ def settings_scheduler():
         try:
             from app import scheduler
             if scheduler:
-                # Удаляем старую задачу
-                try:
-                    scheduler.remove_job('check_events')
-                except:
-                    pass
+                # Удаляем старые задачи
+                for job_id in ('check_events', 'sync_events'):
+                    try:
+                        scheduler.remove_job(job_id)
+                    except:
+                        pass
                 
                 # Добавляем новую задачу, если планировщик включен
                 if scheduler_enabled:
                     from apscheduler.triggers.interval import IntervalTrigger
                     import asyncio
-                    from scheduler import check_and_notify_events
+                    from scheduler import check_and_notify_events, sync_events_from_calendars
                     
                     scheduler.add_job(
-                        func=lambda: asyncio.run(check_and_notify_events()),
+                        func=lambda: run_coroutine(check_and_notify_events()),
                         trigger=IntervalTrigger(minutes=check_interval_int),
                         id='check_events',
                         name='Проверка событий календарей',
                         replace_existing=True
                     )
+                    scheduler.add_job(
+                        func=lambda: asyncio.run(sync_events_from_calendars()),
+                        trigger=IntervalTrigger(minutes=Config.SYNC_TICK_MINUTES),
+                        id='sync_events',
+                        name='Синхронизация событий календарей',
+                        replace_existing=True
+                    )
                     logger.info(f"Планировщик обновлен: интервал {check_interval_int} минут, статус: {'включен' if scheduler_enabled else 'выключен'}")
         except Exception as e:
             logger.warning(f"Не удалось обновить планировщик: {e}")
@@ -1240,11 +1338,7 @@ def bot_status():
 def check_connection():
     """API для проверки подключения к боту"""
     try:
-        # Используем новый event loop в отдельном потоке
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(asyncio.run, check_bot_connection())
-            result = future.result(timeout=10)
+        result = run_coroutine(check_bot_connection(), timeout=10)
         
         return jsonify(result)
     except Exception as e:
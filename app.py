@@ -2,11 +2,15 @@
 from flask import Flask, request, redirect, url_for
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-import asyncio
 import logging
-from telegram import Bot
+from telegram_client import get_bot
+from background_loop import run_coroutine, submit_updates
 from bot import setup_bot
 from scheduler import check_and_notify_events, sync_events_from_calendars
+from notification_outbox import drain_outbox_once
+from job_lease import job_lease
+from sync_queue import request_connection_sync
+import google_push
 from database import Database
 from calendar_google import GoogleCalendar
 from calendar_yandex import YandexCalendar
@@ -54,13 +58,25 @@ try:
     # Добавляем задачу проверки событий, если планировщик включен
     if scheduler_enabled:
         scheduler.add_job(
-            func=lambda: asyncio.run(check_and_notify_events()),
+            func=lambda: run_coroutine(check_and_notify_events()),
             trigger=IntervalTrigger(minutes=check_interval),
             id='check_events',
             name='Проверка событий календарей',
             replace_existing=True
         )
         logger.info(f"Планировщик запущен с интервалом {check_interval} минут")
+        
+        # Синхронизация выбирает только подключения, у которых наступил срок,
+        # поэтому задачу можно запускать часто. Запросы к календарям выполняются
+        # в потоках (asyncio.to_thread), поэтому синхронизация не задерживает общий loop
+        scheduler.add_job(
+            func=lambda: run_coroutine(sync_events_from_calendars()),
+            trigger=IntervalTrigger(minutes=Config.SYNC_TICK_MINUTES),
+            id='sync_events',
+            name='Синхронизация событий календарей',
+            replace_existing=True
+        )
+        logger.info(f"Синхронизация календарей запущена с шагом {Config.SYNC_TICK_MINUTES} минут")
     else:
         logger.info("Планировщик отключен в настройках")
     
@@ -75,17 +91,44 @@ try:
     )
     logger.info("Планировщик рассылок запущен")
     
+    # Отправка очереди уведомлений (повторные попытки после временных ошибок)
+    scheduler.add_job(
+        func=lambda: run_coroutine(drain_outbox_once()),
+        trigger=IntervalTrigger(seconds=Config.OUTBOX_POLL_SECONDS),
+        id='drain_outbox',
+        name='Отправка очереди уведомлений',
+        replace_existing=True
+    )
+    logger.info(f"Отправка очереди уведомлений запущена с шагом {Config.OUTBOX_POLL_SECONDS} секунд")
+    
 except Exception as e:
     logger.warning(f"Не удалось запустить планировщик: {e}. Используйте Scheduled tasks на PythonAnywhere.")
 
+def send_user_message(user_id: int, text: str):
+    """Отправка сообщения пользователю из обработчика Flask через общий клиент Telegram"""
+    if not Config.get_telegram_token():
+        return
+    
+    async def send():
+        bot = await get_bot()
+        await bot.send_message(chat_id=user_id, text=text)
+    
+    run_coroutine(send())
+
 def process_pending_broadcasts():
     """Обработка отложенных рассылок"""
     try:
         from broadcast_sender import send_broadcast
-        pending = db.get_pending_broadcasts()
-        for broadcast in pending:
-            logger.info(f"Запуск отложенной рассылки {broadcast['id']}")
-            send_broadcast(broadcast['id'])
+        with job_lease('check_broadcasts') as lease:
+            if lease is None:
+                return
+            pending = db.get_pending_broadcasts()
+            for broadcast in pending:
+                # Аренда продлевается во время рассылки, а статус рассылки проверяет fencing token
+                if not lease.renew():
+                    break
+                logger.info(f"Запуск отложенной рассылки {broadcast['id']}")
+                send_broadcast(broadcast['id'], lease)
     except Exception as e:
         logger.error(f"Ошибка при обработке отложенных рассылок: {e}")
 
@@ -165,21 +208,12 @@ def google_callback():
             calendar_name=calendar_info.get('name')
         )
         
+        # Первая синхронизация выполняется в фоне, не задерживая ответ
+        request_connection_sync(user_id, 'google')
+        
         # Отправляем уведомление пользователю через Telegram
         try:
-            token = Config.get_telegram_token()
-            if token:
-                bot = Bot(token=token)
-                # Используем asyncio для отправки сообщения
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=t("google_success", user_id, name=calendar_info.get('name'))
-                    )
-                )
-                loop.close()
+            send_user_message(user_id, t("google_success", user_id, name=calendar_info.get('name')))
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
         
@@ -208,18 +242,7 @@ def google_callback():
         
         # Отправляем сообщение об ошибке пользователю
         try:
-            token = Config.get_telegram_token()
-            if token:
-                bot = Bot(token=token)
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=t("error_connection", user_id)
-                    )
-                )
-                loop.close()
+            send_user_message(user_id, t("error_connection", user_id))
         except Exception as e2:
             logger.error(f"Ошибка при отправке сообщения об ошибке: {e2}")
         
@@ -234,6 +257,19 @@ def google_callback():
         </html>
         """, 500
 
+@app.route('/callback/google/push', methods=['POST'])
+def google_push_callback():
+    """Push-уведомление Google Calendar об изменении событий (канал events.watch)"""
+    try:
+        user_id = google_push.handle_notification(request.headers)
+        if user_id:
+            # Повторные уведомления объединяются очередью в одну синхронизацию
+            request_connection_sync(user_id, 'google')
+    except Exception as e:
+        # Google повторяет уведомления с ошибкой; пропущенные изменения найдет опрос
+        logger.error(f"Ошибка при обработке push-уведомления Google: {e}", exc_info=True)
+    return '', 204
+
 @app.route('/callback/yandex')
 def yandex_callback():
     """Callback для Yandex OAuth - автоматическая обработка"""
@@ -309,20 +345,12 @@ def yandex_callback():
             calendar_name=calendar_info.get('name')
         )
         
+        # Первая синхронизация выполняется в фоне, не задерживая ответ
+        request_connection_sync(user_id, 'yandex')
+        
         # Отправляем уведомление пользователю через Telegram
         try:
-            token = Config.get_telegram_token()
-            if token:
-                bot = Bot(token=token)
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=t("yandex_success", user_id, name=calendar_info.get('name'))
-                    )
-                )
-                loop.close()
+            send_user_message(user_id, t("yandex_success", user_id, name=calendar_info.get('name')))
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
         
@@ -351,18 +379,7 @@ def yandex_callback():
         
         # Отправляем сообщение об ошибке пользователю
         try:
-            token = Config.get_telegram_token()
-            if token:
-                bot = Bot(token=token)
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    bot.send_message(
-                        chat_id=user_id,
-                        text=t("error_connection", user_id)
-                    )
-                )
-                loop.close()
+            send_user_message(user_id, t("error_connection", user_id))
         except Exception as e2:
             logger.error(f"Ошибка при отправке сообщения об ошибке: {e2}")
         
@@ -405,7 +422,9 @@ def cron_sync_events():
         logger.info("=" * 50)
         logger.info("Запуск синхронизации событий через /cron/sync-events")
         logger.info("=" * 50)
-        asyncio.run(sync_events_from_calendars())
+        # ?force=1 синхронизирует все подключения, а не только те, у которых наступил срок
+        force = request.args.get('force') in ('1', 'true', 'yes')
+        run_coroutine(sync_events_from_calendars(force=force))
         logger.info("Синхронизация событий завершена успешно")
         return {"status": "success", "message": "Синхронизация событий выполнена"}, 200
     except Exception as e:
@@ -419,13 +438,24 @@ def cron_check_events():
         logger.info("=" * 50)
         logger.info("Запуск проверки событий через /cron/check-events")
         logger.info("=" * 50)
-        asyncio.run(check_and_notify_events())
+        run_coroutine(check_and_notify_events())
         logger.info("Проверка событий завершена успешно")
         return {"status": "success", "message": "Проверка событий выполнена"}, 200
     except Exception as e:
         logger.error(f"Ошибка при проверке событий: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}, 500
 
+@app.route('/cron/drain-outbox')
+def cron_drain_outbox():
+    """Endpoint для отправки очереди уведомлений (вызывается внешним cron-сервисом)"""
+    try:
+        logger.info("Запуск отправки очереди уведомлений через /cron/drain-outbox")
+        run_coroutine(drain_outbox_once())
+        return {"status": "success", "message": "Очередь уведомлений обработана"}, 200
+    except Exception as e:
+        logger.error(f"Ошибка при отправке очереди уведомлений: {e}", exc_info=True)
+        return {"status": "error", "message": str(e)}, 500
+
 @app.route('/test/check-events')
 def test_check_events():
     """Тестовый endpoint для проверки событий (для отладки)"""
@@ -433,7 +463,7 @@ def test_check_events():
         logger.info("=" * 50)
         logger.info("ТЕСТОВЫЙ запуск проверки событий")
         logger.info("=" * 50)
-        asyncio.run(check_and_notify_events())
+        run_coroutine(check_and_notify_events())
         logger.info("Тестовая проверка событий завершена")
         return {"status": "success", "message": "Тестовая проверка событий выполнена. Проверьте логи."}, 200
     except Exception as e:
@@ -459,18 +489,14 @@ def cron_run_bot():
         
         # Используем process_updates_once вместо бесконечного polling
         # Это обработает накопившиеся обновления и завершится
-        import threading
         from process_updates import process_updates_once
         
-        def process_updates_thread():
-            try:
-                asyncio.run(process_updates_once())
-            except Exception as e:
-                logger.error(f"Ошибка при обработке обновлений: {e}", exc_info=True)
+        def log_error(future):
+            if not future.cancelled() and future.exception():
+                logger.error(f"Ошибка при обработке обновлений: {future.exception()}", exc_info=future.exception())
         
-        thread = threading.Thread(target=process_updates_thread)
-        thread.daemon = True
-        thread.start()
+        # Обработка идет в отдельном фоновом loop (не в общем), ответ возвращается сразу
+        submit_updates(process_updates_once()).add_done_callback(log_error)
         
         return {"status": "started", "message": "Обработка обновлений запущена"}, 200
     except Exception as e:
@@ -485,16 +511,22 @@ def cron_run_all():
         
         # Синхронизация событий
         try:
-            asyncio.run(sync_events_from_calendars())
+            run_coroutine(sync_events_from_calendars())
         except Exception as e:
             logger.error(f"Ошибка при синхронизации событий: {e}")
         
         # Проверка событий и отправка уведомлений
         try:
-            asyncio.run(check_and_notify_events())
+            run_coroutine(check_and_notify_events())
         except Exception as e:
             logger.error(f"Ошибка при проверке событий: {e}")
         
+        # Повторная отправка уведомлений из очереди
+        try:
+            run_coroutine(drain_outbox_once())
+        except Exception as e:
+            logger.error(f"Ошибка при отправке очереди уведомлений: {e}")
+        
         # Проверка рассылок
         try:
             process_pending_broadcasts()
@@ -504,7 +536,7 @@ def cron_run_all():
         return {
             "status": "success", 
             "message": "Все задачи выполнены",
-            "tasks": ["sync-events", "check-events", "check-broadcasts"]
+            "tasks": ["sync-events", "check-events", "drain-outbox", "check-broadcasts"]
         }, 200
     except Exception as e:
         logger.error(f"Ошибка при выполнении задач: {e}")
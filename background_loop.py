@@ -0,0 +1,109 @@
+"""Долгоживущий event loop в фоновом потоке для Flask-приложения
+
+Обработчики Flask и задачи планировщика синхронные. Раньше каждый из них
+создавал собственный event loop (asyncio.run или new_event_loop) и вместе с ним
+новый клиент Telegram. Теперь корутины выполняются в одном loop, который живет
+в фоновом потоке все время работы процесса, поэтому клиент Telegram и его пул
+соединений (telegram_client.py) создаются один раз.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+class BackgroundLoop:
+    """Event loop в отдельном потоке с потокобезопасной отправкой корутин"""
+
+    def __init__(self, name: str = 'background-loop'):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # После fork (несколько worker-процессов веб-сервера) поток родителя не наследуется
+            alive = (self._loop is not None and not self._loop.is_closed()
+                     and self._thread.is_alive() and self._pid == os.getpid())
+            if not alive:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._run, args=(loop,), name=self._name, daemon=True)
+                thread.start()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+                logger.info("Фоновый event loop запущен")
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Запланировать корутину в фоновом loop, не дожидаясь результата"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Выполнить корутину в фоновом loop и дождаться результата
+
+        Raises:
+            RuntimeError: при вызове из самого фонового loop (иначе - взаимная блокировка)
+            concurrent.futures.TimeoutError: если результат не получен за timeout секунд
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("Нельзя ожидать результат фонового loop из его собственного потока")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5):
+        """Закрытие клиента Telegram и остановка loop"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or loop.is_closed() or not thread.is_alive():
+            return
+        # Если клиент Telegram в процессе не создавался, модуль не импортируется (при выходе это уже невозможно)
+        telegram_client = sys.modules.get('telegram_client')
+        if telegram_client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(telegram_client.shutdown_bot(), loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии клиента Telegram: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+        logger.info("Фоновый event loop остановлен")
+
+# Loop, общий для всех обработчиков процесса
+background_loop = BackgroundLoop()
+atexit.register(background_loop.stop)
+
+# Отдельный loop для обработки обновлений бота (/cron/run-bot): обработчики делают
+# блокирующие вызовы (OAuth, SQLite, HTTP) и не должны задерживать напоминания,
+# очередь уведомлений и рассылки в общем loop
+updates_loop = BackgroundLoop('bot-updates-loop')
+atexit.register(updates_loop.stop)
+
+def submit(coro: Coroutine) -> concurrent.futures.Future:
+    """Запланировать корутину в общем фоновом loop"""
+    return background_loop.submit(coro)
+
+def submit_updates(coro: Coroutine) -> concurrent.futures.Future:
+    """Запланировать обработку обновлений бота в отдельном loop"""
+    return updates_loop.submit(coro)
+
+def run_coroutine(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """Выполнить корутину в общем фоновом loop и вернуть результат"""
+    return background_loop.run(coro, timeout)
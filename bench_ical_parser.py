@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Микробенчмарк разбора ответов CalDAV (207 Multi-Status)
+
+Сравнивает прежний разбор регулярными выражениями с потоковым разбором
+ical_parser.py на синтетическом ответе в несколько мегабайт: скорость
+(МБ/с, событий/с) и пик выделенной памяти (tracemalloc), а также отбор
+ближайших событий сортировкой всех событий и кучей ограниченного размера.
+Оба разбора собирают список всех событий, поэтому пик памяти сравнивается при
+одинаковом результате. Время каждого повтора заметно колеблется, поэтому
+выводится разброс (мин.-макс.) и отношение regex/stream по парам повторов.
+
+Использование:
+    python bench_ical_parser.py [количество событий] [повторов]
+"""
+
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import List
+from xml.sax.saxutils import escape
+
+from ical_parser import EventSelector, iter_events
+
+# Сколько ближайших событий отбирается в сценарии с max_results
+LIMIT = 10
+
+def build_response(count: int) -> str:
+    """Синтетический ответ REPORT calendar-query с count событиями"""
+    start = datetime(2030, 1, 1, 9, 0)
+    responses = []
+    for i in range(count):
+        dtstart = start + timedelta(hours=i)
+        description = ' '.join(f'Пункт повестки {j} для встречи {i}, подробности\\, ссылки' for j in range(8))
+        # Длинные строки сворачиваются по 75 символов (RFC 5545)
+        folded = '\r\n '.join(description[k:k + 74] for k in range(0, len(description), 74))
+        if i % 2:
+            dtstart_line = f'DTSTART;TZID=Europe/Moscow:{dtstart:%Y%m%dT%H%M%S}'
+            dtend_line = f'DTEND;TZID=Europe/Moscow:{dtstart + timedelta(hours=1):%Y%m%dT%H%M%S}'
+        else:
+            dtstart_line = f'DTSTART:{dtstart:%Y%m%dT%H%M%S}Z'
+            dtend_line = f'DTEND:{dtstart + timedelta(minutes=30):%Y%m%dT%H%M%S}Z'
+        ical = (
+            'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Yandex LLC//Yandex Calendar//EN\r\n'
+            'BEGIN:VEVENT\r\n'
+            f'UID:event-{i}@yandex.ru\r\n'
+            f'SUMMARY:Встреча номер {i}\r\n'
+            f'DESCRIPTION:{folded}\r\n'
+            f'LOCATION:Переговорная {i % 20}\\, этаж {i % 7}\r\n'
+            f'{dtstart_line}\r\n{dtend_line}\r\n'
+            'BEGIN:VALARM\r\nTRIGGER:-PT15M\r\nACTION:DISPLAY\r\nEND:VALARM\r\n'
+            'END:VEVENT\r\nEND:VCALENDAR\r\n'
+        )
+        responses.append(
+            f'<D:response><D:href>/calendars/user/events-1/event-{i}.ics</D:href>'
+            f'<D:propstat><D:prop><D:getetag>"{i}"</D:getetag>'
+            f'<C:calendar-data>{escape(ical)}</C:calendar-data></D:prop>'
+            f'<D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>'
+        )
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<D:multistatus xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+            + ''.join(responses) + '</D:multistatus>')
+
+def parse_regex(ical_data: str):
+    """Прежний разбор: re.findall по всему ответу и re.search на каждое поле"""
+    events = []
+    for vevent_text in re.findall(r'BEGIN:VEVENT(.*?)END:VEVENT', ical_data, re.DOTALL):
+        event = {}
+        uid = re.search(r'UID:(.*?)(?:\r\n|\n)', vevent_text)
+        if not uid:
+            continue
+        event['id'] = uid.group(1).strip()
+        for field in ('SUMMARY', 'DESCRIPTION', 'LOCATION'):
+            match = re.search(field + r'(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
+            event[field.lower()] = match.group(1).strip() if match else ''
+        for field in ('DTSTART', 'DTEND'):
+            match = re.search(field + r'(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
+            if match:
+                value = match.group(1).strip()
+                event[field.lower()] = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+        events.append(event)
+    return events
+
+def parse_stream(ical_data: str):
+    """Потоковый разбор ical_parser со списком всех событий (как parse_regex)"""
+    return list(iter_events(ical_data))
+
+def parse_stream_limited(ical_data: str):
+    """Потоковый разбор с отбором LIMIT ближайших событий (как get_upcoming_events)"""
+    selector = EventSelector(LIMIT)
+    for event in iter_events(ical_data, cutoff=selector.cutoff):
+        selector.offer(event)
+    return selector.result()
+
+def parse_stream_sorted(ical_data: str):
+    """Потоковый разбор всех событий с сортировкой и срезом LIMIT ближайших"""
+    return sorted(iter_events(ical_data), key=lambda event: event['start'])[:LIMIT]
+
+def run_once(func, data: str):
+    started = time.perf_counter()
+    result = func(data)
+    return time.perf_counter() - started, len(result)
+
+def peak_memory(func, data: str) -> float:
+    """Пик выделенной памяти (МБ) за один вызов"""
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+def report(name: str, times: List[float], count: int, data: str, peak: float):
+    size_mb = len(data.encode('utf-8')) / 1024 / 1024
+    best, worst = min(times), max(times)
+    print(f"{name:<10} {best * 1000:7.1f}-{worst * 1000:7.1f} мс  {size_mb / best:7.1f} МБ/с  "
+          f"{count / best:9.0f} событий/с  пик памяти {peak:6.2f} МБ  (событий: {count})")
+
+def measure(name: str, func, data: str, repeats: int) -> List[float]:
+    results = [run_once(func, data) for _ in range(repeats)]
+    times = [elapsed for elapsed, _ in results]
+    report(name, times, results[-1][1], data, peak_memory(func, data))
+    return times
+
+def compare(data: str, repeats: int):
+    """regex и stream по очереди в каждом повторе: отношение времени считается по парам"""
+    regex_results, stream_results = [], []
+    for _ in range(repeats):
+        regex_results.append(run_once(parse_regex, data))
+        stream_results.append(run_once(parse_stream, data))
+    regex_times = [elapsed for elapsed, _ in regex_results]
+    stream_times = [elapsed for elapsed, _ in stream_results]
+    report('regex', regex_times, regex_results[-1][1], data, peak_memory(parse_regex, data))
+    report('stream', stream_times, stream_results[-1][1], data, peak_memory(parse_stream, data))
+    ratios = [regex / stream for regex, stream in zip(regex_times, stream_times)]
+    print(f"stream быстрее regex в {min(ratios):.2f}-{max(ratios):.2f} раза (по {repeats} парам повторов)")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    data = build_response(count)
+    print(f"Ответ: {len(data.encode('utf-8')) / 1024 / 1024:.1f} МБ, {count} событий, повторов: {repeats}")
+    compare(data, repeats)
+    measure(f'sort[:{LIMIT}]', parse_stream_sorted, data, repeats)
+    measure(f'heap({LIMIT})', parse_stream_limited, data, repeats)
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,11 @@ from database import Database
 from calendar_google import GoogleCalendar
 from calendar_yandex import YandexCalendar
 from config import Config
+from rate_limiter import BotRateLimiter
+from telegram_client import create_request
 from i18n import t, get_language_name, SUPPORTED_LANGUAGES
+from sync_queue import request_connection_sync
+from notification_engine import notify_events_changed
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -228,11 +232,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Отключение календарей
     elif data == "disconnect_google":
         db.delete_calendar_connection(user_id, 'google')
+        notify_events_changed(user_id)
         await query.answer(t("google_disconnected_alert", user_id), show_alert=True)
         await query.edit_message_text(t("google_disconnected", user_id), reply_markup=get_calendars_menu(user_id))
     
     elif data == "disconnect_yandex":
         db.delete_calendar_connection(user_id, 'yandex')
+        notify_events_changed(user_id)
         await query.answer(t("yandex_disconnected_alert", user_id), show_alert=True)
         await query.edit_message_text(t("yandex_disconnected", user_id), reply_markup=get_calendars_menu(user_id))
     
@@ -274,6 +280,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith("time_"):
         minutes = int(data.split("_")[1])
         db.update_notification_settings(user_id, minutes)
+        notify_events_changed(user_id)
         await query.answer(t("time_set_alert", user_id, minutes=minutes), show_alert=True)
         await query.edit_message_text(
             t("time_set", user_id, minutes=minutes),
@@ -285,6 +292,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         settings = db.get_notification_settings(user_id)
         new_enabled = not settings.get('enabled', True)
         db.update_notification_settings(user_id, settings.get('notification_minutes', 15), new_enabled)
+        notify_events_changed(user_id)
         status_text = t("notifications_enabled", user_id) if new_enabled else t("notifications_disabled", user_id)
         await query.answer(t("notifications_toggled", user_id, status=status_text), show_alert=True)
         status = t("settings_enabled", user_id) if new_enabled else t("settings_disabled", user_id)
@@ -350,6 +358,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     calendar_name=calendar_info.get('name')
                 )
                 
+                request_connection_sync(user_id, 'google')
                 del user_states[user_id]
                 
                 await update.message.reply_text(
@@ -392,6 +401,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     calendar_name=calendar_info.get('name')
                 )
                 
+                request_connection_sync(user_id, 'yandex')
                 del user_states[user_id]
                 
                 await update.message.reply_text(
@@ -420,7 +430,9 @@ def setup_bot():
     if not token:
         raise ValueError("TELEGRAM_BOT_TOKEN не установлен. Установите его в админ панели или .env файле")
     
-    application = Application.builder().token(token).build()
+    # Пул соединений и таймауты - как у общего клиента (telegram_client.py)
+    application = (Application.builder().token(token).request(create_request())
+                   .rate_limiter(BotRateLimiter()).build())
     
     # Регистрация обработчиков
     application.add_handler(CommandHandler("start", start))
@@ -6,7 +6,7 @@ import json
 import logging
 from pathlib import Path
 from typing import Optional, Dict
-from telegram import Bot
+from telegram_client import get_bot
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -244,7 +244,7 @@ async def check_bot_connection() -> Dict[str, any]:
                 'error': 'Токен не установлен'
             }
         
-        bot = Bot(token=token)
+        bot = await get_bot()
         bot_info = await bot.get_me()
         
         return {
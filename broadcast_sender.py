@@ -1,9 +1,11 @@
 """Модуль для отправки рассылок"""
-import asyncio
 import logging
+import time
 from datetime import datetime
 from typing import List, Dict, Optional
-from telegram import Bot
+from rate_limiter import LANE_BROADCAST
+from telegram_client import get_bot
+from background_loop import run_coroutine
 from database import Database
 from config import Config
 from i18n import SUPPORTED_LANGUAGES
@@ -13,21 +15,25 @@ logger = logging.getLogger(__name__)
 
 db = Database()
 
-async def send_broadcast_async(broadcast_id: int):
-    """Асинхронная отправка рассылки"""
+async def send_broadcast_async(broadcast_id: int, lease=None):
+    """Асинхронная отправка рассылки
+    
+    Args:
+        lease: аренда задачи отложенных рассылок (job_lease.py). Она продлевается
+            между получателями; если аренда потеряна, рассылка возвращается в pending
+            и ее продолжит новый владелец, пропустив уже обработанных получателей
+    """
     try:
         broadcast = db.get_broadcast(broadcast_id)
         if not broadcast:
             logger.error(f"Рассылка {broadcast_id} не найдена")
             return
         
-        if broadcast['status'] != 'pending':
+        # Атомарно переводим в "отправляется": рассылку не начнут два процесса одновременно
+        if not db.claim_broadcast(broadcast_id):
             logger.warning(f"Рассылка {broadcast_id} уже обрабатывается или завершена")
             return
         
-        # Обновляем статус на "отправляется"
-        db.update_broadcast_status(broadcast_id, 'sending')
-        
         # Получаем токен бота
         token = Config.get_telegram_token()
         if not token:
@@ -35,7 +41,9 @@ async def send_broadcast_async(broadcast_id: int):
             db.update_broadcast_status(broadcast_id, 'failed', 0, 1)
             return
         
-        bot = Bot(token=token)
+        # Частоту отправки ограничивает общий для процесса ограничитель (rate_limiter.py),
+        # рассылка идет в полосе с низким приоритетом и не задерживает напоминания
+        bot = await get_bot()
         
         # Получаем список пользователей по языкам
         languages = broadcast.get('languages')
@@ -44,13 +52,22 @@ async def send_broadcast_async(broadcast_id: int):
         # Устанавливаем общее количество пользователей
         db.set_broadcast_total_users(broadcast_id, len(users))
         
-        sent_count = 0
-        failed_count = 0
+        # Рассылка могла быть прервана после потери аренды: обработанные получатели пропускаются
+        processed = db.get_broadcast_processed_users(broadcast_id)
+        sent_count = sum(1 for status in processed.values() if status == 'sent')
+        failed_count = sum(1 for status in processed.values() if status == 'failed')
         
         # Отправляем сообщения
         for user in users:
             user_id = user['user_id']
             user_language = user.get('language') or 'en'
+            if user_id in processed:
+                continue
+            
+            if lease is not None and not lease.keep_alive():
+                logger.warning(f"Аренда рассылок потеряна, рассылка {broadcast_id} возвращена в очередь")
+                db.release_broadcast(broadcast_id)
+                return
             
             # Проверяем, нужно ли отправлять этому пользователю
             if languages and user_language not in languages:
@@ -62,7 +79,11 @@ async def send_broadcast_async(broadcast_id: int):
             
             try:
                 # Отправляем сообщение
-                await bot.send_message(chat_id=user_id, text=broadcast['message_text'])
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=broadcast['message_text'],
+                    rate_limit_args={'lane': LANE_BROADCAST}
+                )
                 
                 # Записываем в историю
                 db.add_broadcast_history(
@@ -70,9 +91,6 @@ async def send_broadcast_async(broadcast_id: int):
                 )
                 sent_count += 1
                 
-                # Небольшая задержка, чтобы не превысить лимиты API
-                await asyncio.sleep(0.05)  # 50ms между сообщениями
-                
             except Exception as e:
                 error_msg = str(e)
                 # Улучшаем сообщение об ошибке для пользователя
@@ -93,7 +111,14 @@ async def send_broadcast_async(broadcast_id: int):
         
         # Обновляем финальный статус
         final_status = 'completed' if failed_count == 0 or sent_count > 0 else 'failed'
-        db.update_broadcast_status(broadcast_id, final_status, sent_count, failed_count)
+        if lease is None:
+            db.update_broadcast_status(broadcast_id, final_status, sent_count, failed_count)
+        elif not db.finish_broadcast_fenced(broadcast_id, final_status, sent_count, failed_count,
+                                            lease.name, lease.token, int(time.time())):
+            # Новый владелец аренды завершит рассылку без повторной отправки
+            logger.warning(f"Аренда рассылок истекла, рассылка {broadcast_id} возвращена в очередь")
+            db.release_broadcast(broadcast_id)
+            return
         
         logger.info(f"Рассылка {broadcast_id} завершена: отправлено {sent_count}, ошибок {failed_count}")
         
@@ -101,10 +126,10 @@ async def send_broadcast_async(broadcast_id: int):
         logger.error(f"Критическая ошибка при отправке рассылки {broadcast_id}: {e}", exc_info=True)
         db.update_broadcast_status(broadcast_id, 'failed', 0, 1)
 
-def send_broadcast(broadcast_id: int):
+def send_broadcast(broadcast_id: int, lease=None):
     """Синхронная обертка для отправки рассылки"""
     try:
-        asyncio.run(send_broadcast_async(broadcast_id))
+        run_coroutine(send_broadcast_async(broadcast_id, lease))
     except Exception as e:
         logger.error(f"Ошибка при запуске рассылки {broadcast_id}: {e}")
 
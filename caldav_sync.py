@@ -0,0 +1,168 @@
+"""Инкрементальная синхронизация календарей CalDAV (Yandex)
+
+Вместо загрузки calendar-data всех событий диапазона при каждой синхронизации
+коллекция опрашивается запросом sync-collection (RFC 6578) с сохраненным
+sync-token: сервер возвращает только href и etag измененных и удаленных
+ресурсов, а загружаются (calendar-multiget) лишь ресурсы с новым etag.
+Когда диапазон синхронизации сдвигается вперед, загружается только новый участок.
+Если сервер не поддерживает sync-collection, используется полная загрузка.
+Коллекции подключения опрашиваются параллельно, а результат каждой
+записывается в collection_sync_state.
+"""
+import itertools
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from calendar_yandex import YandexCalendar
+from database import Database, to_timestamp
+from job_lease import Lease
+from parallel_fetch import fetch_collections
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+yandex_cal = YandexCalendar()
+
+def _sync_collection(user_id: int, calendar_type: str, access_token: str, collection_url: str, state: Dict,
+                     time_min: datetime, time_max: datetime) -> Optional[Dict]:
+    """Изменения одной коллекции с прошлой синхронизации (выполняется в отдельном потоке)
+
+    Returns:
+        Словарь с событиями, UID для замены и удаления, признаком полной загрузки
+        (initial) и состоянием коллекции для commit_sync (update); None, если
+        коллекция не поддерживает sync-collection
+    """
+    time_max_ts = to_timestamp(time_max)
+    changes = yandex_cal.get_sync_changes(access_token, collection_url, state.get('sync_token'))
+    if changes is None:
+        return None
+    known = db.get_caldav_resources(user_id, calendar_type, collection_url)
+    result = {'events': [], 'replaced_uids': set(), 'removed_uids': set(), 'initial': changes['initial']}
+    update = {
+        'collection_url': collection_url,
+        'sync_token': changes['sync_token'],
+        'window_end': time_max_ts,
+        'resources': [],
+        'deleted': changes['deleted'],
+        'reset': changes['initial']
+    }
+
+    if changes['initial']:
+        # Полный список: запоминаем etag всех ресурсов, а данные загружаем только для диапазона
+        update['resources'] = [(href, etag, None) for href, etag in changes['etags'].items()]
+        removed_hrefs = [href for href in known if href not in changes['etags']]
+        fetched = yandex_cal.query_resources(access_token, collection_url, time_min, time_max)
+    else:
+        removed_hrefs = changes['deleted']
+        changed_hrefs = [href for href, etag in changes['etags'].items()
+                         if known.get(href, {}).get('etag') != etag]
+        fetched = yandex_cal.get_resources(access_token, collection_url, changed_hrefs) if changed_hrefs else []
+        # Прежний UID измененного ресурса тоже заменяется (на случай смены UID)
+        result['replaced_uids'].update(known[href]['uid'] for href in changed_hrefs
+                                       if known.get(href, {}).get('uid'))
+
+        # Диапазон сдвинулся: догружаем события, попавшие в новый участок
+        window_end = state.get('window_end')
+        if window_end and window_end < time_max_ts:
+            fetched = itertools.chain(fetched, yandex_cal.query_resources(
+                access_token, collection_url, datetime.utcfromtimestamp(window_end), time_max))
+
+    result['removed_uids'].update(known[href]['uid'] for href in removed_hrefs
+                                  if known.get(href, {}).get('uid'))
+    # Ресурсы разбираются по мере чтения ответа, не накапливая calendar-data всех ресурсов
+    fetched_hrefs = set()
+    for resource in fetched:
+        if resource['href'] in fetched_hrefs:
+            continue
+        fetched_hrefs.add(resource['href'])
+        uid, events = yandex_cal.parse_resource(resource, time_min, time_max)
+        update['resources'].append((resource['href'], resource['etag'], uid))
+        if uid:
+            result['replaced_uids'].add(uid)
+        result['events'].extend(events)
+
+    logger.info(f"Yandex CalDAV: {collection_url}: "
+                f"{'полная загрузка' if changes['initial'] else 'изменения'}, "
+                f"изменено ресурсов {len(fetched_hrefs)}, удалено {len(removed_hrefs)}")
+    result['update'] = update
+    return result
+
+async def sync_collections(user_id: int, calendar_type: str, access_token: str, collections: List[str],
+                           time_min: datetime, time_max: datetime, lease: Optional[Lease] = None) -> Optional[Dict]:
+    """Получение изменений коллекций с прошлой синхронизации
+
+    Коллекции опрашиваются параллельно (parallel_fetch.py). Если коллекция
+    ответила ошибкой, ее состояние не меняется, а изменения остальных коллекций
+    применяются; ошибка всех коллекций прерывает синхронизацию.
+
+    Returns:
+        Словарь с новыми и измененными событиями (events), UID событий, экземпляры
+        которых в кэше заменяются (replaced_uids) или удалены на сервере (removed_uids),
+        признаком полной загрузки всех коллекций (full) и состоянием для commit_sync;
+        None, если нужна обычная полная загрузка
+    """
+    states = db.get_caldav_sync_states(user_id, calendar_type)
+    outcomes = await fetch_collections('yandex', collections, lambda collection_url: _sync_collection(
+        user_id, calendar_type, access_token, collection_url, states.get(collection_url) or {}, time_min, time_max),
+        lease=lease)
+
+    result = {'events': [], 'replaced_uids': set(), 'removed_uids': set(), 'full': True,
+              'updates': [], 'collection_results': []}
+    errors = []
+    for collection_url, collection, error in outcomes:
+        if error is not None:
+            logger.error(f"Yandex CalDAV: ошибка синхронизации коллекции {collection_url}: {error}")
+            errors.append(error)
+            # Без данных коллекции нельзя считать отсутствующие в ответе события удаленными
+            result['full'] = False
+            result['collection_results'].append((collection_url, str(error)[:500], None))
+            continue
+        if collection is None:
+            return None
+        result['full'] = result['full'] and collection['initial']
+        result['events'].extend(collection['events'])
+        result['replaced_uids'] |= collection['replaced_uids']
+        result['removed_uids'] |= collection['removed_uids']
+        result['updates'].append(collection['update'])
+        result['collection_results'].append((collection_url, None, len(collection['events'])))
+    if errors and len(errors) == len(collections):
+        raise errors[0]
+
+    # Событие, которое снова появилось в изменениях, не удаляется
+    result['removed_uids'] -= result['replaced_uids']
+    return result
+
+def stale_event_ids(user_id: int, calendar_type: str, result: Dict,
+                    time_min: datetime, time_max: datetime) -> List[int]:
+    """Строки кэша, которые больше не соответствуют событиям на сервере
+
+    Удаляются экземпляры удаленных событий, прежние экземпляры измененных событий
+    (например, после переноса), а после полной загрузки - все события диапазона,
+    которых нет на сервере.
+    """
+    kept = set()
+    for event in result['events']:
+        start = event.get('start')
+        kept.add((event.get('id'), start.isoformat(' ') if isinstance(start, datetime) else str(start)))
+
+    time_min_ts, time_max_ts = to_timestamp(time_min), to_timestamp(time_max)
+    stale = []
+    for cached in db.get_cached_events(user_id, calendar_type):
+        uid = cached.get('event_id')
+        if (uid, str(cached.get('start_time'))) in kept:
+            continue
+        if uid in result['removed_uids'] or uid in result['replaced_uids']:
+            stale.append(cached['id'])
+        elif result['full'] and time_min_ts <= to_timestamp(cached['start']) <= time_max_ts:
+            stale.append(cached['id'])
+    return stale
+
+def commit_sync(user_id: int, calendar_type: str, result: Dict, collections: List[str]):
+    """Сохранение sync-token и etag после того, как события записаны в кэш"""
+    for update in result['updates']:
+        db.save_caldav_sync(user_id, calendar_type, update['collection_url'], update['sync_token'],
+                            update['window_end'], update['resources'], update['deleted'], update['reset'])
+    db.delete_stale_caldav_collections(user_id, calendar_type, collections)
+    db.record_collection_results(user_id, calendar_type, result['collection_results'], collections,
+                                 int(time.time()))
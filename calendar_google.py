@@ -1,6 +1,6 @@
 """Интеграция с Google Calendar API"""
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
@@ -9,6 +9,11 @@ from googleapiclient.errors import HttpError
 import json
 from config import Config
 
+# Поля ответов (partial response): Google не передает участников, конференции,
+# напоминания и прочие данные событий, которые бот не использует
+CALENDAR_LIST_FIELDS = 'nextPageToken,items(id,summary,summaryOverride,primary,selected)'
+EVENT_LIST_FIELDS = 'etag,nextPageToken,items(id,summary,description,location,start(date,dateTime),end(date,dateTime),htmlLink)'
+
 class GoogleCalendar:
     """Класс для работы с Google Calendar"""
     
@@ -79,58 +84,168 @@ class GoogleCalendar:
             print(f"Ошибка при создании credentials: {e}")
             return None
     
+    def list_calendars(self, credentials: Credentials) -> List[Dict]:
+        """Календари пользователя для синхронизации (calendarList)
+        
+        Берутся календари, отмеченные пользователем в Google Calendar (selected),
+        и основной календарь.
+        
+        Raises:
+            HttpError: при ошибке Google Calendar API
+        """
+        service = build('calendar', 'v3', credentials=credentials)
+        calendars = []
+        page_token = None
+        while True:
+            response = service.calendarList().list(minAccessRole='reader', pageToken=page_token,
+                                                   fields=CALENDAR_LIST_FIELDS).execute()
+            for item in response.get('items', []):
+                if item.get('primary') or item.get('selected'):
+                    calendars.append({
+                        'id': item['id'],
+                        'name': item.get('summaryOverride') or item.get('summary', '')
+                    })
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return calendars
+    
+    def list_events(self, credentials: Credentials, calendar_id: str,
+                    time_min: datetime, time_max: datetime, max_results: int,
+                    etag: Optional[str] = None,
+                    all_pages: bool = True) -> Tuple[Optional[List[Dict]], Optional[str]]:
+        """События одного календаря в диапазоне дат (все страницы ответа)
+        
+        Args:
+            max_results: размер страницы (Google возвращает не больше 2500 событий)
+            etag: ETag предыдущего ответа на такой же запрос (If-None-Match)
+            all_pages: False - только первая страница (первые max_results событий)
+        
+        Returns:
+            События и ETag первой страницы; если календарь не изменился (304),
+            вместо событий возвращается None и прежний ETag
+        
+        Raises:
+            HttpError: при ошибке Google Calendar API
+        """
+        service = build('calendar', 'v3', credentials=credentials)
+        
+        events = []
+        response_etag = None
+        page_token = None
+        while True:
+            request = service.events().list(
+                calendarId=calendar_id,
+                timeMin=time_min.isoformat() + 'Z',
+                timeMax=time_max.isoformat() + 'Z',
+                maxResults=max_results,
+                singleEvents=True,
+                orderBy='startTime',
+                pageToken=page_token,
+                fields=EVENT_LIST_FIELDS
+            )
+            # ETag относится к первой странице: если она не изменилась, не изменился и весь список
+            if etag and page_token is None:
+                request.headers['If-None-Match'] = etag
+            try:
+                events_result = request.execute()
+            except HttpError as e:
+                if etag and page_token is None and getattr(e.resp, 'status', None) == 304:
+                    return None, etag
+                raise
+            if page_token is None:
+                response_etag = events_result.get('etag')
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token or not all_pages:
+                break
+        
+        result = []
+        
+        for event in events:
+            start = event['start'].get('dateTime', event['start'].get('date'))
+            end = event['end'].get('dateTime', event['end'].get('date'))
+            
+            # Парсинг времени
+            if 'T' in start:
+                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+            else:
+                start_dt = datetime.fromisoformat(start)
+            
+            if 'T' in end:
+                end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
+            else:
+                end_dt = datetime.fromisoformat(end)
+            
+            result.append({
+                'id': event.get('id'),
+                'summary': event.get('summary', 'Без названия'),
+                'description': event.get('description', ''),
+                'start': start_dt,
+                'end': end_dt,
+                'location': event.get('location', ''),
+                'htmlLink': event.get('htmlLink', ''),
+                'calendar_type': 'google'
+            })
+        
+        return result, response_etag
+    
+    def watch_events(self, credentials: Credentials, calendar_id: str, channel_id: str,
+                     address: str, token: str, ttl_seconds: int) -> Dict:
+        """Регистрация канала push-уведомлений об изменениях событий календаря (events.watch)
+        
+        Args:
+            channel_id: уникальный id канала (приходит в X-Goog-Channel-ID)
+            address: HTTPS адрес, на который Google отправляет уведомления
+            token: секрет канала (приходит в X-Goog-Channel-Token)
+            ttl_seconds: желаемый срок действия канала (Google может сократить его)
+        
+        Returns:
+            Словарь с resource_id и временем истечения канала (expiration, unix time)
+        
+        Raises:
+            HttpError: при ошибке Google Calendar API
+        """
+        service = build('calendar', 'v3', credentials=credentials)
+        response = service.events().watch(
+            calendarId=calendar_id,
+            body={
+                'id': channel_id,
+                'type': 'web_hook',
+                'address': address,
+                'token': token,
+                'params': {'ttl': str(ttl_seconds)}
+            }
+        ).execute()
+        return {
+            'resource_id': response.get('resourceId'),
+            # Google возвращает время истечения в миллисекундах
+            'expiration': int(response['expiration']) // 1000 if response.get('expiration') else None
+        }
+    
+    def stop_channel(self, credentials: Credentials, channel_id: str, resource_id: str):
+        """Остановка канала push-уведомлений (channels.stop)
+        
+        Raises:
+            HttpError: при ошибке Google Calendar API
+        """
+        service = build('calendar', 'v3', credentials=credentials)
+        service.channels().stop(body={'id': channel_id, 'resourceId': resource_id}).execute()
+    
     def get_upcoming_events(self, credentials: Credentials, 
                            time_min: datetime = None, 
                            time_max: datetime = None,
-                           max_results: int = 10) -> List[Dict]:
+                           max_results: int = 10,
+                           calendar_id: str = 'primary') -> List[Dict]:
         """Получение предстоящих событий"""
         try:
-            service = build('calendar', 'v3', credentials=credentials)
-            
             if time_min is None:
                 time_min = datetime.utcnow()
             if time_max is None:
                 time_max = time_min + timedelta(days=7)
             
-            events_result = service.events().list(
-                calendarId='primary',
-                timeMin=time_min.isoformat() + 'Z',
-                timeMax=time_max.isoformat() + 'Z',
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            result = []
-            
-            for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                end = event['end'].get('dateTime', event['end'].get('date'))
-                
-                # Парсинг времени
-                if 'T' in start:
-                    start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                else:
-                    start_dt = datetime.fromisoformat(start)
-                
-                if 'T' in end:
-                    end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-                else:
-                    end_dt = datetime.fromisoformat(end)
-                
-                result.append({
-                    'id': event.get('id'),
-                    'summary': event.get('summary', 'Без названия'),
-                    'description': event.get('description', ''),
-                    'start': start_dt,
-                    'end': end_dt,
-                    'location': event.get('location', ''),
-                    'htmlLink': event.get('htmlLink', ''),
-                    'calendar_type': 'google'
-                })
-            
-            return result
+            events, _ = self.list_events(credentials, calendar_id, time_min, time_max, max_results,
+                                         all_pages=False)
+            return events
             
         except HttpError as error:
             print(f'Ошибка при получении событий: {error}')
@@ -1,8 +1,50 @@
 """Интеграция с Yandex Calendar API"""
+import itertools
+import logging
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import Config
+from ical_parser import EventSelector, in_range, iter_events
+
+logger = logging.getLogger(__name__)
+
+DAV_NS = 'DAV:'
+CALDAV_NS = 'urn:ietf:params:xml:ns:caldav'
+
+# Ответы, после которых сохраненный адрес коллекции считается устаревшим
+_STALE_STATUSES = (301, 308, 404, 410)
+
+# Прежние адреса запроса событий, если поиск коллекций не удался
+_LEGACY_COLLECTION_PATHS = ('/events/', '/calendars/', '/')
+
+# Теги multistatus, которые обрабатываются при потоковом разборе
+_RESPONSE_TAG = f'{{{DAV_NS}}}response'
+_SYNC_TOKEN_TAG = f'{{{DAV_NS}}}sync-token'
+
+# Размер части тела ответа, передаваемой XML-парсеру
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Ресурсов в одном запросе calendar-multiget
+_MULTIGET_BATCH = 100
+
+# Максимум последовательных запросов sync-collection при усеченных (507) ответах
+_MAX_SYNC_PAGES = 20
+
+def _status_code(status_line: str) -> Optional[int]:
+    """Код из строки статуса WebDAV ("HTTP/1.1 404 Not Found")"""
+    parts = status_line.split()
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+class CalDAVDiscoveryError(Exception):
+    """Не удалось найти коллекции с событиями (principal, calendar-home-set или список календарей)"""
+    pass
 
 class YandexCalendar:
     """Класс для работы с Yandex Calendar"""
@@ -11,11 +53,53 @@ class YandexCalendar:
     TOKEN_URL = "https://oauth.yandex.ru/token"
     API_BASE_URL = "https://caldav.yandex.ru"
     
+    # Общая для всех экземпляров HTTP-сессия: keep-alive соединения с caldav.yandex.ru
+    # и oauth.yandex.ru переиспользуются между запросами и пользователями
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+    
     def __init__(self, client_id: str = None, client_secret: str = None, redirect_uri: str = None):
         self.client_id = client_id or Config.get_yandex_client_id()
         self.client_secret = client_secret or Config.get_yandex_client_secret()
         self.redirect_uri = redirect_uri or Config.get_yandex_redirect_uri()
     
+    @classmethod
+    def _create_session(cls) -> requests.Session:
+        """Сессия с пулом соединений, повторами и сжатием ответов"""
+        # Повторяются только идемпотентные запросы: код авторизации в POST /token одноразовый
+        retry = Retry(
+            total=Config.YANDEX_HTTP_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS', 'PROPFIND', 'REPORT']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2,  # caldav.yandex.ru и oauth.yandex.ru
+            pool_maxsize=Config.YANDEX_POOL_SIZE,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        return session
+    
+    @property
+    def session(self) -> requests.Session:
+        """HTTP-сессия адаптера (создается при первом запросе)"""
+        if YandexCalendar._session is None:
+            with YandexCalendar._session_lock:
+                if YandexCalendar._session is None:
+                    YandexCalendar._session = self._create_session()
+        return YandexCalendar._session
+    
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Запрос через общую сессию с таймаутом по умолчанию"""
+        kwargs.setdefault('timeout', Config.YANDEX_HTTP_TIMEOUT)
+        return self.session.request(method, url, **kwargs)
+    
     def get_authorization_url(self, user_id: int = None) -> str:
         """Получение URL для авторизации
         
@@ -64,7 +148,7 @@ class YandexCalendar:
         }
         
         try:
-            response = requests.post(self.TOKEN_URL, data=data)
+            response = self._request('POST', self.TOKEN_URL, data=data)
             response.raise_for_status()
             token_data = response.json()
             return {
@@ -87,7 +171,7 @@ class YandexCalendar:
         }
         
         try:
-            response = requests.post(self.TOKEN_URL, data=data)
+            response = self._request('POST', self.TOKEN_URL, data=data)
             response.raise_for_status()
             token_data = response.json()
             return {
@@ -112,11 +196,9 @@ class YandexCalendar:
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data)
+                response = self._request('GET', url, headers=headers)
             else:
-                response = requests.request(method, url, headers=headers, json=data)
+                response = self._request(method, url, headers=headers, json=data)
             
             response.raise_for_status()
             return response.json() if response.content else {}
@@ -141,39 +223,203 @@ class YandexCalendar:
             print(f"Ошибка при получении календарей: {e}")
             return [{'id': 'default', 'name': 'Yandex Calendar'}]
     
+    def _propfind(self, access_token: str, url: str, body: str, depth: str = '0') -> Optional[ET.Element]:
+        """PROPFIND-запрос; возвращает корень multistatus или None, если ответ не 207"""
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/xml; charset=utf-8',
+            'Depth': depth
+        }
+        response = self._request('PROPFIND', url, headers=headers, data=body)
+        if response.status_code != 207:
+            logger.debug(f"Yandex CalDAV: PROPFIND {url} вернул {response.status_code}")
+            return None
+        return ET.fromstring(response.content)
+    
+    @staticmethod
+    def _found_props(multistatus: ET.Element):
+        """Пары (href, prop) из ответа multistatus, только свойства со статусом 200"""
+        for response in multistatus.findall(f'{{{DAV_NS}}}response'):
+            href = response.findtext(f'{{{DAV_NS}}}href', '').strip()
+            for propstat in response.findall(f'{{{DAV_NS}}}propstat'):
+                status = propstat.findtext(f'{{{DAV_NS}}}status', '')
+                prop = propstat.find(f'{{{DAV_NS}}}prop')
+                if ' 200 ' in status and prop is not None:
+                    yield href, prop
+    
+    def _find_href(self, access_token: str, url: str, ns: str, prop_name: str) -> Optional[str]:
+        """Значение свойства-ссылки (current-user-principal, calendar-home-set) ресурса url"""
+        prefix = 'C' if ns == CALDAV_NS else 'D'
+        body = (f'<?xml version="1.0" encoding="utf-8" ?>'
+                f'<D:propfind xmlns:D="{DAV_NS}" xmlns:C="{CALDAV_NS}">'
+                f'<D:prop><{prefix}:{prop_name}/></D:prop></D:propfind>')
+        multistatus = self._propfind(access_token, url, body)
+        if multistatus is None:
+            return None
+        for _, prop in self._found_props(multistatus):
+            href = prop.findtext(f'{{{ns}}}{prop_name}/{{{DAV_NS}}}href')
+            if href:
+                return urllib.parse.urljoin(url, href.strip())
+        return None
+    
+    def discover_collections(self, access_token: str) -> List[str]:
+        """Поиск коллекций с событиями (RFC 4791): principal -> calendar-home-set -> календари
+        
+        Returns:
+            Абсолютные адреса коллекций, поддерживающих VEVENT
+        
+        Raises:
+            CalDAVDiscoveryError: если коллекции найти не удалось
+            requests.RequestException: при сетевой ошибке
+        """
+        root_url = f"{self.API_BASE_URL}/"
+        principal_url = self._find_href(access_token, root_url, DAV_NS, 'current-user-principal')
+        if not principal_url:
+            raise CalDAVDiscoveryError("не удалось определить current-user-principal")
+        home_url = self._find_href(access_token, principal_url, CALDAV_NS, 'calendar-home-set')
+        if not home_url:
+            raise CalDAVDiscoveryError(f"не удалось определить calendar-home-set для {principal_url}")
+        
+        body = (f'<?xml version="1.0" encoding="utf-8" ?>'
+                f'<D:propfind xmlns:D="{DAV_NS}" xmlns:C="{CALDAV_NS}">'
+                f'<D:prop><D:resourcetype/><C:supported-calendar-component-set/></D:prop></D:propfind>')
+        multistatus = self._propfind(access_token, home_url, body, depth='1')
+        if multistatus is None:
+            raise CalDAVDiscoveryError(f"не удалось получить список календарей {home_url}")
+        
+        collections = []
+        for href, prop in self._found_props(multistatus):
+            if prop.find(f'{{{DAV_NS}}}resourcetype/{{{CALDAV_NS}}}calendar') is None:
+                continue
+            components = prop.find(f'{{{CALDAV_NS}}}supported-calendar-component-set')
+            if components is not None and len(components):
+                names = {comp.get('name') for comp in components.findall(f'{{{CALDAV_NS}}}comp')}
+                if 'VEVENT' not in names:
+                    continue  # Только задачи (VTODO)
+            url = urllib.parse.urljoin(home_url, href)
+            if url not in collections:
+                collections.append(url)
+        if not collections:
+            raise CalDAVDiscoveryError(f"в {home_url} нет календарей с событиями")
+        logger.info(f"Yandex CalDAV: найдено коллекций с событиями: {len(collections)}")
+        return collections
+    
     def get_upcoming_events(self, access_token: str,
                            time_min: datetime = None,
                            time_max: datetime = None,
                            max_results: int = 10) -> List[Dict]:
         """Получение предстоящих событий через CalDAV"""
-        import logging
-        logger = logging.getLogger(__name__)
-        
         try:
-            # Yandex Calendar использует CalDAV протокол
-            # Для работы с OAuth токеном используем ручную реализацию через requests
-            
-            if time_min is None:
-                time_min = datetime.utcnow()
-            if time_max is None:
-                time_max = time_min + timedelta(days=1)
-            
-            # Форматируем даты для CalDAV запроса (RFC 3339)
-            time_min_str = time_min.strftime('%Y%m%dT%H%M%SZ')
-            time_max_str = time_max.strftime('%Y%m%dT%H%M%SZ')
-            
-            # URL для CalDAV запроса событий
-            # Yandex использует стандартный CalDAV endpoint
-            # Пробуем несколько вариантов endpoints
-            caldav_urls = [
-                f"{self.API_BASE_URL}/events/",
-                f"{self.API_BASE_URL}/calendars/",
-                f"{self.API_BASE_URL}/",
-            ]
-            
-            # CalDAV REPORT запрос для получения событий в диапазоне дат
-            # Используем calendar-query для фильтрации по времени
-            caldav_query = f"""<?xml version="1.0" encoding="utf-8" ?>
+            events, _ = self.fetch_events(access_token, time_min, time_max, max_results)
+            return events
+        except Exception as e:
+            logger.error(f"Ошибка при получении событий Yandex Calendar: {e}", exc_info=True)
+            return []
+    
+    def fetch_events(self, access_token: str,
+                     time_min: datetime = None,
+                     time_max: datetime = None,
+                     max_results: int = 10,
+                     collections: Optional[List[str]] = None,
+                     discovery_error: Optional[CalDAVDiscoveryError] = None) -> Tuple[List[Dict], List[str]]:
+        """Получение событий из коллекций CalDAV
+        
+        Args:
+            collections: адреса коллекций, найденные ранее (None - выполнить поиск)
+            discovery_error: ошибка поиска, уже выполненного в этой синхронизации
+                (поиск не повторяется, события запрашиваются с прежних адресов)
+        
+        Returns:
+            Не более max_results событий с самым ранним началом (по возрастанию начала;
+            правила повторяющихся событий добавляются в конце) и актуальные адреса
+            коллекций. Если сохраненный адрес ответил 404/301, поиск выполняется
+            заново, и вызывающий должен сохранить новые адреса. Если поиск не удался,
+            события запрашиваются с прежних адресов (/events/, /calendars/, /), а
+            вместо адресов возвращается пустой список.
+        
+        Raises:
+            CalDAVDiscoveryError: если коллекции не найдены и прежние адреса не ответили
+            requests.RequestException: при сетевой ошибке
+        """
+        if time_min is None:
+            time_min = datetime.utcnow()
+        if time_max is None:
+            time_max = time_min + timedelta(days=1)
+        
+        caldav_query = self._calendar_query_body(time_min, time_max)
+        
+        logger.info(f"Yandex CalDAV: запрос событий с {time_min:%Y-%m-%d %H:%M} по {time_max:%Y-%m-%d %H:%M}")
+        
+        if not collections and discovery_error is None:
+            try:
+                collections = self.discover_collections(access_token)
+            except CalDAVDiscoveryError as e:
+                discovery_error = e
+        
+        events = []
+        for attempt in range(2):
+            if discovery_error is not None:
+                break
+            # Первые max_results событий по времени начала из всех коллекций
+            selector = EventSelector(max_results)
+            stale_url = None
+            for collection_url in collections:
+                status = self._query_collection(access_token, collection_url, caldav_query,
+                                                time_min, time_max, selector)
+                if status in _STALE_STATUSES and attempt == 0:
+                    stale_url = collection_url
+                    break
+            events = selector.result()
+            if stale_url is None:
+                break
+            # Календарь перемещен или удален: адреса устарели, ищем заново (один раз)
+            logger.info(f"Yandex CalDAV: коллекция {stale_url} недоступна, повторный поиск коллекций")
+            try:
+                collections = self.discover_collections(access_token)
+            except CalDAVDiscoveryError as e:
+                discovery_error = e
+        
+        if discovery_error is not None:
+            logger.warning(f"Yandex CalDAV: {discovery_error}. Пробуем прежние адреса.")
+            events = self._fetch_legacy_events(access_token, caldav_query, time_min, time_max, max_results)
+            if events is None:
+                raise discovery_error
+            collections = []
+        
+        logger.info(f"Yandex CalDAV: получено {len(events)} событий")
+        return events, collections
+    
+    def _fetch_legacy_events(self, access_token: str, caldav_query: str, time_min: datetime,
+                             time_max: datetime, max_results: int) -> Optional[List[Dict]]:
+        """События с прежних адресов (_LEGACY_COLLECTION_PATHS), если поиск коллекций не удался
+        
+        Returns:
+            События первого адреса, который их вернул; None, если ни один адрес не ответил 207
+        """
+        events = None
+        for path in _LEGACY_COLLECTION_PATHS:
+            selector = EventSelector(max_results)
+            try:
+                status = self._query_collection(access_token, f"{self.API_BASE_URL}{path}", caldav_query,
+                                                time_min, time_max, selector)
+            except requests.RequestException as e:
+                logger.debug(f"Ошибка при запросе к {self.API_BASE_URL}{path}: {e}")
+                continue
+            if status != 207:
+                continue
+            events = selector.result()
+            if events:
+                logger.info(f"Yandex CalDAV: события получены через {self.API_BASE_URL}{path}")
+                break
+        return events
+    
+    @staticmethod
+    def _calendar_query_body(time_min: datetime, time_max: datetime) -> str:
+        """Тело REPORT calendar-query: события в диапазоне дат с etag и calendar-data"""
+        # Форматируем даты для CalDAV запроса (RFC 3339)
+        time_min_str = time_min.strftime('%Y%m%dT%H%M%SZ')
+        time_max_str = time_max.strftime('%Y%m%dT%H%M%SZ')
+        return f"""<?xml version="1.0" encoding="utf-8" ?>
 <C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
     <D:prop>
         <D:getetag/>
@@ -187,198 +433,197 @@ class YandexCalendar:
         </C:comp-filter>
     </C:filter>
 </C:calendar-query>"""
-            
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/xml; charset=utf-8',
-                'Depth': '1'
-            }
-            
-            logger.info(f"Yandex CalDAV: запрос событий с {time_min_str} по {time_max_str}")
-            
-            # Пробуем разные endpoints
-            events = []
-            for caldav_url in caldav_urls:
-                try:
-                    logger.debug(f"Пробуем endpoint: {caldav_url}")
-                    # Выполняем REPORT запрос
-                    response = requests.request('REPORT', caldav_url, headers=headers, data=caldav_query, timeout=10)
-                    
-                    if response.status_code == 401:
-                        logger.warning(f"Yandex CalDAV: ошибка авторизации (401) для {caldav_url}")
-                        continue
-                    
-                    if response.status_code == 404:
-                        logger.debug(f"Yandex CalDAV: календарь не найден (404) для {caldav_url}")
-                        continue
-                    
-                    if response.status_code == 207:  # 207 Multi-Status - стандартный ответ CalDAV
-                        # Парсим ответ CalDAV (iCalendar формат)
-                        events = self._parse_caldav_response(response.text, time_min, time_max)
-                        if events:
-                            logger.info(f"Yandex CalDAV: успешно получены события через {caldav_url}")
-                            break
-                    
-                    if response.status_code not in [207, 401, 404]:
-                        logger.debug(f"Yandex CalDAV: статус {response.status_code} для {caldav_url}: {response.text[:200]}")
-                        
-                except Exception as e:
-                    logger.debug(f"Ошибка при запросе к {caldav_url}: {e}")
+    
+    def _report(self, access_token: str, url: str, body: str, depth: str = '1') -> requests.Response:
+        """REPORT-запрос к коллекции (без перехода по перенаправлениям)
+        
+        Тело ответа не загружается заранее: его читает _iter_multistatus по частям.
+        Ответ нужно закрыть (with).
+        """
+        headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/xml; charset=utf-8',
+            'Depth': depth
+        }
+        return self._request('REPORT', url, headers=headers, data=body.encode('utf-8'),
+                             allow_redirects=False, stream=True)
+    
+    @staticmethod
+    def _response_item(response: ET.Element) -> Dict:
+        """Элемент D:response: href, статус, etag и calendar-data"""
+        item = {
+            'href': urllib.parse.unquote(response.findtext(f'{{{DAV_NS}}}href', '').strip()),
+            'status': None,
+            'etag': None,
+            'calendar_data': None
+        }
+        status = response.findtext(f'{{{DAV_NS}}}status')
+        if status:
+            item['status'] = _status_code(status)
+        for propstat in response.findall(f'{{{DAV_NS}}}propstat'):
+            if _status_code(propstat.findtext(f'{{{DAV_NS}}}status', '')) != 200:
+                continue
+            item['status'] = item['status'] or 200
+            item['etag'] = propstat.findtext(f'{{{DAV_NS}}}prop/{{{DAV_NS}}}getetag') or item['etag']
+            item['calendar_data'] = (propstat.findtext(f'{{{DAV_NS}}}prop/{{{CALDAV_NS}}}calendar-data')
+                                     or item['calendar_data'])
+        return item
+    
+    def _iter_multistatus(self, response: requests.Response, meta: Optional[Dict] = None) -> Iterator[Dict]:
+        """Потоковый разбор ответа 207 Multi-Status
+        
+        Тело читается частями и разбирается инкрементальным XML-парсером; каждый
+        D:response выдается, как только он прочитан, и сразу удаляется из дерева,
+        поэтому память не растет с размером календаря.
+        
+        Args:
+            meta: сюда записывается sync-token ответа (sync-collection)
+        """
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        chunks = response.iter_content(chunk_size=_STREAM_CHUNK_SIZE)
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                parser.close()
+            else:
+                parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = element
                     continue
-            
-            # Если не получили события через CalDAV, пробуем альтернативный метод
-            if not events:
-                logger.warning("Yandex CalDAV: не удалось получить события через стандартный CalDAV. Пробуем альтернативный метод.")
-                events = self._get_events_alternative(access_token, time_min, time_max, max_results)
-            
-            logger.info(f"Yandex CalDAV: получено {len(events)} событий")
-            return events[:max_results]
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении событий Yandex Calendar: {e}", exc_info=True)
-            # Пробуем альтернативный подход при ошибке
-            try:
-                return self._get_events_alternative(access_token, time_min, time_max, max_results)
-            except Exception as e2:
-                logger.error(f"Альтернативный метод также не сработал: {e2}")
-                return []
+                if element.tag == _RESPONSE_TAG:
+                    item = self._response_item(element)
+                    # Прочитанные ответы больше не нужны
+                    root.clear()
+                    yield item
+                elif element.tag == _SYNC_TOKEN_TAG and element is not root and meta is not None:
+                    meta['sync_token'] = (element.text or '').strip()
     
-    def _get_events_alternative(self, access_token: str, time_min: datetime, time_max: datetime, max_results: int) -> List[Dict]:
-        """Альтернативный метод получения событий через библиотеку caldav"""
-        import logging
-        logger = logging.getLogger(__name__)
+    def get_sync_changes(self, access_token: str, collection_url: str,
+                         sync_token: Optional[str]) -> Optional[Dict]:
+        """Изменения коллекции с момента sync_token (RFC 6578 sync-collection)
+        
+        Без sync_token (или если сервер его больше не принимает) возвращается
+        полный список ресурсов коллекции с их etag.
+        
+        Returns:
+            Словарь с новым sync_token, etag измененных ресурсов (etags), удаленными
+            ресурсами (deleted) и признаком полного списка (initial); None, если
+            коллекция не поддерживает sync-collection или ее адрес устарел
+        """
+        collection_path = urllib.parse.urlparse(collection_url).path.rstrip('/')
+        initial = not sync_token
+        etags: Dict[str, str] = {}
+        deleted: List[str] = []
+        for _ in range(_MAX_SYNC_PAGES):
+            body = (f'<?xml version="1.0" encoding="utf-8" ?>'
+                    f'<D:sync-collection xmlns:D="{DAV_NS}">'
+                    f'<D:sync-token>{escape(sync_token or "")}</D:sync-token>'
+                    f'<D:sync-level>1</D:sync-level>'
+                    f'<D:prop><D:getetag/></D:prop></D:sync-collection>')
+            with self._report(access_token, collection_url, body, depth='0') as response:
+                if response.status_code in (403, 409) and b'valid-sync-token' in response.content and not initial:
+                    # Сервер забыл токен: начинаем заново с полного списка
+                    logger.info(f"Yandex CalDAV: sync-token для {collection_url} больше не действует")
+                    sync_token, initial = None, True
+                    etags, deleted = {}, []
+                    continue
+                if response.status_code != 207:
+                    logger.info(f"Yandex CalDAV: sync-collection для {collection_url} недоступен ({response.status_code})")
+                    return None
+                
+                meta = {}
+                truncated = False
+                for item in self._iter_multistatus(response, meta):
+                    href = item['href']
+                    if href.rstrip('/') == collection_path:
+                        # 507 у самой коллекции: ответ неполный, продолжаем с новым токеном
+                        truncated = item['status'] == 507
+                        continue
+                    if item['status'] == 404:
+                        etags.pop(href, None)
+                        deleted.append(href)
+                    elif item['etag']:
+                        etags[href] = item['etag']
+            sync_token = meta.get('sync_token') or sync_token
+            if not truncated:
+                break
         
+        return {'sync_token': sync_token, 'etags': etags, 'deleted': deleted, 'initial': initial}
+    
+    def _iter_resources(self, access_token: str, collection_url: str, body: str, report: str) -> Iterator[Dict]:
+        """Найденные ресурсы (href, etag, calendar_data) из ответа REPORT, по одному"""
+        with self._report(access_token, collection_url, body) as response:
+            if response.status_code != 207:
+                raise requests.HTTPError(f"{report} вернул {response.status_code}", response=response)
+            for item in self._iter_multistatus(response):
+                if item['status'] == 200 and item['calendar_data']:
+                    yield item
+    
+    def get_resources(self, access_token: str, collection_url: str, hrefs: List[str]) -> Iterator[Dict]:
+        """Загрузка ресурсов по href (calendar-multiget), пачками
+        
+        Returns:
+            Ответы с href, etag и calendar_data (только найденные ресурсы), по мере чтения
+        """
+        for start in range(0, len(hrefs), _MULTIGET_BATCH):
+            batch = hrefs[start:start + _MULTIGET_BATCH]
+            href_elements = ''.join(f'<D:href>{escape(urllib.parse.quote(href))}</D:href>' for href in batch)
+            body = (f'<?xml version="1.0" encoding="utf-8" ?>'
+                    f'<C:calendar-multiget xmlns:D="{DAV_NS}" xmlns:C="{CALDAV_NS}">'
+                    f'<D:prop><D:getetag/><C:calendar-data/></D:prop>{href_elements}'
+                    f'</C:calendar-multiget>')
+            yield from self._iter_resources(access_token, collection_url, body, 'calendar-multiget')
+    
+    def query_resources(self, access_token: str, collection_url: str,
+                        time_min: datetime, time_max: datetime) -> Iterator[Dict]:
+        """Ресурсы коллекции с событиями в диапазоне дат (calendar-query) с href и etag, по мере чтения"""
+        return self._iter_resources(access_token, collection_url,
+                                    self._calendar_query_body(time_min, time_max), 'calendar-query')
+    
+    def parse_resource(self, resource: Dict, time_min: datetime, time_max: datetime) -> Tuple[Optional[str], List[Dict]]:
+        """UID ресурса и его события в диапазоне дат
+        
+        UID берется из событий, разобранных ical_parser, поэтому совпадает с id
+        событий в кэше (свернутые строки, параметры свойства, экранирование). Ресурс
+        разбирается целиком: UID нужен и тогда, когда события вне диапазона.
+        """
         try:
-            # Пробуем использовать библиотеку caldav
-            import caldav
-            
-            # Для Yandex с OAuth нужно использовать специальный подход
-            # Yandex CalDAV может требовать логин пользователя вместо токена
-            # Пока возвращаем пустой список, так как нужна информация о пользователе
-            
-            logger.warning("Yandex CalDAV: альтернативный метод не реализован. Требуется информация о пользователе.")
-            return []
-            
-        except ImportError:
-            logger.warning("Библиотека caldav не установлена. Установите: pip install caldav")
-            return []
+            events = list(iter_events(resource['calendar_data']))
         except Exception as e:
-            logger.error(f"Ошибка в альтернативном методе: {e}")
-            return []
+            logger.error(f"Ошибка при парсинге CalDAV ответа: {e}", exc_info=True)
+            return None, []
+        uid = events[0]['id'] if events else None
+        return uid, [event for event in events if in_range(event, time_min, time_max)]
+    
+    def _query_collection(self, access_token: str, collection_url: str, caldav_query: str,
+                          time_min: datetime, time_max: datetime, selector: EventSelector) -> int:
+        """REPORT calendar-query к одной коллекции; события передаются в selector, возвращается статус ответа"""
+        # Перенаправление означает, что адрес устарел: обрабатываем его как повод для повторного поиска
+        with self._report(access_token, collection_url, caldav_query) as response:
+            if response.status_code == 207:  # 207 Multi-Status - стандартный ответ CalDAV
+                # calendar-data каждого ответа разбирается сразу, как только он прочитан;
+                # события, которые не войдут в max_results первых, не разбираются дальше DTSTART
+                for item in self._iter_multistatus(response):
+                    if not item['calendar_data']:
+                        continue
+                    try:
+                        for event in iter_events(item['calendar_data'], time_min, time_max, cutoff=selector.cutoff):
+                            selector.offer(event)
+                    except Exception as e:
+                        logger.error(f"Ошибка при парсинге CalDAV ответа: {e}", exc_info=True)
+                return 207
+            if response.status_code == 401:
+                logger.warning(f"Yandex CalDAV: ошибка авторизации (401) для {collection_url}")
+            else:
+                logger.debug(f"Yandex CalDAV: статус {response.status_code} для {collection_url}: {response.text[:200]}")
+            return response.status_code
     
     def _parse_caldav_response(self, ical_data: str, time_min: datetime, time_max: datetime) -> List[Dict]:
-        """Парсинг iCalendar данных из CalDAV ответа"""
-        import logging
-        import re
-        from dateutil import parser as date_parser
-        
-        logger = logging.getLogger(__name__)
-        events = []
-        
+        """Парсинг iCalendar данных из CalDAV ответа (потоковый разбор, см. ical_parser.py)"""
         try:
-            # Разделяем ответ на отдельные события (каждое событие в своем блоке)
-            # CalDAV возвращает несколько VCALENDAR блоков, каждый содержит VEVENT
-            
-            # Ищем все блоки VEVENT
-            vevent_pattern = r'BEGIN:VEVENT(.*?)END:VEVENT'
-            vevents = re.findall(vevent_pattern, ical_data, re.DOTALL)
-            
-            logger.debug(f"Найдено VEVENT блоков: {len(vevents)}")
-            
-            for vevent_text in vevents:
-                try:
-                    event_data = {}
-                    
-                    # Извлекаем основные поля
-                    # UID
-                    uid_match = re.search(r'UID:(.*?)(?:\r\n|\n)', vevent_text)
-                    if uid_match:
-                        event_data['id'] = uid_match.group(1).strip()
-                    else:
-                        continue  # Пропускаем события без UID
-                    
-                    # SUMMARY (название)
-                    summary_match = re.search(r'SUMMARY(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
-                    if summary_match:
-                        event_data['summary'] = summary_match.group(1).strip()
-                    else:
-                        event_data['summary'] = 'Без названия'
-                    
-                    # DESCRIPTION
-                    desc_match = re.search(r'DESCRIPTION(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text, re.DOTALL)
-                    if desc_match:
-                        # Убираем переносы строк и экранирование
-                        description = desc_match.group(1).strip()
-                        description = description.replace('\\n', '\n').replace('\\,', ',')
-                        event_data['description'] = description
-                    else:
-                        event_data['description'] = ''
-                    
-                    # LOCATION
-                    location_match = re.search(r'LOCATION(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
-                    if location_match:
-                        location = location_match.group(1).strip()
-                        location = location.replace('\\,', ',')
-                        event_data['location'] = location
-                    else:
-                        event_data['location'] = ''
-                    
-                    # DTSTART (время начала)
-                    dtstart_match = re.search(r'DTSTART(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
-                    if dtstart_match:
-                        dtstart_str = dtstart_match.group(1).strip()
-                        try:
-                            # Парсим формат iCalendar (YYYYMMDDTHHMMSS или YYYYMMDD)
-                            if 'T' in dtstart_str:
-                                if len(dtstart_str) == 15:  # YYYYMMDDTHHMMSS
-                                    start_dt = datetime.strptime(dtstart_str, '%Y%m%dT%H%M%S')
-                                elif len(dtstart_str) == 16 and dtstart_str.endswith('Z'):  # YYYYMMDDTHHMMSSZ
-                                    start_dt = datetime.strptime(dtstart_str, '%Y%m%dT%H%M%SZ')
-                                else:
-                                    start_dt = date_parser.parse(dtstart_str)
-                            else:
-                                # Только дата
-                                start_dt = datetime.strptime(dtstart_str, '%Y%m%d')
-                            event_data['start'] = start_dt
-                        except Exception as e:
-                            logger.warning(f"Ошибка парсинга DTSTART '{dtstart_str}': {e}")
-                            continue
-                    else:
-                        continue  # Пропускаем события без времени начала
-                    
-                    # DTEND (время окончания)
-                    dtend_match = re.search(r'DTEND(?:;.*?)?:(.*?)(?:\r\n|\n)', vevent_text)
-                    if dtend_match:
-                        dtend_str = dtend_match.group(1).strip()
-                        try:
-                            if 'T' in dtend_str:
-                                if len(dtend_str) == 15:
-                                    end_dt = datetime.strptime(dtend_str, '%Y%m%dT%H%M%S')
-                                elif len(dtend_str) == 16 and dtend_str.endswith('Z'):
-                                    end_dt = datetime.strptime(dtend_str, '%Y%m%dT%H%M%SZ')
-                                else:
-                                    end_dt = date_parser.parse(dtend_str)
-                            else:
-                                end_dt = datetime.strptime(dtend_str, '%Y%m%d')
-                            event_data['end'] = end_dt
-                        except Exception as e:
-                            logger.warning(f"Ошибка парсинга DTEND '{dtend_str}': {e}")
-                            # Если не удалось распарсить, используем start + 1 час
-                            event_data['end'] = event_data['start'] + timedelta(hours=1)
-                    else:
-                        # Если нет DTEND, используем start + 1 час
-                        event_data['end'] = event_data['start'] + timedelta(hours=1)
-                    
-                    # Фильтруем события по времени (на всякий случай, хотя фильтр уже в запросе)
-                    if time_min <= event_data['start'] <= time_max:
-                        events.append(event_data)
-                    
-                except Exception as e:
-                    logger.warning(f"Ошибка при парсинге события: {e}")
-                    continue
-            
-            return events
-            
+            return list(iter_events(ical_data, time_min, time_max))
         except Exception as e:
             logger.error(f"Ошибка при парсинге CalDAV ответа: {e}", exc_info=True)
             return []
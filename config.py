@@ -48,6 +48,11 @@ class Config:
     def get_google_redirect_uri():
         return Config._get_setting('google_redirect_uri', os.getenv('GOOGLE_REDIRECT_URI', 'http://localhost:5000/callback/google'))
     
+    @staticmethod
+    def get_google_push_url():
+        """Публичный HTTPS адрес /callback/google/push для push-уведомлений Google (пусто - только опрос)"""
+        return Config._get_setting('google_push_url', os.getenv('GOOGLE_PUSH_URL', ''))
+    
     GOOGLE_SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
     
     # Yandex Calendar - используем методы для чтения из БД
@@ -76,6 +81,59 @@ class Config:
     # Notifications
     NOTIFICATION_TIME_MINUTES = int(os.getenv('NOTIFICATION_TIME_MINUTES', '15'))
     CHECK_INTERVAL_MINUTES = int(os.getenv('CHECK_INTERVAL_MINUTES', '5'))
+    NOTIFICATION_ENGINE_ENABLED = os.getenv('NOTIFICATION_ENGINE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    NOTIFICATION_ENGINE_HORIZON_MINUTES = int(os.getenv('NOTIFICATION_ENGINE_HORIZON_MINUTES', '180'))  # На сколько вперед загружаются напоминания
+    NOTIFICATION_ENGINE_REFRESH_MINUTES = int(os.getenv('NOTIFICATION_ENGINE_REFRESH_MINUTES', '10'))  # Полная перезагрузка (страховка)
+    NOTIFICATION_ENGINE_POLL_SECONDS = int(os.getenv('NOTIFICATION_ENGINE_POLL_SECONDS', '5'))  # Проверка изменений напоминаний из других процессов
+    REMINDER_MAX_CATCHUP_MINUTES = int(os.getenv('REMINDER_MAX_CATCHUP_MINUTES', '120'))  # Напоминания, пропущенные при простое дольше, не отправляются
+    NOTIFICATION_DIGEST_WINDOW_SECONDS = int(os.getenv('NOTIFICATION_DIGEST_WINDOW_SECONDS', '60'))  # В дайджест попадают напоминания, наступающие в этом окне
+    JOB_LEASE_TTL_SECONDS = int(os.getenv('JOB_LEASE_TTL_SECONDS', '300'))  # Срок аренды периодической задачи; продлевается во время работы
+    
+    # Ограничение частоты запросов к Telegram (общее для уведомлений, рассылок и ответов бота)
+    TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))  # Сообщений в секунду на бота
+    TELEGRAM_SENDER_PROCESSES = int(os.getenv('TELEGRAM_SENDER_PROCESSES', '2'))  # Процессов, отправляющих сообщения (веб-приложение и бот): каждому - равная доля TELEGRAM_GLOBAL_RATE
+    TELEGRAM_PER_CHAT_RATE = float(os.getenv('TELEGRAM_PER_CHAT_RATE', '1'))  # Сообщений в секунду в один личный чат
+    TELEGRAM_GROUP_CHAT_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_CHAT_PER_MINUTE', '20'))  # Сообщений в минуту в одну группу
+    TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '2'))  # Повторов запроса после RetryAfter
+    TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '16'))  # Соединений в пуле общего клиента Telegram
+    TELEGRAM_HTTP_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_TIMEOUT', '10'))  # Таймаут HTTP-запросов к Bot API, секунды
+    
+    # HTTP-клиент Yandex (CalDAV и OAuth)
+    YANDEX_POOL_SIZE = int(os.getenv('YANDEX_POOL_SIZE', '10'))  # Соединений keep-alive на хост
+    YANDEX_HTTP_TIMEOUT = float(os.getenv('YANDEX_HTTP_TIMEOUT', '10'))  # Таймаут HTTP-запросов, секунды
+    YANDEX_HTTP_RETRIES = int(os.getenv('YANDEX_HTTP_RETRIES', '3'))  # Повторов при сетевых ошибках и ответах 429/5xx
+    
+    # Очередь исходящих уведомлений (outbox)
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '25'))  # Уведомлений за один проход
+    OUTBOX_POLL_SECONDS = int(os.getenv('OUTBOX_POLL_SECONDS', '30'))  # Период проверки очереди
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))  # После стольких ошибок уведомление считается недоставляемым
+    OUTBOX_RETRY_BASE_SECONDS = int(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '30'))  # Пауза после первой ошибки, дальше удваивается
+    OUTBOX_RETRY_MAX_SECONDS = int(os.getenv('OUTBOX_RETRY_MAX_SECONDS', '3600'))
+    OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '120'))  # Блокировка захваченных уведомлений
+    
+    # Синхронизация календарей
+    SYNC_INTERVAL_MINUTES = int(os.getenv('SYNC_INTERVAL_MINUTES', '15'))  # Начальный интервал между синхронизациями подключения
+    SYNC_MIN_INTERVAL_MINUTES = int(os.getenv('SYNC_MIN_INTERVAL_MINUTES', '5'))  # Для календарей с недавними изменениями
+    SYNC_MAX_INTERVAL_MINUTES = int(os.getenv('SYNC_MAX_INTERVAL_MINUTES', '240'))  # Для календарей без изменений
+    SYNC_TICK_MINUTES = int(os.getenv('SYNC_TICK_MINUTES', '1'))  # Как часто планировщик ищет подключения к синхронизации
+    SYNC_MAX_BACKOFF_MINUTES = int(os.getenv('SYNC_MAX_BACKOFF_MINUTES', '360'))  # Максимальная пауза после серии ошибок
+    SYNC_DEBOUNCE_SECONDS = float(os.getenv('SYNC_DEBOUNCE_SECONDS', '2'))  # Задержка внеочередной синхронизации после подключения
+    RECURRENCE_HORIZON_DAYS = int(os.getenv('RECURRENCE_HORIZON_DAYS', '7'))  # На сколько дней вперед разворачиваются повторяющиеся события
+    GOOGLE_FETCH_CONCURRENCY = int(os.getenv('GOOGLE_FETCH_CONCURRENCY', '4'))  # Одновременных загрузок календарей Google в процессе
+    YANDEX_FETCH_CONCURRENCY = int(os.getenv('YANDEX_FETCH_CONCURRENCY', '4'))  # Одновременных загрузок коллекций Yandex CalDAV в процессе
+    GOOGLE_WATCH_TTL_HOURS = int(os.getenv('GOOGLE_WATCH_TTL_HOURS', '168'))  # Запрашиваемый срок канала push-уведомлений Google
+    GOOGLE_WATCH_RENEW_HOURS = int(os.getenv('GOOGLE_WATCH_RENEW_HOURS', '24'))  # За сколько часов до истечения канал продлевается
+    GOOGLE_CALENDAR_LIST_REFRESH_HOURS = int(os.getenv('GOOGLE_CALENDAR_LIST_REFRESH_HOURS', '24'))  # Как часто заново запрашивается список календарей Google
+    
+    @staticmethod
+    def is_sync_staggered() -> bool:
+        """Распределять ли синхронизацию подключений по шагам планировщика (из БД или .env)"""
+        return Config._get_setting('sync_staggered', os.getenv('SYNC_STAGGERED', 'false')).lower() in ('1', 'true', 'yes')
+    
+    @staticmethod
+    def is_notification_digest_enabled() -> bool:
+        """Объединять ли напоминания пользователя в одно сообщение-дайджест (из БД или .env)"""
+        return Config._get_setting('notification_digest', os.getenv('NOTIFICATION_DIGEST', 'false')).lower() in ('1', 'true', 'yes')
     
     @staticmethod
     def validate():
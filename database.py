@@ -1,10 +1,17 @@
 """Работа с базой данных"""
 import sqlite3
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict
 from contextlib import contextmanager
 
+def to_timestamp(value: datetime) -> int:
+    """Преобразование datetime в unix time (наивное время считается UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
 class Database:
     """Класс для работы с базой данных"""
     
@@ -65,6 +72,19 @@ class Database:
                 )
             ''')
             
+            # Найденные коллекции подключения (JSON-список, для существующих БД): адреса CalDAV
+            # из PROPFIND для Yandex, id выбранных календарей из calendarList для Google,
+            # и время, когда список был получен
+            try:
+                cursor.execute('ALTER TABLE calendar_connections RENAME COLUMN caldav_collections TO collections')
+            except sqlite3.OperationalError:
+                pass  # Прежней колонки нет
+            for column, column_type in (('collections', 'TEXT'), ('collections_checked_at', 'INTEGER')):
+                try:
+                    cursor.execute(f'ALTER TABLE calendar_connections ADD COLUMN {column} {column_type}')
+                except sqlite3.OperationalError:
+                    pass  # Колонка уже существует
+            
             # Таблица настроек уведомлений
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS notification_settings (
@@ -163,11 +183,192 @@ class Database:
                 )
             ''')
             
+            # Таблица состояния синхронизации (одна строка на подключение календаря)
+            # Все отметки времени хранятся в секундах unix time (UTC)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    last_attempt_at INTEGER,
+                    last_success_at INTEGER,
+                    last_duration_ms INTEGER,
+                    last_change_count INTEGER DEFAULT 0,
+                    error_streak INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    next_due_at INTEGER NOT NULL DEFAULT 0,
+                    interval_seconds INTEGER,
+                    last_change_at INTEGER,
+                    next_event_at INTEGER,
+                    PRIMARY KEY (user_id, calendar_type),
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                )
+            ''')
+            
+            # Колонки адаптивного расписания (для существующих БД)
+            for column in ('interval_seconds', 'last_change_at', 'next_event_at'):
+                try:
+                    cursor.execute(f'ALTER TABLE sync_state ADD COLUMN {column} INTEGER')
+                except sqlite3.OperationalError:
+                    pass  # Колонка уже существует
+            
+            # Таблица напоминаний: одна строка на (пользователь, событие, интервал уведомления)
+            # fire_at и event_start хранятся в секундах unix time (UTC)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    cached_event_id INTEGER NOT NULL,
+                    event_start INTEGER NOT NULL,
+                    offset_minutes INTEGER NOT NULL,
+                    fire_at INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',  -- pending, sent, expired
+                    sent_at INTEGER,
+                    FOREIGN KEY (user_id) REFERENCES users(user_id),
+                    UNIQUE(user_id, calendar_type, event_id, event_start, offset_minutes)
+                )
+            ''')
+            
+            # Последнее изменение напоминаний пользователя: seq растет при каждом изменении,
+            # поэтому движок уведомлений в другом процессе находит измененных пользователей
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS reminder_changes (
+                    user_id INTEGER PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                )
+            ''')
+            
+            # Очередь исходящих уведомлений (outbox)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS notification_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    dedup_key TEXT UNIQUE,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',  -- pending, delivered, dead, expired
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at INTEGER NOT NULL,
+                    locked_until INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    created_at INTEGER NOT NULL,
+                    delivered_at INTEGER,
+                    deadline_at INTEGER,  -- после этого времени уведомление не отправляется
+                    FOREIGN KEY (user_id) REFERENCES users(user_id)
+                )
+            ''')
+            try:
+                cursor.execute('ALTER TABLE notification_outbox ADD COLUMN deadline_at INTEGER')
+            except sqlite3.OperationalError:
+                pass  # Колонка уже существует
+            
+            # Аренды (leases) периодических задач: задачу выполняет только один процесс
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS job_leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    fencing_token INTEGER NOT NULL,
+                    acquired_at INTEGER NOT NULL,
+                    expires_at INTEGER NOT NULL
+                )
+            ''')
+            
+            # Состояние инкрементальной синхронизации CalDAV (RFC 6578) по коллекциям:
+            # sync-token и граница уже загруженного диапазона дат (unix time)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS caldav_sync_state (
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    collection_url TEXT NOT NULL,
+                    sync_token TEXT,
+                    window_end INTEGER,
+                    updated_at INTEGER,
+                    PRIMARY KEY (user_id, calendar_type, collection_url)
+                )
+            ''')
+            
+            # ETag и UID каждого ресурса коллекции CalDAV: неизмененные ресурсы не загружаются повторно
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS caldav_resources (
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    collection_url TEXT NOT NULL,
+                    href TEXT NOT NULL,
+                    etag TEXT,
+                    uid TEXT,
+                    PRIMARY KEY (user_id, calendar_type, href)
+                )
+            ''')
+            
+            # Результат последней загрузки каждой коллекции подключения (календаря Google
+            # или коллекции CalDAV): ошибка одной коллекции не мешает синхронизации остальных
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS collection_sync_state (
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    collection_id TEXT NOT NULL,
+                    last_attempt_at INTEGER,
+                    last_success_at INTEGER,
+                    last_event_count INTEGER,
+                    error_streak INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    etag TEXT,  -- ETag последнего ответа (Google events.list)
+                    etag_query TEXT,  -- параметры запроса, к которому относится etag
+                    PRIMARY KEY (user_id, calendar_type, collection_id)
+                )
+            ''')
+            for column in ('etag', 'etag_query'):
+                try:
+                    cursor.execute(f'ALTER TABLE collection_sync_state ADD COLUMN {column} TEXT')
+                except sqlite3.OperationalError:
+                    pass  # Колонка уже существует
+            
+            # Правила повторяющихся событий (RRULE): экземпляры разворачиваются локально,
+            # в cached_events попадают только экземпляры на ближайший горизонт
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS recurring_events (
+                    user_id INTEGER NOT NULL,
+                    calendar_type TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    summary TEXT,
+                    description TEXT,
+                    location TEXT,
+                    html_link TEXT,
+                    rule TEXT NOT NULL,  -- JSON: RRULE, начало, часовой пояс, длительность, RDATE/EXDATE
+                    updated_at INTEGER,
+                    PRIMARY KEY (user_id, calendar_type, event_id)
+                )
+            ''')
+            
+            # Каналы push-уведомлений Google (events.watch) по календарям подключения
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS google_watch_channels (
+                    channel_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    calendar_id TEXT NOT NULL,
+                    resource_id TEXT,
+                    token TEXT NOT NULL,
+                    expiration INTEGER NOT NULL,  -- unix time истечения канала
+                    created_at INTEGER
+                )
+            ''')
+            
+            # Подключения, у которых еще нет состояния, синхронизируются сразу
+            cursor.execute('''
+                INSERT OR IGNORE INTO sync_state (user_id, calendar_type, next_due_at)
+                SELECT user_id, calendar_type, 0 FROM calendar_connections
+            ''')
+            
             # Индексы для быстрого поиска
             try:
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_cached_events_user_calendar ON cached_events(user_id, calendar_type)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_cached_events_start_time ON cached_events(start_time)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_cached_events_user_start ON cached_events(user_id, start_time)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_state_next_due ON sync_state(next_due_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_status_fire ON reminders(status, fire_at)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders(user_id, calendar_type, status)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_reminder_changes_seq ON reminder_changes(seq)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON notification_outbox(status, next_attempt_at)')
             except sqlite3.OperationalError:
                 pass  # Индексы уже существуют
     
@@ -185,16 +386,36 @@ class Database:
                                  token_expires_at: Optional[datetime] = None,
                                  calendar_id: Optional[str] = None,
                                  calendar_name: Optional[str] = None):
-        """Сохранение подключения к календарю"""
+        """Сохранение подключения к календарю
+        
+        Найденные адреса коллекций CalDAV сохраняются при обновлении токена
+        и сбрасываются, если подключен другой аккаунт (сменился refresh token).
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT OR REPLACE INTO calendar_connections 
+                INSERT INTO calendar_connections 
                 (user_id, calendar_type, access_token, refresh_token, 
                  token_expires_at, calendar_id, calendar_name)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type) DO UPDATE SET
+                    access_token = excluded.access_token,
+                    refresh_token = excluded.refresh_token,
+                    token_expires_at = excluded.token_expires_at,
+                    calendar_id = excluded.calendar_id,
+                    calendar_name = excluded.calendar_name,
+                    collections = CASE
+                        WHEN calendar_connections.refresh_token IS excluded.refresh_token
+                        THEN calendar_connections.collections
+                    END
             ''', (user_id, calendar_type, access_token, refresh_token,
                   token_expires_at, calendar_id, calendar_name))
+            # Новое подключение сразу становится готовым к синхронизации,
+            # обновление токена существующего подключения расписание не сбрасывает
+            cursor.execute('''
+                INSERT OR IGNORE INTO sync_state (user_id, calendar_type, next_due_at)
+                VALUES (?, ?, 0)
+            ''', (user_id, calendar_type))
     
     def get_calendar_connection(self, user_id: int, calendar_type: str) -> Optional[Dict]:
         """Получение подключения к календарю"""
@@ -209,6 +430,25 @@ class Database:
                 return dict(row)
             return None
     
+    def save_collections(self, user_id: int, calendar_type: str, collections: Optional[List[str]],
+                         checked_at: Optional[int] = None):
+        """Сохранение найденных коллекций подключения (None - сбросить и искать заново)
+        
+        Args:
+            checked_at: время получения списка (unix time), по умолчанию - текущее
+        """
+        if collections is None:
+            checked_at = None
+        elif checked_at is None:
+            checked_at = int(time.time())
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calendar_connections SET collections = ?, collections_checked_at = ?
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (json.dumps(collections) if collections is not None else None, checked_at,
+                  user_id, calendar_type))
+    
     def get_user_calendars(self, user_id: int) -> List[Dict]:
         """Получение всех календарей пользователя"""
         with self.get_connection() as conn:
@@ -228,6 +468,23 @@ class Database:
                 DELETE FROM calendar_connections
                 WHERE user_id = ? AND calendar_type = ?
             ''', (user_id, calendar_type))
+            cursor.execute('''
+                DELETE FROM sync_state
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (user_id, calendar_type))
+            cursor.execute('''
+                DELETE FROM reminders
+                WHERE user_id = ? AND calendar_type = ? AND status = 'pending'
+            ''', (user_id, calendar_type))
+            self._mark_reminders_changed(cursor, user_id)
+            for table in ('caldav_sync_state', 'caldav_resources', 'recurring_events', 'collection_sync_state'):
+                cursor.execute(f'''
+                    DELETE FROM {table}
+                    WHERE user_id = ? AND calendar_type = ?
+                ''', (user_id, calendar_type))
+            if calendar_type == 'google':
+                # Уведомления каналов, которые Google еще не закрыл, будут игнорироваться
+                cursor.execute('DELETE FROM google_watch_channels WHERE user_id = ?', (user_id,))
     
     def update_notification_settings(self, user_id: int, notification_minutes: int, enabled: bool = True):
         """Обновление настроек уведомлений"""
@@ -238,6 +495,8 @@ class Database:
                 (user_id, notification_minutes, enabled)
                 VALUES (?, ?, ?)
             ''', (user_id, notification_minutes, enabled))
+        # Напоминания зависят от настроек, поэтому пересчитываем их сразу
+        self.rebuild_reminders(user_id)
     
     def get_notification_settings(self, user_id: int) -> Dict:
         """Получение настроек уведомлений"""
@@ -477,6 +736,63 @@ class Database:
                 results.append(result)
             return results
     
+    def claim_broadcast(self, broadcast_id: int) -> bool:
+        """Атомарный перевод рассылки из pending в sending
+        
+        Returns:
+            True, если рассылку взял в работу вызывающий (а не другой процесс)
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcasts
+                SET status = 'sending', started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
+            ''', (broadcast_id,))
+            return cursor.rowcount == 1
+    
+    def release_broadcast(self, broadcast_id: int):
+        """Возврат незавершенной рассылки из sending в pending (ее продолжит другой процесс)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcasts SET status = 'pending'
+                WHERE id = ? AND status = 'sending'
+            ''', (broadcast_id,))
+    
+    def finish_broadcast_fenced(self, broadcast_id: int, status: str, sent_count: int, failed_count: int,
+                                lease_name: str, fencing_token: int, now_ts: int) -> bool:
+        """Завершение рассылки, только если аренда с fencing_token еще действует
+        
+        Returns:
+            False, если аренда истекла и статус не изменен
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM job_leases
+                WHERE name = ? AND fencing_token = ? AND expires_at > ?
+            ''', (lease_name, fencing_token, now_ts))
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute('''
+                UPDATE broadcasts
+                SET status = ?, completed_at = CURRENT_TIMESTAMP,
+                    sent_count = ?, failed_count = ?
+                WHERE id = ? AND status = 'sending'
+            ''', (status, sent_count, failed_count, broadcast_id))
+            return True
+    
+    def get_broadcast_processed_users(self, broadcast_id: int) -> Dict[int, str]:
+        """Пользователи, которым рассылка уже обработана: user_id -> статус (sent, failed, skipped)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, status FROM broadcast_history
+                WHERE broadcast_id = ?
+            ''', (broadcast_id,))
+            return {row['user_id']: row['status'] for row in cursor.fetchall()}
+    
     def update_broadcast_status(self, broadcast_id: int, status: str, 
                                sent_count: int = 0, failed_count: int = 0):
         """Обновление статуса рассылки"""
@@ -648,6 +964,28 @@ class Database:
             ''', (user_id, calendar_type, before_date))
             return cursor.rowcount
     
+    def delete_cached_events(self, event_ids: List[int]) -> int:
+        """Удаление событий из кэша по id строк"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM cached_events WHERE id = ?', [(event_id,) for event_id in event_ids])
+            return cursor.rowcount
+    
+    def get_next_event_start(self, user_id: int, calendar_type: str, after: datetime) -> Optional[int]:
+        """Начало ближайшего события календаря после after (unix time)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Время событий Google хранится со смещением часового пояса, поэтому строки
+            # сравниваются с запасом в сутки, а точное сравнение выполняется в unix time
+            cursor.execute('''
+                SELECT start_time FROM cached_events
+                WHERE user_id = ? AND calendar_type = ? AND start_time > ?
+            ''', (user_id, calendar_type, after - timedelta(days=1)))
+            after_ts = to_timestamp(after)
+            starts = [to_timestamp(datetime.fromisoformat(row['start_time'].replace('Z', '+00:00')))
+                      for row in cursor.fetchall()]
+            return min((start for start in starts if start > after_ts), default=None)
+    
     def clear_user_events(self, user_id: int, calendar_type: str):
         """Очистка всех событий пользователя для конкретного календаря"""
         with self.get_connection() as conn:
@@ -701,4 +1039,754 @@ class Database:
                     result['end'] = end_time
                 results.append(result)
             return results
-
+    
+    # Методы для работы с состоянием синхронизации
+    def get_due_sync_connections(self, now_ts: int, limit: Optional[int] = None) -> List[Dict]:
+        """Получение подключений, срок синхронизации которых наступил (по индексу next_due_at)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            query = '''
+                SELECT cc.*, ss.next_due_at, ss.error_streak, ss.last_success_at,
+                       ss.interval_seconds, ss.last_change_at, ss.next_event_at,
+                       COALESCE(ns.notification_minutes, 15) as notification_minutes
+                FROM sync_state ss
+                JOIN calendar_connections cc ON cc.user_id = ss.user_id
+                    AND cc.calendar_type = ss.calendar_type
+                LEFT JOIN notification_settings ns ON ns.user_id = ss.user_id
+                WHERE ss.next_due_at <= ?
+                ORDER BY ss.next_due_at ASC
+            '''
+            params = [now_ts]
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_all_sync_connections(self) -> List[Dict]:
+        """Получение всех подключений вместе с состоянием синхронизации"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT cc.*, ss.next_due_at, ss.error_streak, ss.last_success_at,
+                       ss.interval_seconds, ss.last_change_at, ss.next_event_at,
+                       COALESCE(ns.notification_minutes, 15) as notification_minutes
+                FROM calendar_connections cc
+                LEFT JOIN sync_state ss ON cc.user_id = ss.user_id
+                    AND cc.calendar_type = ss.calendar_type
+                LEFT JOIN notification_settings ns ON ns.user_id = cc.user_id
+                ORDER BY ss.next_due_at ASC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_sync_connection(self, user_id: int, calendar_type: str) -> Optional[Dict]:
+        """Получение подключения вместе с состоянием синхронизации"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT cc.*, ss.next_due_at, ss.error_streak, ss.last_success_at,
+                       ss.interval_seconds, ss.last_change_at, ss.next_event_at,
+                       COALESCE(ns.notification_minutes, 15) as notification_minutes
+                FROM calendar_connections cc
+                LEFT JOIN sync_state ss ON cc.user_id = ss.user_id
+                    AND cc.calendar_type = ss.calendar_type
+                LEFT JOIN notification_settings ns ON ns.user_id = cc.user_id
+                WHERE cc.user_id = ? AND cc.calendar_type = ?
+            ''', (user_id, calendar_type))
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+            return None
+    
+    def get_sync_state(self, user_id: int, calendar_type: str) -> Optional[Dict]:
+        """Получение состояния синхронизации подключения"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM sync_state
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (user_id, calendar_type))
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+            return None
+    
+    def get_sync_states(self) -> List[Dict]:
+        """Получение состояния синхронизации всех подключений (для админ панели)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT ss.*, u.username, u.first_name, cc.calendar_name
+                FROM sync_state ss
+                JOIN calendar_connections cc ON cc.user_id = ss.user_id
+                    AND cc.calendar_type = ss.calendar_type
+                LEFT JOIN users u ON ss.user_id = u.user_id
+                ORDER BY ss.next_due_at ASC
+            ''')
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def record_sync_success(self, user_id: int, calendar_type: str, started_at: int,
+                            duration_ms: int, change_count: int, next_due_at: int,
+                            interval_seconds: Optional[int] = None,
+                            next_event_at: Optional[int] = None):
+        """Запись успешной синхронизации подключения"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            last_change_at = started_at if change_count else None
+            cursor.execute('''
+                INSERT INTO sync_state
+                (user_id, calendar_type, last_attempt_at, last_success_at, last_duration_ms,
+                 last_change_count, error_streak, last_error, next_due_at,
+                 interval_seconds, last_change_at, next_event_at)
+                VALUES (?, ?, ?, ?, ?, ?, 0, NULL, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type) DO UPDATE SET
+                    last_attempt_at = excluded.last_attempt_at,
+                    last_success_at = excluded.last_success_at,
+                    last_duration_ms = excluded.last_duration_ms,
+                    last_change_count = excluded.last_change_count,
+                    error_streak = 0,
+                    last_error = NULL,
+                    next_due_at = excluded.next_due_at,
+                    interval_seconds = excluded.interval_seconds,
+                    last_change_at = COALESCE(excluded.last_change_at, sync_state.last_change_at),
+                    next_event_at = excluded.next_event_at
+            ''', (user_id, calendar_type, started_at, started_at, duration_ms,
+                  change_count, next_due_at, interval_seconds, last_change_at, next_event_at))
+    
+    def record_sync_failure(self, user_id: int, calendar_type: str, started_at: int,
+                            duration_ms: int, error: str, next_due_at: int):
+        """Запись неудачной синхронизации подключения (увеличивает серию ошибок)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO sync_state
+                (user_id, calendar_type, last_attempt_at, last_duration_ms,
+                 error_streak, last_error, next_due_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT(user_id, calendar_type) DO UPDATE SET
+                    last_attempt_at = excluded.last_attempt_at,
+                    last_duration_ms = excluded.last_duration_ms,
+                    error_streak = sync_state.error_streak + 1,
+                    last_error = excluded.last_error,
+                    next_due_at = excluded.next_due_at
+            ''', (user_id, calendar_type, started_at, duration_ms, error, next_due_at))
+    
+    # Методы для инкрементальной синхронизации CalDAV
+    def get_caldav_sync_states(self, user_id: int, calendar_type: str) -> Dict[str, Dict]:
+        """Состояние синхронизации коллекций подключения (ключ - адрес коллекции)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM caldav_sync_state
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (user_id, calendar_type))
+            return {row['collection_url']: dict(row) for row in cursor.fetchall()}
+    
+    def get_caldav_resources(self, user_id: int, calendar_type: str, collection_url: str) -> Dict[str, Dict]:
+        """ETag и UID ресурсов коллекции (ключ - href)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT href, etag, uid FROM caldav_resources
+                WHERE user_id = ? AND calendar_type = ? AND collection_url = ?
+            ''', (user_id, calendar_type, collection_url))
+            return {row['href']: {'etag': row['etag'], 'uid': row['uid']} for row in cursor.fetchall()}
+    
+    def save_caldav_sync(self, user_id: int, calendar_type: str, collection_url: str,
+                         sync_token: Optional[str], window_end: int,
+                         resources: List[tuple], deleted_hrefs: List[str], reset: bool = False):
+        """Сохранение результата синхронизации коллекции одной транзакцией
+        
+        Args:
+            resources: кортежи (href, etag, uid); uid None не затирает известный UID
+            deleted_hrefs: удаленные ресурсы
+            reset: полная синхронизация - прежний список ресурсов коллекции заменяется
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if reset:
+                cursor.execute('''
+                    DELETE FROM caldav_resources
+                    WHERE user_id = ? AND calendar_type = ? AND collection_url = ?
+                ''', (user_id, calendar_type, collection_url))
+            cursor.executemany('''
+                DELETE FROM caldav_resources
+                WHERE user_id = ? AND calendar_type = ? AND href = ?
+            ''', [(user_id, calendar_type, href) for href in deleted_hrefs])
+            cursor.executemany('''
+                INSERT INTO caldav_resources (user_id, calendar_type, collection_url, href, etag, uid)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type, href) DO UPDATE SET
+                    collection_url = excluded.collection_url,
+                    etag = excluded.etag,
+                    uid = COALESCE(excluded.uid, caldav_resources.uid)
+            ''', [(user_id, calendar_type, collection_url, href, etag, uid) for href, etag, uid in resources])
+            cursor.execute('''
+                INSERT INTO caldav_sync_state (user_id, calendar_type, collection_url, sync_token, window_end, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type, collection_url) DO UPDATE SET
+                    sync_token = excluded.sync_token,
+                    window_end = excluded.window_end,
+                    updated_at = excluded.updated_at
+            ''', (user_id, calendar_type, collection_url, sync_token, window_end,
+                  to_timestamp(datetime.utcnow())))
+    
+    def delete_stale_caldav_collections(self, user_id: int, calendar_type: str, collection_urls: List[str]):
+        """Удаление состояния коллекций, которых больше нет среди collection_urls"""
+        placeholders = ','.join('?' * len(collection_urls)) or "''"
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for table in ('caldav_sync_state', 'caldav_resources'):
+                cursor.execute(f'''
+                    DELETE FROM {table}
+                    WHERE user_id = ? AND calendar_type = ? AND collection_url NOT IN ({placeholders})
+                ''', [user_id, calendar_type, *collection_urls])
+    
+    # Методы для состояния коллекций подключения
+    def get_collection_states(self, user_id: int, calendar_type: str) -> Dict[str, Dict]:
+        """Результаты последней загрузки коллекций подключения (ключ - id коллекции)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM collection_sync_state
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (user_id, calendar_type))
+            return {row['collection_id']: dict(row) for row in cursor.fetchall()}
+    
+    def record_collection_results(self, user_id: int, calendar_type: str, results: List[tuple],
+                                  collection_ids: List[str], now_ts: int,
+                                  etags: Optional[Dict[str, tuple]] = None):
+        """Запись результатов загрузки коллекций одной транзакцией
+        
+        Args:
+            results: кортежи (id коллекции, текст ошибки или None, количество полученных событий;
+                None - коллекция не изменилась)
+            collection_ids: все коллекции подключения - состояние остальных удаляется
+            etags: ETag ответа и параметры запроса по id коллекции (для условных запросов)
+        """
+        etags = etags or {}
+        placeholders = ','.join('?' * len(collection_ids)) or "''"
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                DELETE FROM collection_sync_state
+                WHERE user_id = ? AND calendar_type = ? AND collection_id NOT IN ({placeholders})
+            ''', [user_id, calendar_type, *collection_ids])
+            cursor.executemany('''
+                INSERT INTO collection_sync_state
+                (user_id, calendar_type, collection_id, last_attempt_at, last_success_at,
+                 last_event_count, error_streak, last_error, etag, etag_query)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type, collection_id) DO UPDATE SET
+                    last_attempt_at = excluded.last_attempt_at,
+                    last_success_at = COALESCE(excluded.last_success_at, collection_sync_state.last_success_at),
+                    last_event_count = COALESCE(excluded.last_event_count, collection_sync_state.last_event_count),
+                    error_streak = CASE WHEN excluded.last_error IS NULL THEN 0
+                                        ELSE collection_sync_state.error_streak + 1 END,
+                    last_error = excluded.last_error,
+                    etag = CASE WHEN excluded.last_error IS NULL THEN excluded.etag
+                                ELSE collection_sync_state.etag END,
+                    etag_query = CASE WHEN excluded.last_error IS NULL THEN excluded.etag_query
+                                      ELSE collection_sync_state.etag_query END
+            ''', [(user_id, calendar_type, collection_id, now_ts, None if error else now_ts,
+                   None if error else event_count, 1 if error else 0, error,
+                   *etags.get(collection_id, (None, None)))
+                  for collection_id, error, event_count in results])
+    
+    # Методы для каналов push-уведомлений Google
+    def get_google_watch_channel(self, channel_id: str) -> Optional[Dict]:
+        """Канал push-уведомлений по id канала"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM google_watch_channels WHERE channel_id = ?', (channel_id,))
+            row = cursor.fetchone()
+            if row:
+                return dict(row)
+            return None
+    
+    def get_google_watch_channels(self, user_id: int) -> List[Dict]:
+        """Каналы push-уведомлений подключения Google"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM google_watch_channels
+                WHERE user_id = ?
+                ORDER BY expiration ASC
+            ''', (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def save_google_watch_channel(self, channel_id: str, user_id: int, calendar_id: str,
+                                  resource_id: Optional[str], token: str, expiration: int, now_ts: int):
+        """Сохранение зарегистрированного канала push-уведомлений"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO google_watch_channels
+                (channel_id, user_id, calendar_id, resource_id, token, expiration, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (channel_id, user_id, calendar_id, resource_id, token, expiration, now_ts))
+    
+    def delete_google_watch_channel(self, channel_id: str):
+        """Удаление канала push-уведомлений"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM google_watch_channels WHERE channel_id = ?', (channel_id,))
+    
+    # Методы для повторяющихся событий
+    def get_recurring_events(self, user_id: int, calendar_type: str) -> List[Dict]:
+        """Сохраненные повторяющиеся события подключения (rule - словарь правила)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM recurring_events
+                WHERE user_id = ? AND calendar_type = ?
+            ''', (user_id, calendar_type))
+            results = []
+            for row in cursor.fetchall():
+                result = dict(row)
+                result['rule'] = json.loads(result['rule'])
+                results.append(result)
+            return results
+    
+    def save_recurring_events(self, user_id: int, calendar_type: str, series: List[Dict],
+                              removed_ids: List[str], replace_all: bool = False):
+        """Сохранение повторяющихся событий одной транзакцией
+        
+        Args:
+            series: события с ключами event_id, summary, description, location, html_link, rule
+            removed_ids: события, которые больше не повторяются или удалены
+            replace_all: полная синхронизация - прежний список повторяющихся событий заменяется
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if replace_all:
+                cursor.execute('''
+                    DELETE FROM recurring_events
+                    WHERE user_id = ? AND calendar_type = ?
+                ''', (user_id, calendar_type))
+            cursor.executemany('''
+                DELETE FROM recurring_events
+                WHERE user_id = ? AND calendar_type = ? AND event_id = ?
+            ''', [(user_id, calendar_type, event_id) for event_id in removed_ids])
+            now_ts = to_timestamp(datetime.utcnow())
+            cursor.executemany('''
+                INSERT INTO recurring_events
+                (user_id, calendar_type, event_id, summary, description, location, html_link, rule, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, calendar_type, event_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    description = excluded.description,
+                    location = excluded.location,
+                    html_link = excluded.html_link,
+                    rule = excluded.rule,
+                    updated_at = excluded.updated_at
+            ''', [(user_id, calendar_type, item['event_id'], item.get('summary'), item.get('description'),
+                   item.get('location'), item.get('html_link'), json.dumps(item['rule']), now_ts)
+                  for item in series])
+    
+    # Методы для работы с арендой задач
+    def acquire_lease(self, name: str, holder: str, ttl_seconds: int, now_ts: int) -> Optional[int]:
+        """Получение аренды задачи, если она свободна или истекла
+        
+        Каждое новое получение аренды увеличивает fencing token, поэтому
+        запись прежнего владельца, у которого аренда истекла, можно отличить.
+        
+        Returns:
+            Fencing token или None, если аренду держит другой владелец
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO job_leases (name, holder, fencing_token, acquired_at, expires_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    fencing_token = job_leases.fencing_token + 1,
+                    acquired_at = excluded.acquired_at,
+                    expires_at = excluded.expires_at
+                WHERE job_leases.expires_at <= ?
+            ''', (name, holder, now_ts, now_ts + ttl_seconds, now_ts))
+            if cursor.rowcount != 1:
+                return None
+            cursor.execute('SELECT fencing_token FROM job_leases WHERE name = ?', (name,))
+            return cursor.fetchone()['fencing_token']
+    
+    def renew_lease(self, name: str, holder: str, fencing_token: int, ttl_seconds: int, now_ts: int) -> bool:
+        """Продление аренды текущим владельцем
+        
+        Returns:
+            False, если аренда уже истекла и перешла к другому владельцу
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_leases SET expires_at = ?
+                WHERE name = ? AND holder = ? AND fencing_token = ? AND expires_at > ?
+            ''', (now_ts + ttl_seconds, name, holder, fencing_token, now_ts))
+            return cursor.rowcount == 1
+    
+    def release_lease(self, name: str, holder: str, fencing_token: int):
+        """Освобождение аренды (только если она все еще принадлежит владельцу)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE job_leases SET expires_at = 0
+                WHERE name = ? AND holder = ? AND fencing_token = ?
+            ''', (name, holder, fencing_token))
+    
+    def set_system_setting_fenced(self, key: str, value: str, lease_name: str,
+                                  fencing_token: int, now_ts: int) -> bool:
+        """Установка настройки системы, только если аренда с fencing_token еще действует
+        
+        Returns:
+            False, если аренда истекла и запись отклонена
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 1 FROM job_leases
+                WHERE name = ? AND fencing_token = ? AND expires_at > ?
+            ''', (lease_name, fencing_token, now_ts))
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute('''
+                INSERT OR REPLACE INTO system_settings (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (key, value))
+            return True
+    
+    # Методы для работы с напоминаниями
+    def get_reminder_offsets(self, user_id: int) -> List[int]:
+        """Интервалы напоминаний пользователя в минутах (пустой список, если уведомления выключены)"""
+        settings = self.get_notification_settings(user_id)
+        if not settings.get('enabled', True):
+            return []
+        return [settings.get('notification_minutes', 15)]
+    
+    def rebuild_reminders(self, user_id: int, calendar_type: Optional[str] = None,
+                          now_ts: Optional[int] = None) -> int:
+        """Пересчет ожидающих напоминаний пользователя по кэшированным событиям
+        
+        Добавляет напоминания для новых будущих событий и удаляет ожидающие
+        напоминания, которые больше не соответствуют событиям или настройкам.
+        Уже отправленные напоминания не затрагиваются. Напоминание, время которого
+        прошло, срабатывает сразу, если о событии еще не напоминали.
+        
+        Returns:
+            Количество добавленных и удаленных напоминаний
+        """
+        if now_ts is None:
+            now_ts = to_timestamp(datetime.utcnow())
+        offsets = self.get_reminder_offsets(user_id)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            query = 'SELECT id, calendar_type, event_id, start_time FROM cached_events WHERE user_id = ?'
+            params = [user_id]
+            if calendar_type:
+                query += ' AND calendar_type = ?'
+                params.append(calendar_type)
+            cursor.execute(query, params)
+            
+            desired = {}
+            late = {}
+            for row in cursor.fetchall():
+                start_time = row['start_time']
+                if isinstance(start_time, str):
+                    start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+                event_start = to_timestamp(start_time)
+                if event_start <= now_ts:
+                    continue
+                for offset in offsets:
+                    key = (row['calendar_type'], row['event_id'], event_start, offset)
+                    if event_start - offset * 60 >= now_ts:
+                        desired[key] = (row['id'], event_start - offset * 60)
+                    else:
+                        late[key] = row['id']
+            
+            query = '''
+                SELECT id, calendar_type, event_id, event_start, offset_minutes, status
+                FROM reminders WHERE user_id = ? AND status IN ('pending', 'sent')
+            '''
+            params = [user_id]
+            if calendar_type:
+                query += ' AND calendar_type = ?'
+                params.append(calendar_type)
+            cursor.execute(query, params)
+            
+            obsolete = []
+            reminded = set()
+            for row in cursor.fetchall():
+                key = (row['calendar_type'], row['event_id'], row['event_start'], row['offset_minutes'])
+                if row['status'] == 'sent' or key in late:
+                    # О событии уже напомнили или напоминание ожидает отправки
+                    reminded.add(key[:3])
+                elif key in desired:
+                    del desired[key]  # Уже есть
+                else:
+                    obsolete.append((row['id'],))
+            
+            # Время напоминания уже прошло (событие добавлено поздно или увеличен интервал):
+            # напомнить сразу, но одним напоминанием и только о событии, о котором еще не напоминали
+            for key in sorted(late, key=lambda key: key[3]):
+                if key[:3] not in reminded:
+                    reminded.add(key[:3])
+                    desired[key] = (late[key], now_ts)
+            
+            cursor.executemany('DELETE FROM reminders WHERE id = ?', obsolete)
+            cursor.executemany('''
+                INSERT OR IGNORE INTO reminders
+                (user_id, calendar_type, event_id, cached_event_id, event_start, offset_minutes, fire_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(user_id, key[0], key[1], cached_event_id, key[2], key[3], fire_at)
+                  for key, (cached_event_id, fire_at) in desired.items()])
+            if obsolete or desired:
+                self._mark_reminders_changed(cursor, user_id)
+            return len(obsolete) + len(desired)
+    
+    @staticmethod
+    def _mark_reminders_changed(cursor, user_id: int):
+        """Отметка об изменении напоминаний пользователя (в транзакции изменения)"""
+        cursor.execute('''
+            INSERT INTO reminder_changes (user_id, seq)
+            VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM reminder_changes))
+            ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq
+        ''', (user_id,))
+    
+    def get_reminder_change_seq(self) -> int:
+        """Номер последнего изменения напоминаний"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM reminder_changes')
+            return cursor.fetchone()[0]
+    
+    def get_reminder_changes(self, after_seq: int) -> List[tuple]:
+        """Пользователи, напоминания которых изменились после after_seq: кортежи (user_id, seq)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, seq FROM reminder_changes
+                WHERE seq > ?
+                ORDER BY seq ASC
+            ''', (after_seq,))
+            return [(row['user_id'], row['seq']) for row in cursor.fetchall()]
+    
+    def rebuild_all_reminders(self) -> int:
+        """Пересчет напоминаний всех пользователей с подключенными календарями"""
+        return sum(self.rebuild_reminders(user_id) for user_id in self.get_all_active_users())
+    
+    def _reminder_rows(self, cursor) -> List[Dict]:
+        """Преобразование строк напоминаний с данными события"""
+        results = []
+        for row in cursor.fetchall():
+            result = dict(row)
+            for field, target in (('start_time', 'start'), ('end_time', 'end')):
+                value = result.get(field)
+                if isinstance(value, str):
+                    result[target] = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                else:
+                    result[target] = value
+            results.append(result)
+        return results
+    
+    def get_due_reminders(self, now_ts: int, limit: Optional[int] = None) -> List[Dict]:
+        """Ожидающие напоминания, время которых наступило (один проход по индексу (status, fire_at))
+        
+        Нижней границы по fire_at нет: напоминание, добавленное другим процессом
+        с fire_at в прошлом, тоже будет выбрано. Объем выборки ограничивают статус
+        и просрочка старых напоминаний (expire_missed_reminders, expire_reminders).
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            query = '''
+                SELECT r.*, ce.summary, ce.description, ce.location,
+                       ce.start_time, ce.end_time, ce.html_link
+                FROM reminders r
+                JOIN cached_events ce ON ce.id = r.cached_event_id
+                WHERE r.status = 'pending' AND r.fire_at <= ? AND r.event_start > ?
+                ORDER BY r.fire_at ASC
+            '''
+            params = [now_ts, now_ts]
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            cursor.execute(query, params)
+            return self._reminder_rows(cursor)
+    
+    def get_pending_reminders(self, until_ts: int, now_ts: int,
+                              user_id: Optional[int] = None) -> List[Dict]:
+        """Ожидающие напоминания со временем срабатывания до until_ts"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            query = '''
+                SELECT r.*, ce.summary, ce.description, ce.location,
+                       ce.start_time, ce.end_time, ce.html_link
+                FROM reminders r
+                JOIN cached_events ce ON ce.id = r.cached_event_id
+                WHERE r.status = 'pending' AND r.fire_at <= ? AND r.event_start > ?
+            '''
+            params = [until_ts, now_ts]
+            if user_id is not None:
+                query += ' AND r.user_id = ?'
+                params.append(user_id)
+            cursor.execute(query, params)
+            return self._reminder_rows(cursor)
+    
+    def enqueue_reminder_notification(self, reminder_ids: List[int], user_id: int, text: str, now_ts: int,
+                                      deadline_at: Optional[int] = None) -> bool:
+        """Атомарная отметка напоминаний как отправленных и постановка уведомления в outbox
+        
+        Одно уведомление может объединять несколько напоминаний (дайджест). Если хотя бы
+        одно из них уже взято в работу другим обработчиком, ничего не меняется.
+        
+        Returns:
+            True, если все напоминания были ожидающими и уведомление поставлено в очередь
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(reminder_ids))
+            cursor.execute(f'''
+                UPDATE reminders SET status = 'sent', sent_at = ?
+                WHERE id IN ({placeholders}) AND status = 'pending'
+            ''', [now_ts, *reminder_ids])
+            if cursor.rowcount != len(reminder_ids):
+                conn.rollback()
+                return False
+            dedup_key = 'reminder:' + '+'.join(str(reminder_id) for reminder_id in sorted(reminder_ids))
+            cursor.execute('''
+                INSERT OR IGNORE INTO notification_outbox
+                (user_id, dedup_key, text, next_attempt_at, created_at, deadline_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, dedup_key, text, now_ts, now_ts, deadline_at))
+            return True
+    
+    def expire_reminders(self, now_ts: int) -> int:
+        """Отметка ожидающих напоминаний о начавшихся событиях как просроченных"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE reminders SET status = 'expired'
+                WHERE status = 'pending' AND event_start <= ?
+            ''', (now_ts,))
+            return cursor.rowcount
+    
+    # Методы для работы с очередью исходящих уведомлений
+    def claim_outbox_batch(self, now_ts: int, limit: int, lease_seconds: int) -> List[Dict]:
+        """Захват пачки уведомлений, готовых к отправке
+        
+        Захваченные строки блокируются до now_ts + lease_seconds, поэтому
+        параллельные обработчики (бот и веб-приложение) не отправят их повторно.
+        Если обработчик упадет, строки снова станут доступны после истечения блокировки.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id FROM notification_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ? AND locked_until <= ?
+                ORDER BY deadline_at IS NULL, deadline_at ASC, next_attempt_at ASC
+                LIMIT ?
+            ''', (now_ts, now_ts, limit))
+            ids = [row['id'] for row in cursor.fetchall()]
+            
+            claimed = []
+            for outbox_id in ids:
+                cursor.execute('''
+                    UPDATE notification_outbox SET locked_until = ?
+                    WHERE id = ? AND status = 'pending' AND locked_until <= ?
+                ''', (now_ts + lease_seconds, outbox_id, now_ts))
+                if cursor.rowcount == 1:
+                    claimed.append(outbox_id)
+            if not claimed:
+                return []
+            
+            placeholders = ','.join('?' * len(claimed))
+            cursor.execute(f'''
+                SELECT * FROM notification_outbox WHERE id IN ({placeholders})
+                ORDER BY deadline_at IS NULL, deadline_at ASC, next_attempt_at ASC
+            ''', claimed)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def mark_outbox_delivered(self, outbox_id: int, now_ts: int):
+        """Отметка уведомления как доставленного"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET status = 'delivered', delivered_at = ?, attempts = attempts + 1,
+                    locked_until = 0, last_error = NULL
+                WHERE id = ?
+            ''', (now_ts, outbox_id))
+    
+    def reschedule_outbox(self, outbox_id: int, next_attempt_at: int, error: str,
+                          count_attempt: bool = True):
+        """Перенос отправки уведомления после временной ошибки"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET next_attempt_at = ?, last_error = ?, locked_until = 0,
+                    attempts = attempts + ?
+                WHERE id = ?
+            ''', (next_attempt_at, error, 1 if count_attempt else 0, outbox_id))
+    
+    def mark_outbox_dead(self, outbox_id: int, error: str):
+        """Отметка уведомления как недоставляемого (повторные попытки не помогут)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET status = 'dead', last_error = ?, locked_until = 0, attempts = attempts + 1
+                WHERE id = ?
+            ''', (error, outbox_id))
+    
+    def mark_outbox_expired(self, outbox_id: int, error: str):
+        """Отметка уведомления как устаревшего (срок отправки истек)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE notification_outbox
+                SET status = 'expired', last_error = ?, locked_until = 0
+                WHERE id = ?
+            ''', (error, outbox_id))
+    
+    def get_outbox_stats(self) -> Dict[str, int]:
+        """Количество уведомлений в outbox по статусам"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) as count FROM notification_outbox GROUP BY status')
+            return {row['status']: row['count'] for row in cursor.fetchall()}
+    
+    def delete_old_outbox(self, before_ts: int) -> int:
+        """Удаление доставленных, недоставляемых и устаревших уведомлений старше before_ts"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM notification_outbox
+                WHERE status IN ('delivered', 'dead', 'expired') AND created_at < ?
+            ''', (before_ts,))
+            return cursor.rowcount
+    
+    def expire_missed_reminders(self, before_ts: int) -> int:
+        """Отметка как просроченных напоминаний, время которых прошло раньше before_ts
+        
+        Такие напоминания пропущены во время простоя дольше допустимого отставания
+        и отправлять их уже поздно.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE reminders SET status = 'expired'
+                WHERE status = 'pending' AND fire_at < ?
+            ''', (before_ts,))
+            return cursor.rowcount
+    
+    def delete_old_reminders(self, user_id: int, calendar_type: str, before_ts: int) -> int:
+        """Удаление напоминаний о давно прошедших событиях"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM reminders
+                WHERE user_id = ? AND calendar_type = ? AND event_start < ?
+            ''', (user_id, calendar_type, before_ts))
+            return cursor.rowcount
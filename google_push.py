@@ -0,0 +1,178 @@
+"""Push-уведомления Google Calendar (events.watch)
+
+Вместо регулярного опроса для каждого календаря подключения регистрируется
+канал уведомлений: при изменении событий Google отправляет POST на
+/callback/google/push (GOOGLE_PUSH_URL), и подключение ставится в очередь
+внеочередной синхронизации (sync_queue.py), которая загружает заново только
+изменившиеся календари (остальные отвечают 304 на If-None-Match).
+
+Каналы регистрируются и продлеваются при синхронизации подключения, если до
+истечения осталось меньше GOOGLE_WATCH_RENEW_HOURS; сроки проверяются по
+сохраненным каналам, и к Google обращаются только за каналами, которым нужно
+продление. Опрос остается запасным
+путем: пока каналы действуют, подключение опрашивается с интервалом
+SYNC_MAX_INTERVAL_MINUTES (он должен быть меньше срока продления), но не реже,
+чем перед ближайшим напоминанием, а без GOOGLE_PUSH_URL или после ошибки
+регистрации - как обычно.
+"""
+import hmac
+import logging
+import secrets
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional
+from calendar_google import GoogleCalendar
+from config import Config
+from database import Database
+from parallel_fetch import fetch_collections
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+google_cal = GoogleCalendar()
+
+# Первое уведомление после регистрации канала: изменений в календаре нет
+SYNC_STATE = 'sync'
+
+# Регистрация канала после отказа Google повторяется не чаще (секунды)
+_REGISTER_RETRY_SECONDS = 3600
+
+# Время последнего отказа в регистрации канала: (user_id, calendar_id) -> unix time
+_register_failed_at: Dict[tuple, int] = {}
+
+def is_enabled() -> bool:
+    """Задан ли адрес для push-уведомлений"""
+    return bool(Config.get_google_push_url())
+
+def _register(user_id: int, credentials, calendar_id: str, address: str, now_ts: int) -> bool:
+    """Регистрация нового канала календаря; False, если Google отказал"""
+    channel_id = uuid.uuid4().hex
+    token = secrets.token_urlsafe(32)
+    ttl_seconds = Config.GOOGLE_WATCH_TTL_HOURS * 3600
+    try:
+        watch = google_cal.watch_events(credentials, calendar_id, channel_id, address, token, ttl_seconds)
+    except Exception as e:
+        logger.warning(f"Google push: не удалось зарегистрировать канал календаря {calendar_id} "
+                       f"пользователя {user_id}: {e}")
+        return False
+    expiration = watch['expiration'] or now_ts + ttl_seconds
+    db.save_google_watch_channel(channel_id, user_id, calendar_id, watch['resource_id'], token, expiration, now_ts)
+    logger.info(f"Google push: канал {channel_id} календаря {calendar_id} пользователя {user_id} "
+                f"действует до {datetime.utcfromtimestamp(expiration):%Y-%m-%d %H:%M} UTC")
+    return True
+
+def _stop(credentials, channel: Dict, now_ts: int):
+    """Остановка канала и удаление его записи"""
+    if channel['expiration'] > now_ts and channel['resource_id']:
+        try:
+            google_cal.stop_channel(credentials, channel['channel_id'], channel['resource_id'])
+        except Exception as e:
+            # Канал истечет сам, а уведомления удаленного канала игнорируются
+            logger.warning(f"Google push: не удалось остановить канал {channel['channel_id']}: {e}")
+    db.delete_google_watch_channel(channel['channel_id'])
+
+def _due_channels(user_id: int, calendar_ids: List[str], now_ts: int):
+    """План обслуживания каналов по сохраненным срокам истечения (без запросов к Google)
+
+    Returns:
+        Календари, для которых нужно зарегистрировать канал, их текущие каналы
+        и каналы, которые нужно остановить в любом случае
+    """
+    address = Config.get_google_push_url()
+    renew_before = Config.GOOGLE_WATCH_RENEW_HOURS * 3600
+    channels: Dict[str, List[Dict]] = {}
+    for channel in db.get_google_watch_channels(user_id):
+        channels.setdefault(channel['calendar_id'], []).append(channel)
+
+    to_register: Dict[str, List[Dict]] = {}
+    to_stop: List[Dict] = []
+    for calendar_id in (calendar_ids if address else []):
+        # Каналы календаря отсортированы по времени истечения
+        current = channels.pop(calendar_id, [])
+        if current and current[-1]['expiration'] - now_ts > renew_before:
+            to_stop.extend(current[:-1])
+        elif now_ts - _register_failed_at.get((user_id, calendar_id), 0) >= _REGISTER_RETRY_SECONDS:
+            to_register[calendar_id] = current
+        else:
+            to_stop.extend(channel for channel in current if channel['expiration'] <= now_ts)
+
+    for removed in channels.values():
+        to_stop.extend(removed)
+    return to_register, to_stop
+
+async def ensure_channels(user_id: int, credentials, calendar_ids: List[str], now_ts: Optional[int] = None) -> int:
+    """Каналы для всех календарей подключения
+
+    Регистрирует каналы календарей без действующего канала и каналы на замену
+    истекающим, останавливает прежние каналы и каналы календарей, которых больше
+    нет в подключении (без GOOGLE_PUSH_URL - все каналы). Календарь, для которого
+    канал зарегистрировать не удалось, опрашивается по расписанию, а регистрация
+    повторяется не чаще раза в _REGISTER_RETRY_SECONDS.
+
+    Сначала по сохраненным срокам истечения определяются каналы, которым нужно
+    обслуживание: обычно их нет, и синхронизация (в том числе по push-уведомлению)
+    не обращается к Google. Запросы watch и stop выполняются в потоках с общим
+    ограничением GOOGLE_FETCH_CONCURRENCY (parallel_fetch.py).
+
+    Returns:
+        Количество зарегистрированных каналов
+    """
+    now_ts = now_ts or int(time.time())
+    to_register, to_stop = _due_channels(user_id, calendar_ids, now_ts)
+    if not to_register and not to_stop:
+        return 0
+
+    address = Config.get_google_push_url()
+    registered = 0
+    outcomes = await fetch_collections('google', list(to_register), lambda calendar_id: _register(
+        user_id, credentials, calendar_id, address, now_ts))
+    for calendar_id, success, _ in outcomes:
+        current = to_register[calendar_id]
+        if success:
+            registered += 1
+            _register_failed_at.pop((user_id, calendar_id), None)
+            to_stop.extend(current)
+        else:
+            # Прежний канал еще может доставлять уведомления до истечения
+            _register_failed_at[(user_id, calendar_id)] = now_ts
+            to_stop.extend(channel for channel in current if channel['expiration'] <= now_ts)
+
+    await fetch_collections('google', to_stop, lambda channel: _stop(credentials, channel, now_ts))
+    return registered
+
+def is_covered(user_id: int, calendar_ids: List[str], now_ts: Optional[int] = None) -> bool:
+    """У каждого календаря подключения есть действующий канал"""
+    if not calendar_ids or not is_enabled():
+        return False
+    now_ts = now_ts or int(time.time())
+    watched = {channel['calendar_id'] for channel in db.get_google_watch_channels(user_id)
+               if channel['expiration'] > now_ts}
+    return all(calendar_id in watched for calendar_id in calendar_ids)
+
+def handle_notification(headers: Mapping[str, str]) -> Optional[int]:
+    """Проверка уведомления канала по заголовкам X-Goog-*
+
+    Returns:
+        ID пользователя, подключение которого нужно синхронизировать; None для
+        уведомлений о регистрации канала (sync), неизвестных каналов и неверного токена
+    """
+    channel_id = headers.get('X-Goog-Channel-ID')
+    channel = db.get_google_watch_channel(channel_id) if channel_id else None
+    if channel is None:
+        logger.info(f"Google push: уведомление неизвестного канала {channel_id} проигнорировано")
+        return None
+
+    token = headers.get('X-Goog-Channel-Token', '')
+    resource_id = headers.get('X-Goog-Resource-ID')
+    if (not hmac.compare_digest(token.encode('utf-8'), channel['token'].encode('utf-8'))
+            or (channel['resource_id'] and resource_id != channel['resource_id'])):
+        logger.warning(f"Google push: неверный токен или ресурс в уведомлении канала {channel_id}")
+        return None
+
+    state = headers.get('X-Goog-Resource-State')
+    if state == SYNC_STATE:
+        return None
+    logger.info(f"Google push: {state} в календаре {channel['calendar_id']} пользователя {channel['user_id']} "
+                f"(сообщение {headers.get('X-Goog-Message-Number')})")
+    return channel['user_id']
@@ -0,0 +1,380 @@
+"""Потоковый разбор iCalendar (RFC 5545)
+
+Данные читаются построчно за один проход: свернутые строки склеиваются,
+строки содержимого разбираются на имя, параметры и значение, а события
+VEVENT выдаются по одному, как только прочитан их END:VEVENT. Поэтому разбор
+не требует регулярного выражения по всему ответу и не держит в памяти
+список всех событий. Время с TZID переводится в UTC.
+
+У повторяющегося события (RRULE/RDATE) правило сохраняется в поле recurrence,
+а экземпляры разворачивает recurrence.py; измененный экземпляр серии
+(RECURRENCE-ID) получает поле recurrence_id.
+
+Для выборки N ближайших событий EventSelector держит кучу из N событий, а
+iter_events отбрасывает событие, которое в нее не попадет, сразу после DTSTART.
+
+Скорость и память можно сравнить с прежним разбором: bench_ical_parser.py.
+"""
+import heapq
+import itertools
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+# Параметр строки содержимого: ;NAME=value или ;NAME="value с : и ;"
+_PARAM_RE = re.compile(r';([^=;:]+)=("[^"]*"|[^;:]*)')
+_ESCAPE_RE = re.compile(r'\\([\\;,nN])')
+_DURATION_RE = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+# Свойства события, значения которых нужны при разборе
+_EVENT_PROPERTIES = frozenset(['UID', 'SUMMARY', 'DESCRIPTION', 'LOCATION', 'DTSTART', 'DTEND', 'DURATION',
+                               'RRULE', 'RDATE', 'EXDATE', 'RECURRENCE-ID'])
+
+_zones: Dict[str, Optional[ZoneInfo]] = {}
+
+Property = Tuple[Dict[str, str], str]
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _parse_value(line: str, name_end: int) -> Optional[Tuple[Dict[str, str], str]]:
+    """Параметры и значение строки содержимого после имени"""
+    if line[name_end] == ':':
+        return {}, line[name_end + 1:]
+
+    # В кавычках параметров могут быть ':' и ';', поэтому значение ищем после параметров
+    params = {}
+    pos = name_end
+    while True:
+        match = _PARAM_RE.match(line, pos)
+        if not match:
+            break
+        value = match.group(2)
+        params[match.group(1).upper()] = value[1:-1] if value[:1] == '"' else value
+        pos = match.end()
+    if line[pos:pos + 1] != ':':
+        return None
+    return params, line[pos + 1:]
+
+def unescape_text(value: str) -> str:
+    """Значение типа TEXT без экранирования (\\n, \\, \\; \\\\)"""
+    if '\\' not in value:
+        return value
+    if '\\\\' not in value:
+        # Без экранированной обратной косой черты порядок замен не важен
+        return value.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',').replace('\\;', ';')
+    return _ESCAPE_RE.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def _zone(tzid: str) -> Optional[ZoneInfo]:
+    if tzid not in _zones:
+        try:
+            _zones[tzid] = ZoneInfo(tzid.strip('/'))
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Неизвестный часовой пояс TZID={tzid}, время считается UTC")
+            _zones[tzid] = None
+    return _zones[tzid]
+
+def parse_local_datetime(value: str, params: Optional[Dict[str, str]] = None) -> Tuple[datetime, bool, Optional[str]]:
+    """Разбор DATE или DATE-TIME без перевода в UTC
+
+    Returns:
+        Время по часам своего часового пояса, признак события на весь день и
+        часовой пояс ('UTC' для значений с Z, None для дат и плавающего времени)
+
+    Raises:
+        ValueError: если значение не в формате iCalendar
+    """
+    value = value.strip()
+    if len(value) == 8 or (params and params.get('VALUE') == 'DATE'):
+        return datetime(int(value[0:4]), int(value[4:6]), int(value[6:8])), True, None
+    if len(value) < 15 or value[8] != 'T':
+        raise ValueError(f"Некорректное значение даты: {value}")
+
+    result = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                      int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if value.endswith('Z'):
+        return result, False, 'UTC'
+    return result, False, params.get('TZID') if params else None
+
+def to_utc(value: datetime, tzid: Optional[str]) -> datetime:
+    """Перевод времени часового пояса tzid в наивное время UTC"""
+    if tzid and tzid != 'UTC':
+        zone = _zone(tzid)
+        if zone is not None:
+            return value - zone.utcoffset(value)
+    # Плавающее время (без Z и TZID) оставляем как есть
+    return value
+
+def from_utc(value: datetime, tzid: Optional[str]) -> datetime:
+    """Перевод наивного времени UTC во время часового пояса tzid"""
+    if tzid and tzid != 'UTC':
+        zone = _zone(tzid)
+        if zone is not None:
+            return value.replace(tzinfo=timezone.utc).astimezone(zone).replace(tzinfo=None)
+    return value
+
+def parse_datetime(value: str, params: Optional[Dict[str, str]] = None) -> Tuple[datetime, bool]:
+    """Разбор DATE или DATE-TIME в наивное время UTC
+
+    Returns:
+        Время и признак события на весь день (значение - дата без времени)
+
+    Raises:
+        ValueError: если значение не в формате iCalendar
+    """
+    result, all_day, tzid = parse_local_datetime(value, params)
+    return to_utc(result, tzid), all_day
+
+def _parse_date_list(values: Optional[List[Property]]) -> List[datetime]:
+    """Даты из свойств EXDATE/RDATE (значения через запятую) в наивном времени UTC"""
+    result = []
+    for params, value in values or ():
+        for item in value.split(','):
+            # Для VALUE=PERIOD важно только начало периода
+            item = item.split('/', 1)[0]
+            if not item.strip():
+                continue
+            try:
+                result.append(parse_datetime(item, params)[0])
+            except ValueError as e:
+                logger.warning(f"Ошибка парсинга даты повторения '{item}': {e}")
+    return result
+
+def parse_duration(value: str) -> Optional[timedelta]:
+    """Разбор DURATION (P1D, PT1H30M, P2W)"""
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+def iter_components(lines: Iterable[str], component: str = 'VEVENT',
+                    properties: Optional[frozenset] = None) -> Iterator[Dict[str, List[Property]]]:
+    """Компоненты component по одному, по мере чтения
+
+    Вложенные компоненты (VALARM) пропускаются. Строки вне компонентов (в том
+    числе обрамление XML, если передан сырой ответ CalDAV) игнорируются.
+
+    Returns:
+        Свойства компонента: имя -> список (параметры, значение)
+    """
+    current: Optional[Dict[str, List[Property]]] = None
+    nested = 0
+    parts: Optional[List[str]] = None
+    # Свернутые строки (продолжение начинается с пробела или табуляции) склеиваются здесь же:
+    # строка обрабатывается, когда прочитана следующая за ней
+    for raw in itertools.chain(lines, ('',)):
+        raw = raw.rstrip('\r\n')
+        if parts is not None and raw[:1] in (' ', '\t') and raw:
+            parts.append(raw[1:])
+            continue
+        if parts is None:
+            parts = [raw]
+            continue
+        line = parts[0] if len(parts) == 1 else ''.join(parts)
+        parts = [raw]
+        
+        colon = line.find(':')
+        if colon <= 0:
+            continue
+        name_end = line.find(';', 0, colon)
+        if name_end == -1:
+            name_end = colon
+        name = line[:name_end].upper()
+        if name == 'BEGIN':
+            if current is not None:
+                nested += 1
+            elif line[name_end + 1:].strip().upper() == component:
+                current, nested = {}, 0
+            continue
+        if current is None:
+            continue
+        if name == 'END':
+            if nested:
+                nested -= 1
+            elif line[name_end + 1:].strip().upper() == component:
+                yield current
+                current = None
+            continue
+        if nested or (properties is not None and name not in properties):
+            continue
+        parsed = _parse_value(line, name_end)
+        if parsed is not None:
+            current.setdefault(name, []).append(parsed)
+
+def _iter_blocks(text: str, component: str = 'VEVENT') -> Iterator[List[str]]:
+    """Строки каждого блока BEGIN:component ... END:component текста
+
+    Границы блоков ищутся str.find, поэтому текст между событиями
+    (VTIMEZONE, обрамление XML) не разбирается построчно.
+    """
+    begin = f'BEGIN:{component}'
+    end = f'END:{component}'
+    pos = 0
+    while True:
+        start = text.find(begin, pos)
+        if start == -1:
+            return
+        stop = text.find(end, start)
+        if stop == -1:
+            return
+        pos = stop + len(end)
+        yield text[start:pos].splitlines()
+
+def _first(component: Dict[str, List[Property]], name: str) -> Optional[Property]:
+    values = component.get(name)
+    return values[0] if values else None
+
+def build_event(component: Dict[str, List[Property]], start_before: Optional[datetime] = None) -> Optional[Dict]:
+    """Событие в формате адаптеров календаря из свойств VEVENT (None без UID или DTSTART)
+
+    Args:
+        start_before: не разбирать дальше событие, которое начинается не раньше этого
+            времени (возвращается None); повторяющиеся события разбираются всегда
+    """
+    uid = _first(component, 'UID')
+    dtstart = _first(component, 'DTSTART')
+    if not uid or not dtstart:
+        return None
+    try:
+        local_start, all_day, tzid = parse_local_datetime(dtstart[1], dtstart[0])
+    except ValueError as e:
+        logger.warning(f"Ошибка парсинга DTSTART '{dtstart[1]}': {e}")
+        return None
+    start = to_utc(local_start, tzid)
+    if (start_before is not None and start >= start_before
+            and not ('RRULE' in component or 'RDATE' in component or 'RECURRENCE-ID' in component)):
+        return None
+
+    end = None
+    dtend = _first(component, 'DTEND')
+    if dtend:
+        try:
+            end, _ = parse_datetime(dtend[1], dtend[0])
+        except ValueError as e:
+            logger.warning(f"Ошибка парсинга DTEND '{dtend[1]}': {e}")
+    elif _first(component, 'DURATION'):
+        duration = parse_duration(_first(component, 'DURATION')[1])
+        if duration is not None:
+            end = start + duration
+    if end is None:
+        # Без DTEND событие на день длится сутки, остальные - час
+        end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+
+    summary = _first(component, 'SUMMARY')
+    description = _first(component, 'DESCRIPTION')
+    location = _first(component, 'LOCATION')
+    event = {
+        'id': uid[1].strip(),
+        'summary': unescape_text(summary[1]).strip() if summary else 'Без названия',
+        'description': unescape_text(description[1]).strip() if description else '',
+        'location': unescape_text(location[1]).strip() if location else '',
+        'start': start,
+        'end': end
+    }
+
+    recurrence_id = _first(component, 'RECURRENCE-ID')
+    if recurrence_id:
+        try:
+            event['recurrence_id'] = parse_datetime(recurrence_id[1], recurrence_id[0])[0]
+        except ValueError as e:
+            logger.warning(f"Ошибка парсинга RECURRENCE-ID '{recurrence_id[1]}': {e}")
+    elif 'RRULE' in component or 'RDATE' in component:
+        # Повторения разворачиваются по часам часового пояса DTSTART (важно при переходе на летнее время)
+        rrule = _first(component, 'RRULE')
+        event['recurrence'] = {
+            'rrule': rrule[1].strip() if rrule else None,
+            'start': local_start,
+            'tzid': tzid,
+            'all_day': all_day,
+            'duration': int((end - start).total_seconds()),
+            'rdates': _parse_date_list(component.get('RDATE')),
+            'exdates': _parse_date_list(component.get('EXDATE'))
+        }
+    return event
+
+def in_range(event: Dict, time_min: Optional[datetime], time_max: Optional[datetime]) -> bool:
+    """Событие попадает в диапазон отбора iter_events
+
+    Повторяющиеся события попадают всегда, измененные экземпляры - и по исходному времени.
+    """
+    if 'recurrence' in event:
+        return True
+    starts = (event['start'], event['recurrence_id']) if 'recurrence_id' in event else (event['start'],)
+    return any((time_min is None or start >= time_min) and (time_max is None or start <= time_max)
+               for start in starts)
+
+def iter_events(data: Union[str, Iterable[str]], time_min: Optional[datetime] = None,
+                time_max: Optional[datetime] = None,
+                cutoff: Optional[Callable[[], Optional[datetime]]] = None) -> Iterator[Dict]:
+    """События из данных iCalendar, по одному
+
+    Args:
+        data: текст или итератор строк (например, поток ответа)
+        time_min, time_max: выдавать только события, начинающиеся в этом диапазоне.
+            Повторяющиеся события выдаются всегда (их экземпляры отбирает recurrence.py),
+            измененные экземпляры - и тогда, когда в диапазон попадает исходное время
+        cutoff: функция, возвращающая текущую границу отбора (EventSelector.cutoff):
+            события, начинающиеся не раньше нее, отбрасываются сразу после DTSTART
+    """
+    if isinstance(data, str):
+        components = (component for block in _iter_blocks(data)
+                      for component in iter_components(block, properties=_EVENT_PROPERTIES))
+    else:
+        components = iter_components(data, properties=_EVENT_PROPERTIES)
+    for component in components:
+        event = build_event(component, cutoff() if cutoff is not None else None)
+        if event is None:
+            continue
+        if in_range(event, time_min, time_max):
+            yield event
+
+class EventSelector:
+    """Отбор limit событий с самым ранним началом (куча ограниченного размера)
+
+    Пока отобрано меньше limit событий, принимается любое; затем - только
+    событие, которое начинается раньше самого позднего из отобранных, и оно
+    вытесняет его. Граница отбора (cutoff) передается в iter_events, поэтому
+    заведомо лишние события отбрасываются сразу после разбора DTSTART.
+    Повторяющиеся события (правила серий) не считаются и сохраняются все.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._heap: List[Tuple[float, int, Dict]] = []  # (-начало, -порядковый номер, событие)
+        self._seq = itertools.count()
+        self.series: List[Dict] = []
+
+    def cutoff(self) -> Optional[datetime]:
+        """Начало самого позднего отобранного события, когда отобрано limit событий"""
+        if self.limit <= 0:
+            return datetime.min  # Не отбирается ни одно событие, кроме правил серий
+        if len(self._heap) < self.limit:
+            return None
+        return self._heap[0][2]['start']
+
+    def offer(self, event: Dict) -> bool:
+        """Предложить событие; True, если оно отобрано"""
+        if 'recurrence' in event:
+            self.series.append(event)
+            return True
+        if self.limit <= 0:
+            return False
+        key = (-(event['start'] - _EPOCH).total_seconds(), -next(self._seq), event)
+        if len(self._heap) < self.limit:
+            heapq.heappush(self._heap, key)
+            return True
+        # При равном начале остается событие, полученное раньше
+        if key[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, key)
+            return True
+        return False
+
+    def result(self) -> List[Dict]:
+        """Отобранные события по возрастанию начала, затем правила повторяющихся событий"""
+        return [item[2] for item in sorted(self._heap, key=lambda item: (-item[0], -item[1]))] + self.series
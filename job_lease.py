@@ -0,0 +1,118 @@
+"""Аренда (lease) периодических задач между процессами
+
+Планировщик запускается в каждом процессе веб-сервера, в процессе бота и через
+cron endpoints, поэтому одна и та же задача могла выполняться одновременно
+несколько раз. Перед запуском задача получает аренду в таблице job_leases:
+аренду держит один владелец до истечения срока, а каждый новый владелец
+получает увеличенный fencing token. Записи, которые опасно выполнять после
+потери аренды, проверяют токен (Lease.ensure_held, db.set_system_setting_fenced).
+"""
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+_holder_pid: Optional[int] = None
+_holder_id: Optional[str] = None
+
+def holder_id() -> str:
+    """Уникальный идентификатор владельца аренды: хост, процесс и случайная часть (pid может повториться)
+
+    Вычисляется в каждом процессе заново: воркеры, созданные fork из предзагруженного
+    приложения, иначе получили бы один идентификатор и считали бы чужие аренды своими.
+    """
+    global _holder_pid, _holder_id
+    pid = os.getpid()
+    if _holder_pid != pid:
+        _holder_id = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+        _holder_pid = pid
+    return _holder_id
+
+class LeaseLostError(Exception):
+    """Аренда потеряна во время выполнения задачи: задачу продолжает другой процесс"""
+
+class Lease:
+    """Полученная аренда задачи"""
+
+    def __init__(self, name: str, token: int, ttl_seconds: int):
+        self.name = name
+        self.token = token
+        self.ttl_seconds = ttl_seconds
+        self.expires_at = int(time.time()) + ttl_seconds
+
+    def is_valid(self) -> bool:
+        """Аренда еще не истекла по локальным часам"""
+        return time.time() < self.expires_at
+
+    def renew(self) -> bool:
+        """Продлить аренду на ttl_seconds
+
+        Returns:
+            False, если аренда потеряна: задачу нужно прервать
+        """
+        now_ts = int(time.time())
+        if not db.renew_lease(self.name, holder_id(), self.token, self.ttl_seconds, now_ts):
+            logger.warning(f"Аренда задачи {self.name} (token {self.token}) потеряна")
+            self.expires_at = 0
+            return False
+        self.expires_at = now_ts + self.ttl_seconds
+        return True
+
+    def keep_alive(self) -> bool:
+        """Продлить аренду, если прошло больше половины ее срока (для вызова в цикле длинной задачи)
+
+        Returns:
+            False, если аренда потеряна: задачу нужно прервать
+        """
+        if self.expires_at - time.time() > self.ttl_seconds / 2:
+            return True
+        return self.renew()
+
+    def ensure_held(self, renew: bool = False):
+        """Продлить аренду перед следующим шагом задачи
+
+        Args:
+            renew: продлить сразу, а не после половины срока: renew_lease проверяет
+                fencing token в базе, поэтому вызывается перед записями, которые
+                нельзя выполнять после перехода аренды к другому владельцу
+
+        Raises:
+            LeaseLostError: аренда потеряна, задачу нужно прервать
+        """
+        if not (self.renew() if renew else self.keep_alive()):
+            raise LeaseLostError(f"Аренда задачи {self.name} (token {self.token}) потеряна")
+
+    def release(self):
+        db.release_lease(self.name, holder_id(), self.token)
+        self.expires_at = 0
+
+@contextmanager
+def job_lease(name: str, ttl_seconds: Optional[int] = None) -> Iterator[Optional[Lease]]:
+    """Получить аренду задачи name на время блока with
+
+    Возвращает Lease или None, если задачу сейчас выполняет другой процесс.
+    """
+    ttl_seconds = ttl_seconds or Config.JOB_LEASE_TTL_SECONDS
+    token = db.acquire_lease(name, holder_id(), ttl_seconds, int(time.time()))
+    if token is None:
+        logger.info(f"Задача {name} уже выполняется другим процессом, пропуск")
+        yield None
+        return
+
+    lease = Lease(name, token, ttl_seconds)
+    try:
+        yield lease
+    finally:
+        try:
+            lease.release()
+        except Exception as e:
+            logger.warning(f"Ошибка при освобождении аренды задачи {name}: {e}")
@@ -4,8 +4,11 @@ import logging
 from telegram import Update
 from bot import setup_bot
 from scheduler import check_and_notify_events
+from notification_engine import run_notification_engine
+from notification_outbox import run_outbox_worker
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from config import Config
+from telegram_client import use_application_bot
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -19,18 +22,27 @@ async def main():
     
     # Настройка бота
     application = setup_bot()
+    # Отправители процесса используют бота приложения и его пул соединений
+    use_application_bot(application.bot)
     
     # Настройка планировщика
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        check_and_notify_events,
-        'interval',
-        minutes=Config.CHECK_INTERVAL_MINUTES,
-        id='check_events',
-        replace_existing=True
-    )
+    if Config.NOTIFICATION_ENGINE_ENABLED:
+        # Движок отправляет напоминания в точное время, периодическая проверка не нужна
+        asyncio.create_task(run_notification_engine())
+    else:
+        scheduler.add_job(
+            check_and_notify_events,
+            'interval',
+            minutes=Config.CHECK_INTERVAL_MINUTES,
+            id='check_events',
+            replace_existing=True
+        )
     scheduler.start()
     
+    # Отправка уведомлений из очереди с повторными попытками
+    asyncio.create_task(run_outbox_worker())
+    
     logger.info("Бот запущен и готов к работе!")
     
     # Запуск бота
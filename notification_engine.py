@@ -0,0 +1,179 @@
+"""Движок уведомлений с точным временем срабатывания
+
+Вместо периодического опроса всех пользователей движок держит в памяти кучу
+(heap) ожидающих напоминаний из таблицы reminders на ближайший горизонт
+(время срабатывания = начало события минус интервал уведомления пользователя).
+Между напоминаниями движок спит.
+
+Синхронизация календарей обычно выполняется в другом процессе (веб-приложение,
+cron, очередь синхронизации), поэтому каждое изменение напоминаний отмечается в
+таблице reminder_changes. Раз в NOTIFICATION_ENGINE_POLL_SECONDS движок
+проверяет ее по индексу и перезагружает только измененных пользователей.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+from config import Config
+from telegram_client import get_bot
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+class NotificationEngine:
+    """Долгоживущий движок, отправляющий каждое напоминание в его точное время"""
+
+    def __init__(self):
+        self._heap = []  # (fire_at, seq, key)
+        self._entries: Dict[int, Tuple[int, int, Dict]] = {}  # id напоминания -> (fire_at, seq, напоминание)
+        self._user_keys: Dict[int, Set[int]] = {}
+        self._seq = itertools.count()
+        self._dirty_users: Set[int] = set()
+        self._full_reload = True
+        self._loaded_until = 0
+        self._change_seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _load(self, user_id: Optional[int] = None):
+        """Загрузка напоминаний на горизонт (для всех пользователей или одного)"""
+        now_ts = int(time.time())
+        until_ts = now_ts + Config.NOTIFICATION_ENGINE_HORIZON_MINUTES * 60
+
+        if user_id is None:
+            # Изменения, записанные во время загрузки, будут найдены при следующей проверке
+            self._change_seq = db.get_reminder_change_seq()
+            # После простоя догоняем пропущенные напоминания, но не старше допустимого отставания
+            missed = db.expire_missed_reminders(now_ts - Config.REMINDER_MAX_CATCHUP_MINUTES * 60)
+            if missed:
+                logger.warning(f"Движок уведомлений: пропущено напоминаний из-за простоя: {missed}")
+
+        reminders = db.get_pending_reminders(until_ts, now_ts, user_id)
+
+        # Удаляем старые записи; устаревшие элементы кучи пропускаются при извлечении
+        user_ids = [user_id] if user_id is not None else list(self._user_keys)
+        for uid in user_ids:
+            for key in self._user_keys.pop(uid, set()):
+                self._entries.pop(key, None)
+        if user_id is None:
+            self._heap = []
+            self._entries = {}
+
+        for reminder in reminders:
+            key = reminder['id']
+            seq = next(self._seq)
+            self._entries[key] = (reminder['fire_at'], seq, reminder)
+            self._user_keys.setdefault(reminder['user_id'], set()).add(key)
+            heapq.heappush(self._heap, (reminder['fire_at'], seq, key))
+
+        if user_id is None:
+            self._loaded_until = now_ts + Config.NOTIFICATION_ENGINE_REFRESH_MINUTES * 60
+            logger.info(f"Движок уведомлений: загружено {len(reminders)} напоминаний")
+        else:
+            logger.info(f"Движок уведомлений: обновлено {len(reminders)} напоминаний пользователя {user_id}")
+
+    async def _fire_due(self):
+        """Постановка в outbox всех напоминаний, время которых наступило"""
+        from scheduler import deliver_due_reminders
+        from notification_outbox import drain_outbox, notify_outbox
+
+        due = []
+        now_ts = time.time()
+        while self._heap and self._heap[0][0] <= now_ts:
+            fire_at, seq, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if not entry or entry[1] != seq:
+                continue  # Запись устарела после перезагрузки
+            del self._entries[key]
+            reminder = entry[2]
+            self._user_keys.get(reminder['user_id'], set()).discard(key)
+            due.append(reminder)
+        if not due:
+            return
+
+        queued = deliver_due_reminders(due, int(now_ts))
+        if queued and not notify_outbox():
+            await drain_outbox(await get_bot())
+
+    async def run(self):
+        """Основной цикл движка"""
+        token = Config.get_telegram_token()
+        if not token:
+            logger.warning("TELEGRAM_BOT_TOKEN не установлен. Движок уведомлений не запущен.")
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.info("Движок уведомлений запущен")
+
+        from scheduler import ensure_reminders_initialized
+        ensure_reminders_initialized()
+
+        while True:
+            try:
+                if self._full_reload or time.time() >= self._loaded_until:
+                    self._full_reload = False
+                    self._dirty_users.clear()
+                    self._load()
+                self._poll_changes()
+                while self._dirty_users:
+                    self._load(self._dirty_users.pop())
+
+                await self._fire_due()
+            except Exception as e:
+                logger.error(f"Ошибка в движке уведомлений: {e}", exc_info=True)
+
+            # Спим до ближайшего напоминания, проверки изменений или плановой перезагрузки
+            wake_at = min(self._loaded_until, time.time() + Config.NOTIFICATION_ENGINE_POLL_SECONDS)
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            timeout = max(wake_at - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _poll_changes(self):
+        """Пользователи, напоминания которых изменились в любом процессе после прошлой проверки"""
+        for user_id, seq in db.get_reminder_changes(self._change_seq):
+            self._dirty_users.add(user_id)
+            self._change_seq = max(self._change_seq, seq)
+
+    def _mark_dirty(self, user_id: Optional[int]):
+        if user_id is None:
+            self._full_reload = True
+        else:
+            self._dirty_users.add(user_id)
+        self._wakeup.set()
+
+    def notify_changed(self, user_id: Optional[int] = None):
+        """Сообщить движку об изменении событий или настроек пользователя (потокобезопасно)"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._mark_dirty, user_id)
+
+# Движок, запущенный в текущем процессе (если есть)
+_engine: Optional[NotificationEngine] = None
+
+async def run_notification_engine():
+    """Запуск движка уведомлений в текущем event loop (работает до отмены задачи)"""
+    global _engine
+    _engine = NotificationEngine()
+    try:
+        await _engine.run()
+    finally:
+        _engine = None
+
+def notify_events_changed(user_id: Optional[int] = None):
+    """Сразу обновить напоминания пользователя в движке этого процесса
+
+    Движок в другом процессе найдет изменение в reminder_changes не позже чем
+    через NOTIFICATION_ENGINE_POLL_SECONDS.
+    """
+    if _engine is not None:
+        _engine.notify_changed(user_id)
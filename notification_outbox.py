@@ -0,0 +1,185 @@
+"""Очередь исходящих уведомлений (outbox)
+
+Уведомления сначала сохраняются в таблицу notification_outbox, а отправляет их
+отдельный обработчик: пачками, с повторными попытками при временных ошибках
+(экспоненциальная пауза, retry_after от Telegram) и с пометкой delivered/dead.
+Напоминания отправляются в приоритетной полосе ограничителя; не отправленные
+до начала события помечаются как expired.
+Поэтому таймаут Telegram больше не приводит к потере напоминания, а отправка
+не зависит от проверки событий.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from config import Config
+from rate_limiter import DeadlineExceeded, LANE_REMINDER
+from telegram_client import get_bot
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+# Доставленные и недоставляемые уведомления хранятся неделю
+_RETENTION_SECONDS = 7 * 24 * 3600
+
+def _retry_delay(attempts: int) -> int:
+    """Пауза (в секундах) перед повторной отправкой после attempts неудачных попыток"""
+    delay = Config.OUTBOX_RETRY_BASE_SECONDS * (2 ** min(max(attempts - 1, 0), 16))
+    return min(delay, Config.OUTBOX_RETRY_MAX_SECONDS)
+
+async def drain_outbox(bot: Bot, batch_size: Optional[int] = None) -> Dict[str, int]:
+    """Отправка готовых уведомлений из outbox
+
+    Returns:
+        Количество доставленных (delivered), отложенных (retried), недоставляемых (dead)
+        и устаревших (expired) уведомлений
+    """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+    stats = {'delivered': 0, 'retried': 0, 'dead': 0, 'expired': 0}
+
+    while True:
+        now_ts = int(time.time())
+        batch = db.claim_outbox_batch(now_ts, batch_size, Config.OUTBOX_LEASE_SECONDS)
+        if not batch:
+            break
+
+        for index, item in enumerate(batch):
+            outbox_id = item['id']
+            user_id = item['user_id']
+            deadline_at = item.get('deadline_at')
+            if deadline_at and time.time() >= deadline_at:
+                db.mark_outbox_expired(outbox_id, 'Срок отправки истек до попытки')
+                stats['expired'] += 1
+                logger.warning(f"Уведомление {outbox_id} пользователю {user_id} устарело и не отправлено")
+                continue
+            try:
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=item['text'],
+                    rate_limit_args={'lane': LANE_REMINDER, 'deadline': deadline_at}
+                )
+                db.mark_outbox_delivered(outbox_id, int(time.time()))
+                stats['delivered'] += 1
+                logger.info(f"Уведомление {outbox_id} доставлено пользователю {user_id}")
+
+            except RetryAfter as e:
+                # Ограничение частоты действует на всего бота: откладываем остаток пачки
+                retry_at = int(time.time()) + int(e.retry_after) + 1
+                logger.warning(f"Telegram ограничил частоту отправки, пауза {e.retry_after} с")
+                for pending in batch[index:]:
+                    db.reschedule_outbox(pending['id'], retry_at, str(e), count_attempt=False)
+                stats['retried'] += len(batch) - index
+                return stats
+
+            except DeadlineExceeded as e:
+                db.mark_outbox_expired(outbox_id, str(e))
+                stats['expired'] += 1
+                logger.warning(f"Уведомление {outbox_id} пользователю {user_id} не успело получить место в лимите до начала события")
+
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота, не запускал его или сообщение некорректно
+                db.mark_outbox_dead(outbox_id, str(e))
+                stats['dead'] += 1
+                logger.warning(f"Уведомление {outbox_id} пользователю {user_id} не может быть доставлено: {e}")
+
+            except Exception as e:
+                # Таймауты, сетевые и прочие временные ошибки
+                attempts = item['attempts'] + 1
+                if attempts >= Config.OUTBOX_MAX_ATTEMPTS:
+                    db.mark_outbox_dead(outbox_id, str(e))
+                    stats['dead'] += 1
+                    logger.error(f"Уведомление {outbox_id} пользователю {user_id} не доставлено после {attempts} попыток: {e}")
+                else:
+                    delay = _retry_delay(attempts)
+                    db.reschedule_outbox(outbox_id, int(time.time()) + delay, str(e))
+                    stats['retried'] += 1
+                    level = logging.WARNING if isinstance(e, TelegramError) else logging.ERROR
+                    logger.log(level, f"Ошибка отправки уведомления {outbox_id} пользователю {user_id}, повтор через {delay} с: {e}")
+
+        if len(batch) < batch_size:
+            break
+
+    if any(stats.values()):
+        logger.info(f"Outbox: доставлено {stats['delivered']}, отложено {stats['retried']}, "
+                    f"недоставляемых {stats['dead']}, устаревших {stats['expired']}")
+    return stats
+
+async def drain_outbox_once():
+    """Однократная отправка очереди (для планировщика и cron endpoint)"""
+    token = Config.get_telegram_token()
+    if not token:
+        logger.warning("TELEGRAM_BOT_TOKEN не установлен. Пропуск отправки уведомлений.")
+        return
+    try:
+        await drain_outbox(await get_bot())
+        db.delete_old_outbox(int(time.time()) - _RETENTION_SECONDS)
+    except Exception as e:
+        logger.error(f"Ошибка при отправке очереди уведомлений: {e}", exc_info=True)
+
+class OutboxWorker:
+    """Долгоживущий обработчик outbox для процесса бота"""
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def run(self):
+        """Основной цикл обработчика"""
+        token = Config.get_telegram_token()
+        if not token:
+            logger.warning("TELEGRAM_BOT_TOKEN не установлен. Обработчик outbox не запущен.")
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.info("Обработчик очереди уведомлений запущен")
+
+        last_cleanup = 0
+        while True:
+            try:
+                await drain_outbox(await get_bot())
+                if time.time() - last_cleanup >= 3600:
+                    db.delete_old_outbox(int(time.time()) - _RETENTION_SECONDS)
+                    last_cleanup = time.time()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике очереди уведомлений: {e}", exc_info=True)
+
+            # Спим до новых уведомлений или до следующей проверки (повторные попытки)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), Config.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def wake(self):
+        """Разбудить обработчик после постановки уведомлений в очередь (потокобезопасно)"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+# Обработчик, запущенный в текущем процессе (если есть)
+_worker: Optional[OutboxWorker] = None
+
+async def run_outbox_worker():
+    """Запуск обработчика outbox в текущем event loop (работает до отмены задачи)"""
+    global _worker
+    _worker = OutboxWorker()
+    try:
+        await _worker.run()
+    finally:
+        _worker = None
+
+def notify_outbox() -> bool:
+    """Разбудить обработчик outbox этого процесса
+
+    Returns:
+        True, если в процессе работает обработчик; иначе очередь нужно отправить самостоятельно
+    """
+    if _worker is None:
+        return False
+    _worker.wake()
+    return True
@@ -0,0 +1,63 @@
+"""Параллельная загрузка коллекций календарей
+
+Коллекции одного подключения (календари Google, коллекции CalDAV Yandex)
+загружаются одновременно в потоках (asyncio.to_thread), но число
+одновременных загрузок у каждого провайдера ограничено
+(GOOGLE_FETCH_CONCURRENCY, YANDEX_FETCH_CONCURRENCY). Синхронизация
+запускается в разных event loop (планировщик, очередь синхронизации, cron
+endpoints), поэтому ограничение общее для процесса - threading.BoundedSemaphore.
+Перед загрузкой каждой коллекции продлевается аренда синхронизации подключения:
+коллекция может долго ждать семафор, а загрузка - идти по страницам с повторами.
+"""
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import Config
+from job_lease import Lease, LeaseLostError
+
+_limits: Dict[str, threading.BoundedSemaphore] = {}
+_limits_lock = threading.Lock()
+
+def _limit(provider: str) -> threading.BoundedSemaphore:
+    with _limits_lock:
+        if provider not in _limits:
+            concurrency = {
+                'google': Config.GOOGLE_FETCH_CONCURRENCY,
+                'yandex': Config.YANDEX_FETCH_CONCURRENCY
+            }.get(provider, 1)
+            _limits[provider] = threading.BoundedSemaphore(max(concurrency, 1))
+        return _limits[provider]
+
+def _call_limited(provider: str, fetch: Callable[[Any], Any], collection: Any, lease: Optional[Lease]) -> Any:
+    with _limit(provider):
+        if lease is not None:
+            lease.ensure_held()
+        return fetch(collection)
+
+async def fetch_collections(provider: str, collections: List[Any], fetch: Callable[[Any], Any],
+                            lease: Optional[Lease] = None) -> List[Tuple[Any, Any, Optional[Exception]]]:
+    """Вызов fetch(коллекция) для всех коллекций параллельно
+
+    Ошибка одной коллекции не прерывает загрузку остальных.
+
+    Raises:
+        LeaseLostError: аренда lease потеряна во время загрузки
+
+    Returns:
+        Кортежи (коллекция, результат, ошибка) в порядке collections
+    """
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_call_limited, provider, fetch, collection, lease) for collection in collections),
+        return_exceptions=True
+    )
+    outcomes = []
+    for collection, result in zip(collections, results):
+        if isinstance(result, LeaseLostError):
+            raise result
+        if isinstance(result, Exception):
+            outcomes.append((collection, None, result))
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            outcomes.append((collection, result, None))
+    return outcomes
@@ -0,0 +1,289 @@
+"""Общий ограничитель частоты запросов к Telegram Bot API
+
+Уведомления, рассылки и ответы бота отправляются через один ограничитель на процесс:
+общий лимит сообщений в секунду, лимит на один чат и автоматическое замедление
+после ошибки 429 (RetryAfter). Общий лимит делится между полосами приоритета:
+напоминания, затем ответы пользователям, затем рассылки. Ограничитель потокобезопасен и не привязан к event loop,
+поэтому его разделяют задачи планировщика Flask, работающие в разных потоках.
+
+Корзины ограничителя не разделяются между процессами: веб-приложение и процесс
+бота (run_bot.py) отправляют сообщения одним ботом независимо. Поэтому каждому
+процессу достается равная доля общего лимита бота: TELEGRAM_GLOBAL_RATE /
+TELEGRAM_SENDER_PROCESSES (по умолчанию 25 / 2 сообщения в секунду), и вместе
+они не превышают лимит Telegram в 30 сообщений в секунду. Лимит на чат
+действует в каждом процессе отдельно.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# После RetryAfter общий лимит снижается вдвое, но не ниже этой доли от настроенного
+_MIN_SLOWDOWN = 0.1
+
+# Полосы приоритета: при нехватке общего лимита токены делятся пропорционально весам
+LANE_REMINDER = 'reminder'
+LANE_INTERACTIVE = 'interactive'
+LANE_BROADCAST = 'broadcast'
+LANE_WEIGHTS = {
+    LANE_REMINDER: 8,
+    LANE_INTERACTIVE: 4,
+    LANE_BROADCAST: 1,
+}
+
+# Неиспользуемые корзины чатов удаляются, когда их становится больше этого числа
+_MAX_CHAT_BUCKETS = 10000
+
+class DeadlineExceeded(Exception):
+    """Запрос не успел получить место в лимите до своего срока"""
+
+    def __init__(self, deadline: float):
+        super().__init__(f"Срок отправки истек ({deadline:.0f})")
+        self.deadline = deadline
+
+class TokenBucket:
+    """Корзина токенов: пополняется со скоростью rate токенов в секунду, не более capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0, если токен есть)"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+class TelegramRateLimiter:
+    """Общий лимит + лимит на чат + пауза и замедление после RetryAfter"""
+
+    def __init__(self, global_rate: float, chat_rate: float, group_chat_per_minute: float,
+                 recovery_seconds: float = 60):
+        self._lock = threading.Lock()
+        self._global_rate = global_rate
+        self._chat_rate = chat_rate
+        self._group_rate = group_chat_per_minute / 60
+        self._recovery_seconds = recovery_seconds
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._slowdown = 1.0  # Доля от настроенного общего лимита
+        self._slowdown_updated = time.monotonic()
+        # Очереди ожидающих общий токен по полосам и их виртуальное время
+        self._waiting: Dict[str, Deque[int]] = {lane: deque() for lane in LANE_WEIGHTS}
+        self._lane_time: Dict[str, float] = {lane: 0.0 for lane in LANE_WEIGHTS}
+        self._virtual_time = 0.0
+        self._tickets = itertools.count()
+
+    @staticmethod
+    def _is_group(chat_id: Any) -> bool:
+        try:
+            return int(chat_id) < 0
+        except (TypeError, ValueError):
+            return True  # @username канала или группы
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full(now)}
+            rate = self._group_rate if self._is_group(chat_id) else self._chat_rate
+            bucket = TokenBucket(rate, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _recover(self, now: float):
+        """Постепенное возвращение общего лимита к настроенному после замедления"""
+        if self._slowdown < 1.0 and now >= self._paused_until:
+            elapsed = now - max(self._slowdown_updated, self._paused_until)
+            self._slowdown = min(1.0, self._slowdown + elapsed / self._recovery_seconds)
+            self._global.rate = self._global_rate * self._slowdown
+        self._slowdown_updated = now
+
+    def _reserve_chat(self, chat_id: Any, now: float) -> float:
+        """Занять место в лимите чата; возвращает, сколько ждать до своей очереди в чате"""
+        bucket = self._chat_bucket(chat_id, now)
+        bucket.refill(now)
+        bucket.consume()  # Баланс может уйти в минус: следующие сообщения в чат ждут дольше
+        return 0.0 if bucket.tokens >= 0 else -bucket.tokens / bucket.rate
+
+    def _refund_chat(self, chat_id: Any, now: float):
+        """Вернуть место в лимите чата, занятое запросом, который не был отправлен"""
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            bucket.refill(now)
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    def _select_lane(self) -> Optional[str]:
+        """Полоса, чей запрос получит следующий общий токен (взвешенная справедливая очередь)"""
+        selected, selected_finish = None, None
+        for lane, waiters in self._waiting.items():
+            if not waiters:
+                continue
+            finish = self._lane_time[lane] + 1 / LANE_WEIGHTS[lane]
+            if selected_finish is None or finish < selected_finish:
+                selected, selected_finish = lane, finish
+        return selected
+
+    def _try_acquire(self, lane: str, ticket: int, now: float) -> float:
+        """Выдать общий токен, если очередь дошла до ticket; иначе вернуть время ожидания"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._recover(now)
+
+        wait = self._global.wait_time(now)
+        if wait > 0:
+            return wait
+        if self._waiting[lane][0] != ticket or self._select_lane() != lane:
+            return 1 / self._global.rate  # Токен достанется другому запросу, проверим позже
+
+        self._global.consume()
+        self._waiting[lane].popleft()
+        # Виртуальное время полосы растет обратно пропорционально ее весу
+        self._virtual_time = max(self._virtual_time, self._lane_time[lane])
+        self._lane_time[lane] += 1 / LANE_WEIGHTS[lane]
+        return 0.0
+
+    async def acquire(self, chat_id: Any = None, lane: str = LANE_INTERACTIVE,
+                      deadline: Optional[float] = None):
+        """Дождаться возможности отправить запрос в чат chat_id
+
+        Запросы без чата ждут только паузы после RetryAfter. Общие токены распределяются
+        между полосами по весам LANE_WEIGHTS. Если запрос не получил токен до deadline
+        (unix time), возбуждается DeadlineExceeded.
+        """
+        if lane not in LANE_WEIGHTS:
+            lane = LANE_INTERACTIVE
+
+        if chat_id is None:
+            while True:
+                with self._lock:
+                    wait = self._paused_until - time.monotonic()
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+
+        with self._lock:
+            chat_wait = self._reserve_chat(chat_id, time.monotonic())
+        try:
+            if chat_wait > 0:
+                if deadline is not None and time.time() + chat_wait > deadline:
+                    raise DeadlineExceeded(deadline)
+                await asyncio.sleep(chat_wait)
+            await self._acquire_global(lane, deadline)
+        except BaseException:
+            # Запрос не будет отправлен (истек срок или задача отменена): место в лимите чата
+            # возвращается, иначе следующее сообщение в этот чат ждало бы напрасно
+            with self._lock:
+                self._refund_chat(chat_id, time.monotonic())
+            raise
+
+    async def _acquire_global(self, lane: str, deadline: Optional[float]):
+        """Дождаться общего токена в очереди полосы lane"""
+        with self._lock:
+            ticket = next(self._tickets)
+            if not self._waiting[lane]:
+                # Полоса после простоя не получает накопленного преимущества
+                self._lane_time[lane] = max(self._lane_time[lane], self._virtual_time)
+            self._waiting[lane].append(ticket)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(lane, ticket, time.monotonic())
+                if wait <= 0:
+                    return
+                if deadline is not None and time.time() + wait > deadline:
+                    raise DeadlineExceeded(deadline)
+                await asyncio.sleep(wait)
+        except BaseException:
+            with self._lock:
+                if ticket in self._waiting[lane]:
+                    self._waiting[lane].remove(ticket)
+            raise
+
+    def on_retry_after(self, retry_after: float):
+        """Остановить отправку на retry_after секунд и снизить общий лимит"""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + float(retry_after))
+            self._slowdown = max(self._slowdown / 2, _MIN_SLOWDOWN)
+            self._slowdown_updated = now
+            self._global.rate = self._global_rate * self._slowdown
+            self._global.tokens = min(self._global.tokens, 0)
+        logger.warning(f"Telegram RetryAfter: пауза {retry_after} с, общий лимит снижен до "
+                       f"{self._global_rate * self._slowdown:.1f} сообщений/с")
+
+def process_global_rate() -> float:
+    """Доля общего лимита бота (сообщений в секунду) для этого процесса"""
+    return Config.TELEGRAM_GLOBAL_RATE / max(Config.TELEGRAM_SENDER_PROCESSES, 1)
+
+# Ограничитель, общий для всех ботов процесса
+telegram_limiter = TelegramRateLimiter(
+    process_global_rate(),
+    Config.TELEGRAM_PER_CHAT_RATE,
+    Config.TELEGRAM_GROUP_CHAT_PER_MINUTE
+)
+
+class BotRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """Адаптер общего ограничителя для python-telegram-bot (ExtBot и Application)
+
+    Полоса и срок передаются через rate_limit_args: {'lane': LANE_BROADCAST}
+    или {'lane': LANE_REMINDER, 'deadline': unix time}. По умолчанию - LANE_INTERACTIVE.
+    """
+
+    def __init__(self, limiter: Optional[TelegramRateLimiter] = None, max_retries: Optional[int] = None):
+        self._limiter = limiter or telegram_limiter
+        self._max_retries = Config.TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        chat_id = data.get('chat_id') if data else None
+        rate_limit_args = rate_limit_args or {}
+        lane = rate_limit_args.get('lane', LANE_INTERACTIVE)
+        deadline = rate_limit_args.get('deadline')
+        attempt = 0
+        while True:
+            await self._limiter.acquire(chat_id, lane, deadline)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._limiter.on_retry_after(e.retry_after)
+                if attempt >= self._max_retries:
+                    raise
+                attempt += 1
+                logger.info(f"Повтор запроса {endpoint} после RetryAfter (попытка {attempt})")
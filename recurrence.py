@@ -0,0 +1,145 @@
+"""Локальное развертывание повторяющихся событий (RRULE, RFC 5545)
+
+CalDAV возвращает повторяющееся событие одним master-VEVENT с RRULE, RDATE и
+EXDATE. Вместо того чтобы просить сервер развернуть серию при каждой
+синхронизации, правило сохраняется в таблице recurring_events, когда ресурс
+загружается (неизмененные ресурсы повторно не загружаются, см. caldav_sync.py),
+а экземпляры разворачиваются локально и только на ближайший горизонт
+RECURRENCE_HORIZON_DAYS: в кэш событий и напоминания попадают лишь экземпляры,
+напоминания о которых скоро понадобятся. Измененные экземпляры (RECURRENCE-ID)
+приходят отдельными событиями и заменяют экземпляр серии с тем же исходным временем.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+from dateutil.rrule import rrulestr
+from config import Config
+from database import Database
+from ical_parser import from_utc, parse_local_datetime, to_utc
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+def _rule_to_json(recurrence: Dict, overridden: List[datetime]) -> Dict:
+    """Правило серии в виде, пригодном для JSON (даты - ISO 8601)"""
+    return {
+        'rrule': recurrence['rrule'],
+        'start': recurrence['start'].isoformat(),
+        'tzid': recurrence['tzid'],
+        'all_day': recurrence['all_day'],
+        'duration': recurrence['duration'],
+        'rdates': [value.isoformat() for value in recurrence['rdates']],
+        'exdates': [value.isoformat() for value in recurrence['exdates'] + overridden]
+    }
+
+def _local_until(rrule: str, tzid: str, all_day: bool) -> str:
+    """RRULE, в котором UNTIL указан во времени DTSTART
+
+    dateutil требует, чтобы UNTIL и DTSTART были одного вида (оба с часовым
+    поясом или оба без), поэтому серия разворачивается в наивном местном времени.
+    """
+    parts = rrule.split(';')
+    for index, part in enumerate(parts):
+        name, _, value = part.partition('=')
+        if name.strip().upper() != 'UNTIL':
+            continue
+        until, until_all_day, until_tzid = parse_local_datetime(value)
+        if until_tzid == 'UTC':
+            until = from_utc(until, tzid)
+        elif until_all_day and not all_day:
+            # UNTIL-дата для серии со временем включает весь этот день
+            until += timedelta(days=1, seconds=-1)
+        parts[index] = f"UNTIL={until:%Y%m%dT%H%M%S}"
+    return ';'.join(parts)
+
+def occurrence_starts(rule: Dict, time_min: datetime, time_max: datetime) -> List[datetime]:
+    """Начала экземпляров серии в диапазоне [time_min, time_max] (наивное время UTC) по возрастанию"""
+    start = datetime.fromisoformat(rule['start'])
+    tzid = rule['tzid']
+    starts = {to_utc(start, tzid)}
+    starts.update(datetime.fromisoformat(value) for value in rule['rdates'])
+    if rule['rrule']:
+        try:
+            recurrence = rrulestr(_local_until(rule['rrule'], tzid, rule['all_day']), dtstart=start)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Некорректное правило повторения '{rule['rrule']}': {e}")
+        else:
+            # Повторения считаются по часам часового пояса DTSTART; окно расширено на сутки
+            # с каждой стороны, чтобы учесть разницу с UTC, и затем уточняется в UTC
+            local_min = from_utc(time_min, tzid) - timedelta(days=1)
+            local_max = from_utc(time_max, tzid) + timedelta(days=1)
+            starts.update(to_utc(value, tzid) for value in recurrence.between(local_min, local_max, inc=True))
+
+    excluded = {datetime.fromisoformat(value) for value in rule['exdates']}
+    return sorted(value for value in starts if time_min <= value <= time_max and value not in excluded)
+
+def expand_series(user_id: int, calendar_type: str, time_min: datetime, time_max: datetime) -> List[Dict]:
+    """Экземпляры всех сохраненных серий подключения в диапазоне, в формате адаптеров календаря"""
+    events = []
+    for series in db.get_recurring_events(user_id, calendar_type):
+        rule = series['rule']
+        duration = timedelta(seconds=rule['duration'])
+        for start in occurrence_starts(rule, time_min, time_max):
+            events.append({
+                'id': series['event_id'],
+                'summary': series['summary'],
+                'description': series['description'],
+                'location': series['location'],
+                'start': start,
+                'end': start + duration,
+                'htmlLink': series['html_link']
+            })
+    return events
+
+def apply_sync(user_id: int, calendar_type: str, events: List[Dict], time_min: datetime, time_max: datetime,
+               full: bool, changed_ids: Iterable[str] = ()) -> List[Dict]:
+    """Сохранение серий из результата синхронизации и развертывание экземпляров
+
+    Args:
+        events: события из календаря, в том числе master-события серий (поле recurrence)
+        full: загружены все события календаря - сохраненные серии, которых нет среди events, удаляются
+        changed_ids: UID измененных и удаленных событий (инкрементальная синхронизация);
+            их серии удаляются, если событие больше не повторяется
+
+    Returns:
+        Обычные события и измененные экземпляры из диапазона, а также экземпляры
+        всех сохраненных серий от текущего момента до горизонта RECURRENCE_HORIZON_DAYS
+    """
+    plain = []
+    series = []
+    overridden: Dict[str, List[datetime]] = {}
+    for event in events:
+        if 'recurrence' in event:
+            series.append(event)
+            continue
+        if 'recurrence_id' in event:
+            # Исходное время измененного экземпляра исключается из серии, даже если
+            # сам экземпляр перенесен за пределы диапазона
+            overridden.setdefault(event['id'], []).append(event['recurrence_id'])
+            if not time_min <= event['start'] <= time_max:
+                continue
+        plain.append(event)
+
+    series_ids = {event['id'] for event in series}
+    db.save_recurring_events(
+        user_id, calendar_type,
+        [{
+            'event_id': event['id'],
+            'summary': event.get('summary'),
+            'description': event.get('description'),
+            'location': event.get('location'),
+            'html_link': event.get('htmlLink'),
+            'rule': _rule_to_json(event['recurrence'], overridden.get(event['id'], []))
+        } for event in series],
+        removed_ids=[event_id for event_id in changed_ids if event_id not in series_ids],
+        replace_all=full
+    )
+
+    now = datetime.utcnow().replace(microsecond=0)
+    horizon = min(time_max, now + timedelta(days=Config.RECURRENCE_HORIZON_DAYS))
+    occurrences = expand_series(user_id, calendar_type, now, horizon)
+    if series or occurrences:
+        logger.info(f"Повторяющиеся события {calendar_type} пользователя {user_id}: обновлено серий {len(series)}, "
+                    f"экземпляров до {horizon:%Y-%m-%d %H:%M}: {len(occurrences)}")
+    return plain + occurrences
@@ -4,6 +4,9 @@ import logging
 import sys
 from bot import setup_bot
 from config import Config
+from notification_engine import run_notification_engine
+from notification_outbox import run_outbox_worker
+from telegram_client import shutdown_bot, use_application_bot
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,6 +25,8 @@ async def main():
         
         # Настройка бота
         application = setup_bot()
+        # Отправители процесса используют бота приложения и его пул соединений
+        use_application_bot(application.bot)
         
         # Инициализируем приложение
         await application.initialize()
@@ -37,12 +42,26 @@ async def main():
             allowed_updates=None
         )
         
+        # Запускаем движок уведомлений с точным временем срабатывания
+        engine_task = None
+        if Config.NOTIFICATION_ENGINE_ENABLED:
+            engine_task = asyncio.create_task(run_notification_engine())
+        
+        # Отправка уведомлений из очереди с повторными попытками
+        outbox_task = asyncio.create_task(run_outbox_worker())
+        
         # Ждем остановки
         try:
             await asyncio.Event().wait()  # Ждем бесконечно
         except KeyboardInterrupt:
             logger.info("Остановка бота...")
         finally:
+            # Останавливаем движок уведомлений
+            if engine_task:
+                engine_task.cancel()
+            outbox_task.cancel()
+            # Закрываем общий клиент Telegram
+            await shutdown_bot()
             # Останавливаем updater
             await application.updater.stop()
             # Останавливаем приложение
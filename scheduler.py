@@ -1,12 +1,23 @@
 """Планировщик проверки событий"""
+import asyncio
+import json
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Set
-from database import Database
+from typing import List, Dict, Optional, Set
+from database import Database, to_timestamp
 from calendar_google import GoogleCalendar
-from calendar_yandex import YandexCalendar
-from telegram import Bot
+from calendar_yandex import YandexCalendar, CalDAVDiscoveryError
+from telegram_client import get_bot
 from config import Config
+from sync_planner import next_sync_interval, order_by_deadline, filter_current_slice, current_stagger_tick
+from notification_engine import notify_events_changed
+from notification_outbox import drain_outbox, notify_outbox
+from job_lease import Lease, LeaseLostError, job_lease
+from parallel_fetch import fetch_collections
+import caldav_sync
+import google_push
+import recurrence
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,142 +26,368 @@ db = Database()
 google_cal = GoogleCalendar()
 yandex_cal = YandexCalendar()
 
+# Системная настройка со временем последней проверки напоминаний: по ней определяется простой
+# и нужно ли ограничивать догоняющую отправку REMINDER_MAX_CATCHUP_MINUTES
+REMINDER_WATERMARK_KEY = 'reminders_watermark'
+
+# Системная настройка с номером последнего обработанного шага режима распределения
+STAGGER_TICK_KEY = 'sync_stagger_tick'
+
+class CalendarSyncError(Exception):
+    """Ошибка получения событий из календаря при синхронизации"""
+
 async def check_and_notify_events():
-    """Проверка событий и отправка уведомлений из кэшированной БД"""
+    """Проверка напоминаний и постановка уведомлений в outbox
+    
+    Напоминания заранее рассчитаны в таблице reminders, поэтому проверка - это
+    один проход по индексу: fire_at <= now AND status = 'pending'.
+    """
     try:
         logger.info("=== Начало проверки событий ===")
         token = Config.get_telegram_token()
         if not token:
             logger.warning("TELEGRAM_BOT_TOKEN не установлен. Пропуск проверки событий.")
             return
-        bot = Bot(token=token)
-        active_users = db.get_all_active_users()
-        logger.info(f"Найдено активных пользователей: {len(active_users)}")
+        bot = await get_bot()
         
-        if not active_users:
-            logger.info("Нет активных пользователей с подключенными календарями")
-            return
-        
-        for user_id in active_users:
-            try:
-                logger.info(f"Обработка пользователя {user_id}")
-                settings = db.get_notification_settings(user_id)
-                if not settings.get('enabled', True):
-                    logger.info(f"Уведомления отключены для пользователя {user_id}")
-                    continue
-                
-                notification_minutes = settings.get('notification_minutes', 15)
-                logger.info(f"Интервал уведомлений для пользователя {user_id}: {notification_minutes} минут")
-                
-                # Получаем события из кэшированной БД
-                now = datetime.utcnow()
-                target_time = now + timedelta(minutes=notification_minutes)
-                logger.info(f"Проверка событий между {now} и {target_time}")
-                
-                # Получаем события из БД для этого временного диапазона
-                events = db.get_events_for_notification(user_id, now, target_time)
-                logger.info(f"Найдено {len(events)} событий в БД для пользователя {user_id} в диапазоне уведомлений")
-                
-                events_to_notify = 0
-                for event in events:
-                    event_start = event['start']
-                    calendar_type = event['calendar_type']
-                    event_id = event['event_id']
-                    
-                    logger.debug(f"Событие: {event.get('summary', 'N/A')} в {event_start}")
-                    
-                    # Проверяем, нужно ли отправить уведомление
-                    if now <= event_start <= target_time:
-                        logger.info(f"Событие '{event.get('summary', 'N/A')}' попадает в диапазон уведомлений")
-                        # Проверяем, не отправляли ли уже уведомление
-                        if not db.is_notification_sent(user_id, calendar_type, event_id, event_start):
-                            logger.info(f"Отправка уведомления о событии '{event.get('summary', 'N/A')}' пользователю {user_id}")
-                            # Преобразуем формат события для совместимости с send_notification
-                            event_dict = {
-                                'id': event_id,
-                                'summary': event.get('summary'),
-                                'description': event.get('description'),
-                                'location': event.get('location'),
-                                'start': event_start,
-                                'end': event.get('end'),
-                                'htmlLink': event.get('html_link')
-                            }
-                            await send_notification(bot, user_id, event_dict, calendar_type)
-                            db.mark_notification_sent(user_id, calendar_type, event_id, event_start)
-                            events_to_notify += 1
-                        else:
-                            logger.info(f"Уведомление о событии '{event.get('summary', 'N/A')}' уже отправлено ранее")
-                    else:
-                        logger.debug(f"Событие '{event.get('summary', 'N/A')}' не попадает в диапазон (start: {event_start})")
-                
-                logger.info(f"Отправлено уведомлений для пользователя {user_id}: {events_to_notify}")
+        # Проверку выполняет только один процесс (веб-воркеры, бот, cron)
+        with job_lease('check_events') as lease:
+            if lease is None:
+                return
+            ensure_reminders_initialized()
             
-            except Exception as e:
-                logger.error(f"Ошибка при обработке пользователя {user_id}: {e}", exc_info=True)
+            now_ts = int(time.time())
+            expired = db.expire_reminders(now_ts)
+            if expired:
+                logger.info(f"Просрочено напоминаний о начавшихся событиях: {expired}")
+            
+            expire_missed_reminders(now_ts)
+            # Выбираются все ожидающие наступившие напоминания, в том числе добавленные
+            # другим процессом с временем раньше прошлой проверки
+            reminders = db.get_due_reminders(now_ts)
+            logger.info(f"Напоминаний к отправке: {len(reminders)}")
+            
+            queued = deliver_due_reminders(reminders, now_ts)
+            
+            # Watermark (время последней проверки) записывается только при действующей аренде:
+            # иначе процесс, потерявший аренду, мог бы сдвинуть его после проверки нового владельца
+            if not db.set_system_setting_fenced(REMINDER_WATERMARK_KEY, str(now_ts), lease.name,
+                                                lease.token, int(time.time())):
+                logger.warning("Аренда проверки событий истекла, watermark не обновлен")
+            
+            # Если в процессе нет обработчика outbox (cron, веб-приложение), отправляем очередь сами
+            if not notify_outbox():
+                await drain_outbox(bot)
         
-        logger.info("=== Завершение проверки событий ===")
+        logger.info(f"=== Завершение проверки событий: в очередь поставлено {queued} ===")
     
     except Exception as e:
         logger.error(f"Ошибка при проверке событий: {e}", exc_info=True)
 
-async def get_events_for_calendar(connection: Dict, calendar_type: str) -> List[Dict]:
-    """Получение событий для календаря"""
-    try:
-        if calendar_type == 'google':
-            from google.oauth2.credentials import Credentials
-            from google.auth.transport.requests import Request
-            from googleapiclient.errors import HttpError
-            
-            logger.info(f"Google Calendar: получение событий для пользователя {connection['user_id']}")
-            
-            # Восстанавливаем credentials
-            token_data = {
-                'token': connection['access_token'],
-                'refresh_token': connection.get('refresh_token'),
-                'token_uri': 'https://oauth2.googleapis.com/token',
-                'client_id': Config.get_google_client_id(),
-                'client_secret': Config.get_google_client_secret(),
-                'scopes': Config.GOOGLE_SCOPES
-            }
-            
-            # Проверяем наличие обязательных данных
-            if not token_data['client_id']:
-                logger.error("Google Calendar: Client ID не установлен")
-                return []
-            
-            if not token_data['client_secret']:
-                logger.error("Google Calendar: Client Secret не установлен")
-                return []
-            
+def expire_missed_reminders(now_ts: int):
+    """Просрочка напоминаний, пропущенных при простое дольше допустимого отставания
+    
+    Простой определяется по watermark - времени прошлой проверки. Если проверка
+    не выполнялась дольше двух интервалов CHECK_INTERVAL_MINUTES (или watermark
+    еще не записан), напоминания, время которых прошло раньше
+    REMINDER_MAX_CATCHUP_MINUTES назад, помечаются как просроченные, а более
+    поздние отправляются при этой проверке. Без простоя отправляются все ожидающие
+    напоминания: старые среди них добавлены другим процессом задним числом.
+    """
+    watermark = db.get_system_setting(REMINDER_WATERMARK_KEY)
+    lag = now_ts - int(watermark) if watermark else None
+    if lag is not None and lag <= Config.CHECK_INTERVAL_MINUTES * 60 * 2:
+        return
+    
+    if lag is not None:
+        logger.warning(f"Предыдущая проверка напоминаний была {lag // 60} минут назад, "
+                       f"напоминания за последние {Config.REMINDER_MAX_CATCHUP_MINUTES} минут будут отправлены")
+    missed = db.expire_missed_reminders(now_ts - Config.REMINDER_MAX_CATCHUP_MINUTES * 60)
+    if missed:
+        logger.warning(f"Пропущено напоминаний из-за простоя дольше {Config.REMINDER_MAX_CATCHUP_MINUTES} минут: {missed}")
+
+def ensure_reminders_initialized():
+    """Однократное построение напоминаний для событий, закэшированных до появления таблицы reminders"""
+    if db.get_system_setting('reminders_initialized'):
+        return
+    created = db.rebuild_all_reminders()
+    db.set_system_setting('reminders_initialized', 'true')
+    logger.info(f"Таблица напоминаний заполнена: {created} записей")
+
+def deliver_due_reminders(reminders: List[Dict], now_ts: int) -> int:
+    """Постановка наступивших напоминаний в outbox
+    
+    В режиме дайджеста (Config.is_notification_digest_enabled) напоминания одного
+    пользователя вместе с его напоминаниями, наступающими в ближайшие
+    NOTIFICATION_DIGEST_WINDOW_SECONDS, объединяются в одно сообщение.
+    
+    Returns:
+        Количество напоминаний, поставленных в очередь
+    """
+    if not Config.is_notification_digest_enabled():
+        queued = 0
+        for reminder in reminders:
             try:
-                creds = Credentials.from_authorized_user_info(token_data)
+                if deliver_reminder(reminder):
+                    queued += 1
             except Exception as e:
-                logger.error(f"Google Calendar: ошибка при создании credentials: {e}")
-                return []
-            
-            # Обновляем токен, если истек
-            if creds.expired and creds.refresh_token:
-                logger.info("Google Calendar: токен истек, обновляем...")
-                try:
-                    creds.refresh(Request())
-                    logger.info("Google Calendar: токен успешно обновлен")
-                    # Сохраняем обновленный токен
+                logger.error(f"Ошибка при обработке напоминания пользователю {reminder['user_id']}: {e}", exc_info=True)
+        return queued
+    
+    by_user: Dict[int, Dict[int, Dict]] = {}
+    for reminder in reminders:
+        by_user.setdefault(reminder['user_id'], {})[reminder['id']] = reminder
+    
+    queued = 0
+    window = Config.NOTIFICATION_DIGEST_WINDOW_SECONDS
+    for user_id, group in by_user.items():
+        try:
+            if window > 0:
+                for reminder in db.get_pending_reminders(now_ts + window, now_ts, user_id):
+                    group.setdefault(reminder['id'], reminder)
+            queued += deliver_digest(user_id, list(group.values()))
+        except Exception as e:
+            logger.error(f"Ошибка при обработке напоминаний пользователю {user_id}: {e}", exc_info=True)
+    return queued
+
+def deliver_digest(user_id: int, reminders: List[Dict]) -> int:
+    """Постановка нескольких напоминаний пользователя в outbox одним сообщением
+    
+    Returns:
+        Количество напоминаний, поставленных в очередь
+    """
+    if len(reminders) == 1:
+        return 1 if deliver_reminder(reminders[0]) else 0
+    
+    reminders = sorted(reminders, key=lambda reminder: reminder['event_start'])
+    text = format_event_digest(user_id, reminders)
+    reminder_ids = [reminder['id'] for reminder in reminders]
+    if not db.enqueue_reminder_notification(reminder_ids, user_id, text, int(time.time()),
+                                            deadline_at=reminders[0]['event_start']):
+        # Часть напоминаний уже обработана другим обработчиком - ставим оставшиеся по одному
+        logger.info(f"Дайджест для пользователя {user_id} не собран, напоминания обрабатываются по отдельности")
+        return sum(1 for reminder in reminders if deliver_reminder(reminder))
+    
+    logger.info(f"Дайджест из {len(reminders)} событий для пользователя {user_id} поставлен в очередь")
+    for reminder in reminders:
+        db.mark_notification_sent(user_id, reminder['calendar_type'], reminder['event_id'], reminder['start'])
+    return len(reminders)
+
+def deliver_reminder(reminder: Dict) -> bool:
+    """Постановка уведомления в outbox, если другой обработчик еще не взял напоминание в работу
+    
+    Returns:
+        True, если уведомление поставлено в очередь
+    """
+    user_id = reminder['user_id']
+    text = format_event_notification(user_id, {
+        'summary': reminder.get('summary'),
+        'description': reminder.get('description'),
+        'location': reminder.get('location'),
+        'start': reminder['start']
+    })
+    # Напоминание о начавшемся событии бесполезно: срок отправки - начало события
+    if not db.enqueue_reminder_notification([reminder['id']], user_id, text, int(time.time()),
+                                            deadline_at=reminder['event_start']):
+        logger.info(f"Напоминание {reminder['id']} уже обработано ранее")
+        return False
+    
+    logger.info(f"Уведомление о событии '{reminder.get('summary', 'N/A')}' для пользователя {user_id} поставлено в очередь")
+    db.mark_notification_sent(user_id, reminder['calendar_type'], reminder['event_id'], reminder['start'])
+    return True
+
+def format_event_digest(user_id: int, reminders: List[Dict]) -> str:
+    """Текст дайджеста о нескольких событиях на языке пользователя"""
+    from i18n import t
+    
+    items = []
+    for reminder in reminders:
+        item = t("event_digest_item", user_id,
+                 start_time=reminder['start'].strftime('%d.%m.%Y %H:%M'),
+                 title=reminder.get('summary') or 'Event')
+        if reminder.get('location'):
+            item += '\n' + t("event_digest_location", user_id, location=reminder['location'])
+        items.append(item)
+    
+    return t("event_digest", user_id, count=len(items), events='\n\n'.join(items))
+
+def get_yandex_access_token(connection: Dict) -> str:
+    """Access token подключения Yandex (обновляется, если истек)"""
+    access_token = connection['access_token']
+    
+    # Проверяем, не истек ли токен
+    if connection.get('token_expires_at'):
+        try:
+            expires_at_str = connection['token_expires_at']
+            if isinstance(expires_at_str, str):
+                # Обработка разных форматов даты
+                expires_at_str = expires_at_str.replace('Z', '+00:00')
+                if '+' not in expires_at_str and expires_at_str.count(':') == 1:
+                    expires_at_str += '+00:00'
+                expires_at = datetime.fromisoformat(expires_at_str)
+            else:
+                expires_at = expires_at_str
+            if expires_at <= datetime.utcnow() and connection.get('refresh_token'):
+                # Обновляем токен
+                new_token_data = yandex_cal.refresh_access_token(connection['refresh_token'])
+                if new_token_data:
+                    expires_at = datetime.utcnow() + timedelta(seconds=new_token_data.get('expires_in', 3600))
                     db.save_calendar_connection(
                         user_id=connection['user_id'],
-                        calendar_type='google',
-                        access_token=creds.token,
-                        refresh_token=creds.refresh_token,
-                        token_expires_at=creds.expiry,
+                        calendar_type='yandex',
+                        access_token=new_token_data['access_token'],
+                        refresh_token=new_token_data.get('refresh_token'),
+                        token_expires_at=expires_at,
                         calendar_id=connection.get('calendar_id'),
                         calendar_name=connection.get('calendar_name')
                     )
-                except Exception as e:
-                    logger.error(f"Google Calendar: ошибка при обновлении токена: {e}")
-                    logger.warning("Google Calendar: возможно, нужно переподключить календарь")
-                    return []
-            elif creds.expired and not creds.refresh_token:
-                logger.error("Google Calendar: токен истек и нет refresh_token. Нужно переподключить календарь.")
-                return []
+                    access_token = new_token_data['access_token']
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Ошибка при обработке даты истечения токена: {e}")
+    return access_token
+
+async def sync_yandex_incremental(connection: Dict, time_min: datetime, time_max: datetime,
+                                  lease: Optional[Lease] = None) -> Optional[Dict]:
+    """Инкрементальная синхронизация Yandex через sync-collection (см. caldav_sync.py)
+    
+    Returns:
+        Результат caldav_sync.sync_collections или None, если нужна полная загрузка
+    """
+    user_id = connection['user_id']
+    access_token = await asyncio.to_thread(get_yandex_access_token, connection)
+    try:
+        collections = json.loads(connection['collections']) if connection.get('collections') else None
+        if not collections:
+            try:
+                collections = await asyncio.to_thread(yandex_cal.discover_collections, access_token)
+            except CalDAVDiscoveryError as e:
+                # Полная загрузка пробует прежние адреса без повторного поиска
+                connection['discovery_error'] = e
+                return None
+            db.save_collections(user_id, 'yandex', collections)
+            connection['collections'] = json.dumps(collections)
+        return await caldav_sync.sync_collections(user_id, 'yandex', access_token, collections, time_min, time_max,
+                                                  lease=lease)
+    except LeaseLostError:
+        raise
+    except Exception as e:
+        logger.error(f"Yandex CalDAV: ошибка инкрементальной синхронизации: {e}")
+        raise CalendarSyncError(f"Yandex CalDAV: {e}") from e
+
+def get_google_calendar_ids(connection: Dict, creds) -> List[str]:
+    """Календари Google подключения
+    
+    Список из calendarList хранится в подключении и запрашивается заново раз в
+    GOOGLE_CALENDAR_LIST_REFRESH_HOURS (новые и скрытые пользователем календари)
+    или после ответа 404/410 для одного из календарей (список сбрасывается).
+    """
+    cached = json.loads(connection['collections']) if connection.get('collections') else None
+    checked_at = connection.get('collections_checked_at') or 0
+    now_ts = int(time.time())
+    if cached and now_ts - checked_at < Config.GOOGLE_CALENDAR_LIST_REFRESH_HOURS * 3600:
+        return cached
+    try:
+        calendars = google_cal.list_calendars(creds)
+    except Exception as e:
+        logger.warning(f"Google Calendar: не удалось получить список календарей, "
+                       f"используется {'прежний' if cached else 'основной'}: {e}")
+        return cached or ['primary']
+    calendar_ids = [calendar['id'] for calendar in calendars] or ['primary']
+    if calendar_ids != cached:
+        logger.info(f"Google Calendar: календарей для синхронизации: {len(calendar_ids)}")
+    db.save_collections(connection['user_id'], 'google', calendar_ids, now_ts)
+    connection['collections_checked_at'] = now_ts
+    connection['collections'] = json.dumps(calendar_ids)
+    return calendar_ids
+
+def describe_google_error(calendar_id: str, error: Exception) -> str:
+    """Запись ошибки загрузки календаря Google в лог; возвращает ее описание"""
+    from googleapiclient.errors import HttpError
+    
+    if not isinstance(error, HttpError):
+        logger.error(f"Google Calendar: неожиданная ошибка при получении событий календаря {calendar_id}: {error}")
+        return str(error)
+    
+    error_details = error.error_details if hasattr(error, 'error_details') else str(error)
+    status = error.resp.status if hasattr(error, 'resp') else 'unknown'
+    logger.error(f"Google Calendar: HttpError {status} для календаря {calendar_id}: {error_details}")
+    
+    # Специальная обработка ошибки 403
+    if status == 403:
+        reason = error_details[0].get('reason', '') if isinstance(error_details, list) and error_details else ''
+        if 'accessNotConfigured' in str(error_details):
+            logger.error("Google Calendar: API не включен или OAuth не настроен правильно")
+            logger.error("Решение: 1) Включите Google Calendar API в Google Cloud Console")
+            logger.error("         2) Проверьте OAuth Consent Screen")
+            logger.error("         3) Переподключите календарь в боте")
+        else:
+            logger.error(f"Google Calendar: ошибка доступа (403). Причина: {reason}")
+    return f"HttpError {status}: {error_details}"
+
+def get_google_credentials(connection: Dict):
+    """Credentials подключения Google (access token обновляется, если истек)"""
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    
+    # Восстанавливаем credentials
+    token_data = {
+        'token': connection['access_token'],
+        'refresh_token': connection.get('refresh_token'),
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'client_id': Config.get_google_client_id(),
+        'client_secret': Config.get_google_client_secret(),
+        'scopes': Config.GOOGLE_SCOPES
+    }
+    
+    # Проверяем наличие обязательных данных
+    if not token_data['client_id']:
+        logger.error("Google Calendar: Client ID не установлен")
+        raise CalendarSyncError("Google Client ID не установлен")
+    
+    if not token_data['client_secret']:
+        logger.error("Google Calendar: Client Secret не установлен")
+        raise CalendarSyncError("Google Client Secret не установлен")
+    
+    try:
+        creds = Credentials.from_authorized_user_info(token_data)
+    except Exception as e:
+        logger.error(f"Google Calendar: ошибка при создании credentials: {e}")
+        raise CalendarSyncError(f"Ошибка при создании credentials: {e}") from e
+    
+    # Обновляем токен, если истек
+    if creds.expired and creds.refresh_token:
+        logger.info("Google Calendar: токен истек, обновляем...")
+        try:
+            creds.refresh(Request())
+            logger.info("Google Calendar: токен успешно обновлен")
+            # Сохраняем обновленный токен
+            db.save_calendar_connection(
+                user_id=connection['user_id'],
+                calendar_type='google',
+                access_token=creds.token,
+                refresh_token=creds.refresh_token,
+                token_expires_at=creds.expiry,
+                calendar_id=connection.get('calendar_id'),
+                calendar_name=connection.get('calendar_name')
+            )
+        except Exception as e:
+            logger.error(f"Google Calendar: ошибка при обновлении токена: {e}")
+            logger.warning("Google Calendar: возможно, нужно переподключить календарь")
+            raise CalendarSyncError(f"Ошибка при обновлении токена: {e}") from e
+    elif creds.expired and not creds.refresh_token:
+        logger.error("Google Calendar: токен истек и нет refresh_token. Нужно переподключить календарь.")
+        raise CalendarSyncError("Токен истек и нет refresh_token")
+    return creds
+
+async def get_events_for_calendar(connection: Dict, calendar_type: str, lease: Optional[Lease] = None) -> List[Dict]:
+    """Получение событий для календаря"""
+    try:
+        if calendar_type == 'google':
+            from googleapiclient.errors import HttpError
+            
+            logger.info(f"Google Calendar: получение событий для пользователя {connection['user_id']}")
+            # Запросы к API выполняются в потоках: синхронизация идет в общем фоновом loop
+            creds = await asyncio.to_thread(get_google_credentials, connection)
             
             # Используем переданные time_min и time_max, если они есть
             if 'time_min' not in connection or connection.get('time_min') is None:
@@ -163,63 +400,70 @@ async def get_events_for_calendar(connection: Dict, calendar_type: str) -> List[
             else:
                 time_max = connection['time_max']
             
-            try:
-                # Увеличиваем max_results для синхронизации всех событий
-                max_results = connection.get('max_results', 2500)  # Google Calendar API limit
-                events = google_cal.get_upcoming_events(creds, time_min, time_max, max_results=max_results)
-                logger.info(f"Google Calendar: успешно получено {len(events)} событий")
-                return events
-            except HttpError as e:
-                error_details = e.error_details if hasattr(e, 'error_details') else str(e)
-                logger.error(f"Google Calendar: HttpError {e.resp.status if hasattr(e, 'resp') else 'unknown'}: {error_details}")
-                
-                # Специальная обработка ошибки 403
-                if hasattr(e, 'resp') and e.resp.status == 403:
-                    reason = error_details[0].get('reason', '') if isinstance(error_details, list) and error_details else ''
-                    if 'accessNotConfigured' in str(error_details):
-                        logger.error("Google Calendar: API не включен или OAuth не настроен правильно")
-                        logger.error("Решение: 1) Включите Google Calendar API в Google Cloud Console")
-                        logger.error("         2) Проверьте OAuth Consent Screen")
-                        logger.error("         3) Переподключите календарь в боте")
-                    else:
-                        logger.error(f"Google Calendar: ошибка доступа (403). Причина: {reason}")
-                return []
-            except Exception as e:
-                logger.error(f"Google Calendar: неожиданная ошибка при получении событий: {e}", exc_info=True)
-                return []
+            # Границы диапазона округляются до суток: в течение дня запрос не меняется,
+            # и неизмененный календарь отвечает 304 на If-None-Match с прежним ETag
+            time_min = time_min.replace(hour=0, minute=0, second=0, microsecond=0)
+            time_max = time_max.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            
+            # Увеличиваем max_results для синхронизации всех событий
+            max_results = connection.get('max_results', 2500)  # Google Calendar API limit
+            calendar_ids = await asyncio.to_thread(get_google_calendar_ids, connection, creds)
+            # Каналы push-уведомлений регистрируются до загрузки, чтобы не пропустить изменения
+            await google_push.ensure_channels(connection['user_id'], creds, calendar_ids)
+            states = db.get_collection_states(connection['user_id'], 'google')
+            etag_query = f"{time_min:%Y%m%d}-{time_max:%Y%m%d}-{max_results}"
+            
+            def list_calendar_events(calendar_id: str):
+                state = states.get(calendar_id) or {}
+                etag = state.get('etag') if state.get('etag_query') == etag_query else None
+                return google_cal.list_events(creds, calendar_id, time_min, time_max, max_results, etag=etag)
+            
+            # Календари загружаются параллельно; ошибка одного календаря не мешает остальным
+            outcomes = await fetch_collections('google', calendar_ids, list_calendar_events, lease=lease)
+            
+            events = []
+            seen = set()
+            results = []
+            etags = {}
+            errors = []
+            unchanged = 0
+            for calendar_id, listed, error in outcomes:
+                if error is not None:
+                    errors.append(describe_google_error(calendar_id, error))
+                    results.append((calendar_id, errors[-1][:500], None))
+                    if isinstance(error, HttpError) and getattr(error.resp, 'status', None) in (404, 410):
+                        # Календарь удален или скрыт: список календарей ищется заново при следующей синхронизации
+                        db.save_collections(connection['user_id'], 'google', None)
+                    continue
+                calendar_events, etag = listed
+                etags[calendar_id] = (etag, etag_query)
+                if calendar_events is None:
+                    # 304: события календаря в кэше актуальны
+                    unchanged += 1
+                    results.append((calendar_id, None, None))
+                    continue
+                results.append((calendar_id, None, len(calendar_events)))
+                for event in calendar_events:
+                    # Приглашение может быть в нескольких календарях пользователя
+                    key = (event['id'], event['start'])
+                    if key not in seen:
+                        seen.add(key)
+                        events.append(event)
+            # ETag календарей записывается только владельцем аренды подключения
+            if lease is not None:
+                lease.ensure_held(renew=True)
+            db.record_collection_results(connection['user_id'], 'google', results, calendar_ids, int(time.time()),
+                                         etags=etags)
+            
+            if errors and len(errors) == len(calendar_ids):
+                raise CalendarSyncError(f"Google Calendar: {errors[0]}")
+            logger.info(f"Google Calendar: успешно получено {len(events)} событий из "
+                        f"{len(calendar_ids) - len(errors) - unchanged} календарей "
+                        f"(без изменений: {unchanged}, с ошибками: {len(errors)})")
+            return events
         
         elif calendar_type == 'yandex':
-            access_token = connection['access_token']
-            
-            # Проверяем, не истек ли токен
-            if connection.get('token_expires_at'):
-                try:
-                    expires_at_str = connection['token_expires_at']
-                    if isinstance(expires_at_str, str):
-                        # Обработка разных форматов даты
-                        expires_at_str = expires_at_str.replace('Z', '+00:00')
-                        if '+' not in expires_at_str and expires_at_str.count(':') == 1:
-                            expires_at_str += '+00:00'
-                        expires_at = datetime.fromisoformat(expires_at_str)
-                    else:
-                        expires_at = expires_at_str
-                    if expires_at <= datetime.utcnow() and connection.get('refresh_token'):
-                        # Обновляем токен
-                        new_token_data = yandex_cal.refresh_access_token(connection['refresh_token'])
-                        if new_token_data:
-                            expires_at = datetime.utcnow() + timedelta(seconds=new_token_data.get('expires_in', 3600))
-                            db.save_calendar_connection(
-                                user_id=connection['user_id'],
-                                calendar_type='yandex',
-                                access_token=new_token_data['access_token'],
-                                refresh_token=new_token_data.get('refresh_token'),
-                                token_expires_at=expires_at,
-                                calendar_id=connection.get('calendar_id'),
-                                calendar_name=connection.get('calendar_name')
-                            )
-                            access_token = new_token_data['access_token']
-                except (ValueError, AttributeError) as e:
-                    logger.warning(f"Ошибка при обработке даты истечения токена: {e}")
+            access_token = await asyncio.to_thread(get_yandex_access_token, connection)
             
             # Используем переданные time_min и time_max, если они есть
             if 'time_min' not in connection or connection.get('time_min') is None:
@@ -233,146 +477,272 @@ async def get_events_for_calendar(connection: Dict, calendar_type: str) -> List[
                 time_max = connection['time_max']
             
             max_results = connection.get('max_results', 1000)  # Yandex может иметь другие лимиты
-            return yandex_cal.get_upcoming_events(access_token, time_min, time_max, max_results=max_results)
+            # Адреса коллекций CalDAV ищутся один раз и хранятся в подключении
+            cached_collections = json.loads(connection['collections']) if connection.get('collections') else None
+            if lease is not None:
+                lease.ensure_held()
+            events, collections = await asyncio.to_thread(
+                yandex_cal.fetch_events, access_token, time_min, time_max, max_results=max_results,
+                collections=cached_collections, discovery_error=connection.get('discovery_error'))
+            if collections != cached_collections and (collections or cached_collections):
+                db.save_collections(connection['user_id'], 'yandex', collections or None)
+            return events
         
         return []
     
+    except (CalendarSyncError, LeaseLostError):
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении событий для {calendar_type}: {e}")
-        return []
+        raise CalendarSyncError(str(e)) from e
 
-async def send_notification(bot: Bot, user_id: int, event: Dict, calendar_type: str):
-    """Отправка уведомления о событии"""
-    try:
-        from i18n import t
-        from telegram.error import TelegramError, BadRequest, Forbidden
-        
-        event_start = event['start']
-        start_time_str = event_start.strftime('%d.%m.%Y %H:%M')
-        
-        title = event.get('summary', 'Event')
-        location = event.get('location', '')
-        description = event.get('description', '')
-        if description and len(description) > 200:
-            description = description[:200] + "..."
+def format_event_notification(user_id: int, event: Dict) -> str:
+    """Текст уведомления о событии на языке пользователя"""
+    from i18n import t
+    
+    event_start = event['start']
+    start_time_str = event_start.strftime('%d.%m.%Y %H:%M')
+    
+    title = event.get('summary') or 'Event'
+    location = event.get('location', '')
+    description = event.get('description', '')
+    if description and len(description) > 200:
+        description = description[:200] + "..."
+    
+    return t("event_notification", user_id,
+             title=title,
+             start_time=start_time_str,
+             location=location if location else '-',
+             description=description if description else '-')
+
+def _sync_retry_delay(error_streak: int) -> int:
+    """Пауза (в секундах) перед повторной синхронизацией после серии ошибок"""
+    interval = Config.SYNC_INTERVAL_MINUTES * 60
+    max_backoff = Config.SYNC_MAX_BACKOFF_MINUTES * 60
+    return min(interval * (2 ** min(max(error_streak - 1, 0), 10)), max_backoff)
+
+async def sync_connection(connection: Dict, lease: Lease) -> Dict:
+    """Синхронизация одного подключения календаря с кэшем событий
+    
+    Аренда подключения lease продлевается между загрузками коллекций, а перед
+    записью в кэш, sync-token и напоминания проверяется ее fencing token: если
+    синхронизация затянулась и аренду получил другой процесс, она прерывается
+    (LeaseLostError), чтобы не записывать те же данные одновременно с ним.
+    
+    Returns:
+        Словарь с количеством новых или измененных событий (changed)
+        и временем начала ближайшего будущего события (next_event_at, unix time)
+    """
+    user_id = connection['user_id']
+    calendar_type = connection['calendar_type']
+    
+    # Получаем события из календаря (прошедшие и будущие)
+    # Берем широкий диапазон: от 30 дней назад до 90 дней вперед
+    time_min = datetime.utcnow() - timedelta(days=30)
+    time_max = datetime.utcnow() + timedelta(days=90)
+    
+    connection['time_min'] = time_min
+    connection['time_max'] = time_max
+    connection['max_results'] = 2500  # Максимум для синхронизации
+    
+    # Yandex: только изменения с прошлой синхронизации, если сервер поддерживает sync-collection
+    incremental = None
+    if calendar_type == 'yandex':
+        incremental = await sync_yandex_incremental(connection, time_min, time_max, lease)
+    if incremental is not None:
+        events = incremental['events']
+    else:
+        events = await get_events_for_calendar(connection, calendar_type, lease)
+    lease.ensure_held(renew=True)
+    if calendar_type == 'yandex':
+        # Серии повторяющихся событий сохраняются и разворачиваются локально на ближайший горизонт
+        changed_ids = incremental['removed_uids'] | incremental['replaced_uids'] if incremental is not None else ()
+        events = recurrence.apply_sync(user_id, calendar_type, events, time_min, time_max,
+                                       full=incremental is None or incremental['full'], changed_ids=changed_ids)
+        if incremental is not None:
+            incremental['events'] = events
+    logger.info(f"Получено {len(events)} событий из {calendar_type} для пользователя {user_id}")
+    
+    # Текущее содержимое кэша для этого календаря, чтобы посчитать изменения
+    existing_events: Dict[tuple, tuple] = {}
+    for event in db.get_cached_events(user_id, calendar_type, time_min, time_max):
+        existing_events[(event.get('event_id'), str(event.get('start_time')))] = (
+            event.get('summary'), event.get('description'), event.get('location'),
+            str(event.get('end_time')), event.get('html_link')
+        )
+    
+    # Сохраняем/обновляем события из календаря
+    changed = 0
+    now_ts = int(time.time())
+    for event in events:
+        event_id = event.get('id')
+        start_time = event.get('start')
+        end_time = event.get('end')
         
-        message = t("event_notification", user_id, 
-                   title=title,
-                   start_time=start_time_str,
-                   location=location if location else '-',
-                   description=description if description else '-')
+        key = (event_id, start_time.isoformat(' ') if isinstance(start_time, datetime) else str(start_time))
+        fingerprint = (
+            event.get('summary'), event.get('description'), event.get('location'),
+            end_time.isoformat(' ') if isinstance(end_time, datetime) else str(end_time),
+            event.get('htmlLink')
+        )
+        if existing_events.get(key) != fingerprint:
+            changed += 1
         
-        await bot.send_message(chat_id=user_id, text=message)
-        logger.info(f"Уведомление отправлено пользователю {user_id} о событии {event['id']}")
+        # Сохраняем или обновляем событие
+        db.save_or_update_event(
+            user_id=user_id,
+            calendar_type=calendar_type,
+            event_id=event_id,
+            summary=event.get('summary'),
+            description=event.get('description'),
+            location=event.get('location'),
+            start_time=start_time,
+            end_time=end_time,
+            html_link=event.get('htmlLink')
+        )
     
-    except BadRequest as e:
-        error_message = str(e).lower()
-        if 'chat not found' in error_message or 'chat_id is empty' in error_message:
-            logger.warning(f"Пользователь {user_id} не зарегистрирован в боте (никогда не отправлял /start). Пропуск уведомления.")
-        else:
-            logger.error(f"Ошибка BadRequest при отправке уведомления пользователю {user_id}: {e}")
-    
-    except Forbidden as e:
-        error_message = str(e).lower()
-        if 'bot was blocked by the user' in error_message:
-            logger.warning(f"Пользователь {user_id} заблокировал бота. Пропуск уведомления.")
-        elif 'user is deactivated' in error_message:
-            logger.warning(f"Пользователь {user_id} деактивировал аккаунт. Пропуск уведомления.")
-        else:
-            logger.error(f"Ошибка Forbidden при отправке уведомления пользователю {user_id}: {e}")
+    # Удаляем события, удаленные или перенесенные в календаре, и сохраняем sync-token
+    # только после записи событий: при сбое изменения будут получены повторно
+    removed = 0
+    if incremental is not None:
+        lease.ensure_held(renew=True)
+        removed = db.delete_cached_events(
+            caldav_sync.stale_event_ids(user_id, calendar_type, incremental, time_min, time_max))
+        caldav_sync.commit_sync(user_id, calendar_type, incremental,
+                                json.loads(connection['collections']))
+        changed += removed
     
-    except TelegramError as e:
-        logger.error(f"Ошибка Telegram API при отправке уведомления пользователю {user_id}: {e}")
+    # Неизмененные события (sync-collection, ответ 304) не загружались: ближайшее событие берем из кэша
+    next_event_at = db.get_next_event_start(user_id, calendar_type, datetime.utcnow())
     
+    # Удаляем старые события (более 7 дней назад)
+    deleted = db.delete_old_events(user_id, calendar_type, datetime.utcnow() - timedelta(days=7))
+    db.delete_old_reminders(user_id, calendar_type, now_ts - 7 * 24 * 3600)
+    
+    # Пересчитываем напоминания по обновленному кэшу
+    if changed or deleted:
+        lease.ensure_held(renew=True)
+        db.rebuild_reminders(user_id, calendar_type)
+    
+    logger.info(f"Синхронизировано {len(events)} событий для календаря {calendar_type} пользователя {user_id}: "
+                f"изменено {changed} (из них удалено {removed}), удалено старых {deleted}")
+    return {'changed': changed, 'next_event_at': next_event_at}
+
+async def run_connection_sync(connection: Dict) -> Optional[bool]:
+    """Синхронизация подключения с записью результата в sync_state
+    
+    Подключение синхронизирует только один процесс: плановая синхронизация, cron,
+    очередь синхронизации и push-уведомления берут аренду sync:<user_id>:<тип>.
+    
+    Returns:
+        True, если синхронизация прошла успешно; None, если подключение сейчас
+        синхронизирует другой процесс или поток (в том числе получивший аренду,
+        пока синхронизация выполнялась)
+    """
+    user_id = connection['user_id']
+    calendar_type = connection['calendar_type']
+    with job_lease(f"sync:{user_id}:{calendar_type}") as lease:
+        if lease is None:
+            return None
+        return await _run_connection_sync(connection, lease)
+
+async def _run_connection_sync(connection: Dict, lease: Lease) -> Optional[bool]:
+    user_id = connection['user_id']
+    calendar_type = connection['calendar_type']
+    started_at = int(time.time())
+    started = time.monotonic()
+    
+    try:
+        result = await sync_connection(connection, lease)
+    except LeaseLostError:
+        # Результат запишет процесс, которому перешла аренда
+        logger.warning(f"Аренда синхронизации {calendar_type} для пользователя {user_id} потеряна, "
+                       f"синхронизация прервана")
+        return None
     except Exception as e:
-        logger.error(f"Неожиданная ошибка при отправке уведомления пользователю {user_id}: {e}", exc_info=True)
+        duration_ms = int((time.monotonic() - started) * 1000)
+        error_streak = (connection.get('error_streak') or 0) + 1
+        next_due_at = int(time.time()) + _sync_retry_delay(error_streak)
+        db.record_sync_failure(user_id, calendar_type, started_at, duration_ms, str(e)[:500], next_due_at)
+        logger.error(f"Ошибка при синхронизации {calendar_type} для пользователя {user_id} "
+                     f"(ошибок подряд: {error_streak}): {e}", exc_info=not isinstance(e, CalendarSyncError))
+        return False
+    
+    duration_ms = int((time.monotonic() - started) * 1000)
+    now_ts = int(time.time())
+    
+    next_reminder_at = None
+    if result['next_event_at'] is not None:
+        notification_minutes = db.get_notification_settings(user_id).get('notification_minutes', 15)
+        next_reminder_at = result['next_event_at'] - notification_minutes * 60
+    
+    # Об изменениях календарей с каналами push-уведомлений Google сообщит сам
+    push_covered = calendar_type == 'google' and google_push.is_covered(
+        user_id, json.loads(connection['collections']) if connection.get('collections') else [])
+    interval = next_sync_interval(connection.get('interval_seconds'), result['changed'],
+                                  now_ts, next_reminder_at, push_covered=push_covered)
+    db.record_sync_success(user_id, calendar_type, started_at, duration_ms, result['changed'],
+                           now_ts + interval, interval_seconds=interval,
+                           next_event_at=result['next_event_at'])
+    logger.info(f"Следующая синхронизация {calendar_type} для пользователя {user_id} через {interval // 60} мин")
+    if result['changed']:
+        notify_events_changed(user_id)
+    return True
 
-async def sync_events_from_calendars():
-    """Синхронизация событий из календарей в базу данных"""
+async def sync_events_from_calendars(force: bool = False):
+    """Синхронизация событий из календарей в базу данных
+    
+    Args:
+        force: синхронизировать все подключения, а не только те, у которых наступил срок
+    """
     try:
         logger.info("=== Начало синхронизации событий ===")
-        active_users = db.get_all_active_users()
-        logger.info(f"Найдено активных пользователей: {len(active_users)}")
+        now_ts = int(time.time())
         
-        if not active_users:
-            logger.info("Нет активных пользователей с подключенными календарями")
-            return
-        
-        total_synced = 0
-        total_deleted = 0
-        
-        for user_id in active_users:
-            try:
-                logger.info(f"Синхронизация событий для пользователя {user_id}")
-                calendars = db.get_user_calendars(user_id)
-                
-                for cal_info in calendars:
-                    calendar_type = cal_info['calendar_type']
-                    logger.info(f"Синхронизация календаря {calendar_type} для пользователя {user_id}")
-                    
-                    connection = db.get_calendar_connection(user_id, calendar_type)
-                    if not connection:
-                        logger.warning(f"Подключение {calendar_type} не найдено для пользователя {user_id}")
-                        continue
-                    
-                    # Получаем события из календаря (прошедшие и будущие)
-                    # Берем широкий диапазон: от 30 дней назад до 90 дней вперед
-                    time_min = datetime.utcnow() - timedelta(days=30)
-                    time_max = datetime.utcnow() + timedelta(days=90)
-                    
-                    connection['user_id'] = user_id
-                    connection['time_min'] = time_min
-                    connection['time_max'] = time_max
-                    connection['max_results'] = 2500  # Максимум для синхронизации
-                    events = await get_events_for_calendar(connection, calendar_type)
-                    logger.info(f"Получено {len(events)} событий из {calendar_type} для пользователя {user_id}")
-                    
-                    # Получаем текущие event_id из БД для этого календаря
-                    existing_events = db.get_cached_events(user_id, calendar_type, time_min, time_max)
-                    existing_event_ids: Set[tuple] = set()
-                    for event in existing_events:
-                        event_id = event.get('event_id')
-                        start_time = event.get('start_time')
-                        if isinstance(start_time, str):
-                            start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        elif hasattr(start_time, 'isoformat'):
-                            pass  # Уже datetime
-                        else:
-                            continue
-                        existing_event_ids.add((event_id, start_time))
-                    
-                    # Сохраняем/обновляем события из календаря
-                    current_event_ids: Set[tuple] = set()
-                    for event in events:
-                        event_id = event.get('id')
-                        start_time = event.get('start')
-                        current_event_ids.add((event_id, start_time))
-                        
-                        # Сохраняем или обновляем событие
-                        db.save_or_update_event(
-                            user_id=user_id,
-                            calendar_type=calendar_type,
-                            event_id=event_id,
-                            summary=event.get('summary'),
-                            description=event.get('description'),
-                            location=event.get('location'),
-                            start_time=start_time,
-                            end_time=event.get('end'),
-                            html_link=event.get('htmlLink')
-                        )
-                        total_synced += 1
-                    
-                    # Удаляем старые события (более 7 дней назад)
-                    deleted = db.delete_old_events(user_id, calendar_type, datetime.utcnow() - timedelta(days=7))
-                    total_deleted += deleted
-                    
-                    logger.info(f"Синхронизировано {len(events)} событий для календаря {calendar_type} пользователя {user_id}")
+        with job_lease('sync_events') as lease:
+            if lease is None:
+                return
+            staggered = not force and Config.is_sync_staggered()
+            if force:
+                connections = db.get_all_sync_connections()
+            else:
+                connections = db.get_due_sync_connections(now_ts)
+            if staggered:
+                # Каждый шаг обрабатывает только слоты, наступившие с прошлого обработанного шага,
+                # чтобы не создавать пиковую нагрузку на API календарей и SQLite
+                due_count = len(connections)
+                last_tick = db.get_system_setting(STAGGER_TICK_KEY)
+                connections = filter_current_slice(connections, now_ts, int(last_tick) if last_tick else None)
+                logger.info(f"Режим распределения: в наступивших слотах {len(connections)} из {due_count} подключений")
+            logger.info(f"Подключений к синхронизации: {len(connections)}")
             
-            except Exception as e:
-                logger.error(f"Ошибка при синхронизации событий для пользователя {user_id}: {e}", exc_info=True)
-        
-        logger.info(f"=== Синхронизация завершена: добавлено/обновлено {total_synced}, удалено {total_deleted} ===")
+            succeeded = 0
+            failed = 0
+            completed = True
+            # Первыми синхронизируются пользователи, чьи напоминания сработают раньше
+            for connection in order_by_deadline(connections, now_ts):
+                # Аренда продлевается между подключениями; потерянная аренда означает,
+                # что синхронизацию уже продолжает другой процесс
+                if not lease.renew():
+                    logger.warning("Аренда синхронизации потеряна, синхронизация прервана")
+                    completed = False
+                    break
+                logger.info(f"Синхронизация календаря {connection['calendar_type']} для пользователя {connection['user_id']}")
+                result = await run_connection_sync(connection)
+                if result:
+                    succeeded += 1
+                elif result is not None:
+                    failed += 1
+            
+            # Шаг считается обработанным, только если все подключения его слотов пройдены
+            if staggered and completed:
+                db.set_system_setting_fenced(STAGGER_TICK_KEY, str(current_stagger_tick(now_ts)),
+                                             lease.name, lease.token, int(time.time()))
+            
+            if connections:
+                logger.info(f"=== Синхронизация завершена: успешно {succeeded}, с ошибками {failed} ===")
+            else:
+                logger.info("Нет подключений, которым нужна синхронизация")
     
     except Exception as e:
         logger.error(f"Ошибка при синхронизации событий: {e}", exc_info=True)
-
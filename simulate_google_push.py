@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Локальная замена Google для проверки push-уведомлений
+
+Отправляет на /callback/google/push такие же запросы, как Google при изменении
+календаря (заголовки X-Goog-*), для каналов пользователя из базы данных.
+С --register сначала создает локальный канал календаря без обращения к Google
+(для локальной проверки, когда GOOGLE_PUSH_URL недоступен из интернета).
+
+Использование:
+    python simulate_google_push.py USER_ID [--url URL] [--calendar CALENDAR_ID]
+        [--register CALENDAR_ID] [--state exists|not_exists|sync]
+"""
+
+import argparse
+import secrets
+import sys
+import time
+import uuid
+
+import requests
+
+from config import Config
+from database import Database
+
+db = Database()
+
+def register_local_channel(user_id: int, calendar_id: str):
+    """Канал, как после events.watch, но без регистрации в Google"""
+    now_ts = int(time.time())
+    channel_id = f"local-{uuid.uuid4().hex}"
+    db.save_google_watch_channel(channel_id, user_id, calendar_id, f"local-resource-{calendar_id}",
+                                 secrets.token_urlsafe(32), now_ts + Config.GOOGLE_WATCH_TTL_HOURS * 3600, now_ts)
+    print(f"Создан локальный канал {channel_id} для календаря {calendar_id}")
+    return db.get_google_watch_channel(channel_id)
+
+def post_notification(url: str, channel: dict, state: str, message_number: int) -> int:
+    """Уведомление канала в формате Google (тело пустое, все данные в заголовках)"""
+    response = requests.post(url, headers={
+        'X-Goog-Channel-ID': channel['channel_id'],
+        'X-Goog-Channel-Token': channel['token'],
+        'X-Goog-Channel-Expiration': time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(channel['expiration'])),
+        'X-Goog-Resource-ID': channel['resource_id'] or '',
+        'X-Goog-Resource-URI': f"https://www.googleapis.com/calendar/v3/calendars/{channel['calendar_id']}/events",
+        'X-Goog-Resource-State': state,
+        'X-Goog-Message-Number': str(message_number)
+    }, timeout=10)
+    print(f"{state} -> канал {channel['channel_id']} ({channel['calendar_id']}): HTTP {response.status_code}")
+    return response.status_code
+
+def main():
+    parser = argparse.ArgumentParser(description='Отправка push-уведомлений Google Calendar на локальный сервер')
+    parser.add_argument('user_id', type=int)
+    parser.add_argument('--url', default='http://localhost:5000/callback/google/push')
+    parser.add_argument('--calendar', help='только каналы этого календаря')
+    parser.add_argument('--register', metavar='CALENDAR_ID', help='создать локальный канал календаря')
+    parser.add_argument('--state', default='exists', choices=['exists', 'not_exists', 'sync'])
+    args = parser.parse_args()
+
+    message_number = 1
+    if args.register:
+        # Google подтверждает регистрацию канала уведомлением sync
+        post_notification(args.url, register_local_channel(args.user_id, args.register), 'sync', message_number)
+        message_number += 1
+
+    channels = [channel for channel in db.get_google_watch_channels(args.user_id)
+                if not args.calendar or channel['calendar_id'] == args.calendar]
+    if not channels:
+        print(f"У пользователя {args.user_id} нет каналов push-уведомлений (используйте --register)")
+        sys.exit(1)
+    for channel in channels:
+        post_notification(args.url, channel, args.state, message_number)
+        message_number += 1
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Политика планирования синхронизации календарей"""
+import heapq
+import zlib
+from typing import Optional, List, Dict, Iterator, Set
+from config import Config
+
+def next_sync_interval(previous_interval: Optional[int], change_count: int, now_ts: int,
+                       next_reminder_at: Optional[int] = None, push_covered: bool = False) -> int:
+    """Расчет интервала (в секундах) до следующей синхронизации подключения
+    
+    Календарь с изменениями синхронизируется с минимальным интервалом, каждая
+    синхронизация без изменений удваивает интервал до максимума. Перед ближайшим
+    напоминанием интервал сокращается, чтобы данные были свежими к его отправке.
+    
+    Args:
+        previous_interval: интервал предыдущей синхронизации (None для первой)
+        change_count: количество изменений, найденных при текущей синхронизации
+        now_ts: текущее время (unix time)
+        next_reminder_at: время ближайшего напоминания по этому календарю (unix time)
+        push_covered: об изменениях сообщают push-уведомления, опрос - запасной
+            путь с максимальным интервалом (но не позже срока перед напоминанием)
+    """
+    min_interval = Config.SYNC_MIN_INTERVAL_MINUTES * 60
+    max_interval = max(Config.SYNC_MAX_INTERVAL_MINUTES * 60, min_interval)
+    
+    if push_covered:
+        interval = max_interval
+    elif change_count:
+        interval = min_interval
+    elif previous_interval:
+        interval = previous_interval * 2
+    else:
+        interval = Config.SYNC_INTERVAL_MINUTES * 60
+    
+    # Последняя синхронизация перед напоминанием - за минимальный интервал до него
+    if next_reminder_at is not None and next_reminder_at > now_ts:
+        interval = min(interval, max(next_reminder_at - min_interval - now_ts, min_interval))
+    
+    return max(min_interval, min(interval, max_interval))
+
+def reminder_deadline(connection: Dict, now_ts: int) -> Optional[int]:
+    """Время ближайшего известного напоминания подключения (начало события минус интервал уведомления)"""
+    next_event_at = connection.get('next_event_at')
+    if next_event_at and next_event_at > now_ts:
+        notification_minutes = connection.get('notification_minutes') or 15
+        return next_event_at - notification_minutes * 60
+    return None
+
+def sync_priority(connection: Dict, now_ts: int) -> tuple:
+    """Ключ приоритета синхронизации подключения (меньше - срочнее)
+    
+    Первыми идут подключения, которые еще ни разу не синхронизировались (для них
+    в кэше нет событий), затем - по времени ближайшего известного напоминания
+    (начало события минус интервал уведомления пользователя), в конце - подключения
+    без известных будущих событий в порядке наступления срока синхронизации.
+    """
+    if not connection.get('last_success_at'):
+        return (0, connection.get('next_due_at') or 0)
+    
+    deadline = reminder_deadline(connection, now_ts)
+    if deadline is not None:
+        return (1, deadline)
+    
+    return (2, connection.get('next_due_at') or 0)
+
+def order_by_deadline(connections: List[Dict], now_ts: int) -> Iterator[Dict]:
+    """Выдача подключений из очереди с приоритетом по ближайшему напоминанию"""
+    queue = [(sync_priority(connection, now_ts), index, connection)
+             for index, connection in enumerate(connections)]
+    heapq.heapify(queue)
+    while queue:
+        yield heapq.heappop(queue)[2]
+
+def stagger_slot_count() -> int:
+    """Количество слотов, по которым распределяются подключения в пределах интервала синхронизации"""
+    return max(1, round(Config.SYNC_INTERVAL_MINUTES / max(Config.SYNC_TICK_MINUTES, 1)))
+
+def stagger_slot(user_id: int, calendar_type: str, slots: int) -> int:
+    """Стабильный слот подключения (не зависит от процесса и перезапусков, в отличие от hash())"""
+    return zlib.crc32(f"{user_id}:{calendar_type}".encode('utf-8')) % slots
+
+def current_stagger_tick(now_ts: int) -> int:
+    """Номер текущего шага планировщика"""
+    return now_ts // (max(Config.SYNC_TICK_MINUTES, 1) * 60)
+
+def due_stagger_slots(last_tick: Optional[int], now_ts: int, slots: int) -> Set[int]:
+    """Слоты всех шагов после последнего обработанного шага last_tick по текущий включительно
+    
+    APScheduler может запустить задачу с опозданием, пропустить шаг или запустить ее
+    дважды за шаг: слоты пропущенных шагов обрабатываются на ближайшем шаге, а не
+    через полный цикл.
+    """
+    current = current_stagger_tick(now_ts)
+    first = current if last_tick is None else max(min(last_tick + 1, current), current - slots + 1)
+    return {tick % slots for tick in range(first, current + 1)}
+
+def filter_current_slice(connections: List[Dict], now_ts: int, last_tick: Optional[int] = None) -> List[Dict]:
+    """Отбор подключений, слоты которых наступили с последнего обработанного шага
+    
+    Подключения, которые еще ни разу не синхронизировались, и подключения, напоминание
+    которых наступит раньше, чем закончится цикл слотов, не ждут своего слота.
+    """
+    slots = stagger_slot_count()
+    due_slots = due_stagger_slots(last_tick, now_ts, slots)
+    cycle_end = now_ts + slots * max(Config.SYNC_TICK_MINUTES, 1) * 60
+    selected = []
+    for connection in connections:
+        deadline = reminder_deadline(connection, now_ts)
+        if (not connection.get('last_success_at')
+                or (deadline is not None and deadline <= cycle_end)
+                or stagger_slot(connection['user_id'], connection['calendar_type'], slots) in due_slots):
+            selected.append(connection)
+    return selected
@@ -0,0 +1,79 @@
+"""Очередь внеочередной синхронизации отдельных подключений календарей"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from background_loop import run_coroutine
+from config import Config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+db = Database()
+
+# Пауза перед повтором, если подключение синхронизирует другой процесс
+BUSY_RETRY_SECONDS = 30
+
+class SyncQueue:
+    """Очередь синхронизации подключений, выполняемая в фоновом потоке
+    
+    Повторные запросы для подключения, которое уже ждет в очереди, объединяются
+    в одну синхронизацию (debounce), поэтому вызывать request() можно сразу после
+    каждого сохранения подключения, не блокируя обработчик запроса.
+    """
+    
+    def __init__(self, debounce_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self._pending: Dict[Tuple[int, str], float] = {}
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def request(self, user_id: int, calendar_type: str, delay: Optional[float] = None):
+        """Постановка подключения в очередь синхронизации (через delay секунд, по умолчанию - пауза debounce)"""
+        key = (user_id, calendar_type)
+        with self._condition:
+            if key not in self._pending:
+                self._pending[key] = time.monotonic() + (self.debounce_seconds if delay is None else delay)
+                logger.info(f"Синхронизация {calendar_type} для пользователя {user_id} поставлена в очередь")
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name='sync-queue', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+    
+    def _next_ready(self) -> Tuple[int, str]:
+        """Ожидание подключения, для которого истекла пауза debounce"""
+        with self._condition:
+            while True:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                key, due = min(self._pending.items(), key=lambda item: item[1])
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                del self._pending[key]
+                return key
+    
+    def _worker(self):
+        """Фоновый поток, выполняющий синхронизацию подключений из очереди"""
+        while True:
+            user_id, calendar_type = self._next_ready()
+            try:
+                connection = db.get_sync_connection(user_id, calendar_type)
+                if not connection:
+                    logger.info(f"Подключение {calendar_type} пользователя {user_id} удалено, синхронизация пропущена")
+                    continue
+                from scheduler import run_connection_sync
+                if run_coroutine(run_connection_sync(connection)) is None:
+                    # Подключение синхронизирует другой процесс: изменения после начала
+                    # его загрузки могли быть пропущены, поэтому повторяем позже
+                    self.request(user_id, calendar_type, delay=BUSY_RETRY_SECONDS)
+            except Exception as e:
+                logger.error(f"Ошибка при синхронизации {calendar_type} для пользователя {user_id} из очереди: {e}", exc_info=True)
+
+sync_queue = SyncQueue(Config.SYNC_DEBOUNCE_SECONDS)
+
+def request_connection_sync(user_id: int, calendar_type: str):
+    """Внеочередная синхронизация подключения (например, сразу после подключения календаря)"""
+    sync_queue.request(user_id, calendar_type)
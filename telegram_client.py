@@ -0,0 +1,115 @@
+"""Общий клиент Telegram Bot API для процесса
+
+Все отправители (уведомления, рассылки, сообщения после подключения календаря,
+проверка подключения в админ-панели) используют один инициализированный бот
+с пулом HTTP-соединений и keep-alive, а не создают новый Bot и HTTP-клиент на
+каждый запуск. HTTP-клиент httpx привязан к event loop, поэтому бот создается
+один на каждый работающий loop.
+
+В процессе бота (main.py, run_bot.py) общим клиентом становится бот Application
+(use_application_bot): обработчики обновлений и отправители используют один пул
+соединений, созданный create_request.
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+from config import Config
+from rate_limiter import BotRateLimiter
+
+logger = logging.getLogger(__name__)
+
+class _BotEntry:
+    """Бот, созданный для одного event loop"""
+
+    def __init__(self, token: str, bot: ExtBot, owned: bool = True):
+        self.token = token
+        self.bot = bot
+        # Бот Application закрывает само приложение
+        self.owned = owned
+        self.init_lock = asyncio.Lock()
+
+_bots: Dict[asyncio.AbstractEventLoop, _BotEntry] = {}
+_bots_lock = threading.Lock()
+
+def create_request() -> HTTPXRequest:
+    """HTTP-клиент запросов Bot API с пулом соединений (TELEGRAM_POOL_SIZE)"""
+    timeout = Config.TELEGRAM_HTTP_TIMEOUT
+    return HTTPXRequest(
+        connection_pool_size=Config.TELEGRAM_POOL_SIZE,
+        connect_timeout=timeout,
+        read_timeout=timeout,
+        write_timeout=timeout,
+        pool_timeout=timeout
+    )
+
+def _create_bot(token: str) -> ExtBot:
+    """Бот с пулом соединений и общим ограничителем частоты"""
+    return ExtBot(token=token, request=create_request(), rate_limiter=BotRateLimiter())
+
+def use_application_bot(bot: ExtBot):
+    """Бот Application как общий клиент текущего event loop
+
+    Вызывается в процессе бота после setup_bot: отправители используют пул
+    соединений приложения вместо второго клиента. Закрывает бота само приложение.
+    """
+    loop = asyncio.get_running_loop()
+    with _bots_lock:
+        previous = _bots.get(loop)
+        _bots[loop] = _BotEntry(bot.token, bot, owned=False)
+    if previous is not None and previous.owned and previous.bot is not bot:
+        loop.create_task(_shutdown(previous.bot))
+
+async def get_bot() -> ExtBot:
+    """Инициализированный бот текущего event loop
+
+    При смене токена в админ-панели старый бот закрывается и создается новый.
+
+    Raises:
+        ValueError: если токен бота не установлен
+    """
+    token = Config.get_telegram_token()
+    if not token:
+        raise ValueError("TELEGRAM_BOT_TOKEN не установлен")
+
+    loop = asyncio.get_running_loop()
+    stale: Optional[ExtBot] = None
+    with _bots_lock:
+        # Боты завершившихся loop (например, после asyncio.run) больше не используются
+        for closed_loop in [key for key in _bots if key.is_closed()]:
+            del _bots[closed_loop]
+
+        entry = _bots.get(loop)
+        if entry is not None and entry.token != token:
+            stale = entry.bot if entry.owned else None
+            entry = None
+        if entry is None:
+            entry = _BotEntry(token, _create_bot(token))
+            _bots[loop] = entry
+
+    if stale is not None:
+        await _shutdown(stale)
+
+    if not entry.bot._initialized:
+        async with entry.init_lock:
+            if not entry.bot._initialized:
+                await entry.bot.initialize()
+                logger.info(f"Клиент Telegram инициализирован (@{entry.bot.username})")
+    return entry.bot
+
+async def _shutdown(bot: ExtBot):
+    try:
+        await bot.shutdown()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии клиента Telegram: {e}")
+
+async def shutdown_bot():
+    """Закрытие бота текущего event loop (при остановке процесса или loop)"""
+    loop = asyncio.get_running_loop()
+    with _bots_lock:
+        entry = _bots.pop(loop, None)
+    if entry is not None and entry.owned:
+        await _shutdown(entry.bot)
+        logger.info("Клиент Telegram закрыт")
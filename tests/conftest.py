@@ -0,0 +1,24 @@
+"""Общие фикстуры тестов
+
+Модули проекта создают общую базу (db = Database()) в текущем каталоге при
+импорте, поэтому тесты запускаются из временного каталога, а каждый тест
+получает свою пустую базу через фикстуру db.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.chdir(tempfile.mkdtemp(prefix='kabalaka-tests-'))
+
+from database import Database  # noqa: E402
+
+@pytest.fixture
+def db(tmp_path):
+    """Пустая база данных теста"""
+    return Database(str(tmp_path / 'test.db'))
@@ -0,0 +1,84 @@
+"""Тесты обслуживания каналов push-уведомлений Google (google_push.ensure_channels)"""
+import asyncio
+
+import pytest
+
+import google_push
+from config import Config
+
+USER_ID = 3003
+NOW = 1_800_000_000
+HOUR = 3600
+
+class FakeGoogleCalendar:
+    """Запоминает вызовы events.watch и channels.stop"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.watched = []
+        self.stopped = []
+
+    def watch_events(self, credentials, calendar_id, channel_id, address, token, ttl_seconds):
+        self.watched.append(calendar_id)
+        if calendar_id in self.fail:
+            raise RuntimeError('forbidden')
+        return {'expiration': NOW + ttl_seconds, 'resource_id': f'resource-{calendar_id}'}
+
+    def stop_channel(self, credentials, channel_id, resource_id):
+        self.stopped.append(channel_id)
+
+@pytest.fixture(autouse=True)
+def push_db(db, monkeypatch):
+    monkeypatch.setattr(google_push, 'db', db)
+    monkeypatch.setattr(google_push, '_register_failed_at', {})
+    monkeypatch.setattr(Config, 'get_google_push_url', staticmethod(lambda: 'https://example.com/push'))
+    monkeypatch.setattr(Config, 'GOOGLE_WATCH_TTL_HOURS', 168)
+    monkeypatch.setattr(Config, 'GOOGLE_WATCH_RENEW_HOURS', 24)
+    return db
+
+@pytest.fixture
+def google(monkeypatch):
+    fake = FakeGoogleCalendar()
+    monkeypatch.setattr(google_push, 'google_cal', fake)
+    return fake
+
+def _ensure(calendar_ids, now_ts=NOW):
+    return asyncio.run(google_push.ensure_channels(USER_ID, None, calendar_ids, now_ts))
+
+def test_valid_channels_need_no_google_requests(google):
+    assert _ensure(['a', 'b']) == 2
+    assert sorted(google.watched) == ['a', 'b']
+
+    # Повторная синхронизация (например, по push-уведомлению) не обращается к Google
+    assert _ensure(['a', 'b'], NOW + HOUR) == 0
+    assert sorted(google.watched) == ['a', 'b']
+    assert google.stopped == []
+    assert google_push.is_covered(USER_ID, ['a', 'b'], NOW + HOUR)
+
+def test_expiring_channel_is_replaced(google, push_db):
+    _ensure(['a'])
+    old = push_db.get_google_watch_channels(USER_ID)[0]['channel_id']
+
+    renew_at = NOW + (168 - 23) * HOUR
+    assert _ensure(['a'], renew_at) == 1
+    assert google.watched == ['a', 'a']
+    assert google.stopped == [old]
+    assert len(push_db.get_google_watch_channels(USER_ID)) == 1
+
+def test_removed_calendar_channel_is_stopped(google, push_db):
+    _ensure(['a', 'b'])
+    _ensure(['a'], NOW + HOUR)
+
+    assert len(google.stopped) == 1
+    assert [channel['calendar_id'] for channel in push_db.get_google_watch_channels(USER_ID)] == ['a']
+
+def test_failed_registration_is_not_retried_on_every_sync(monkeypatch):
+    google = FakeGoogleCalendar(fail={'a'})
+    monkeypatch.setattr(google_push, 'google_cal', google)
+
+    assert _ensure(['a']) == 0
+    assert _ensure(['a'], NOW + 60) == 0
+    assert google.watched == ['a']
+
+    assert _ensure(['a'], NOW + google_push._REGISTER_RETRY_SECONDS) == 0
+    assert google.watched == ['a', 'a']
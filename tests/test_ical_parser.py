@@ -0,0 +1,99 @@
+"""Тесты потокового разбора iCalendar (ical_parser.py) в сравнении с прежним разбором регулярными выражениями"""
+from datetime import datetime, timedelta
+
+from bench_ical_parser import build_response, parse_regex
+from calendar_yandex import YandexCalendar
+from ical_parser import EventSelector, iter_events
+
+# Europe/Moscow - UTC+3 без перехода на летнее время
+MOSCOW_OFFSET = timedelta(hours=3)
+
+def test_stream_parser_matches_regex_parser():
+    data = build_response(40)
+    expected = parse_regex(data)
+    events = list(iter_events(data))
+
+    assert [event['id'] for event in events] == [event['id'] for event in expected]
+    for event, old in zip(events, expected):
+        assert event['summary'] == old['summary']
+        # Прежний разбор не учитывал TZID: время Europe/Moscow оставалось местным
+        offset = MOSCOW_OFFSET if int(old['id'].split('-')[1].split('@')[0]) % 2 else timedelta(0)
+        assert event['start'] == old['dtstart'] - offset
+        assert event['end'] == old['dtend'] - offset
+        # Экранирование (\,) снимается, свернутые строки склеиваются
+        assert event['location'] == old['location'].replace('\\,', ',')
+        assert event['description'].startswith(old['description'].replace('\\,', ','))
+        assert len(event['description']) > len(old['description'])
+
+def test_time_range_filter():
+    data = build_response(10)
+    time_min = datetime(2030, 1, 1, 12, 0)
+    time_max = datetime(2030, 1, 1, 15, 0)
+    starts = [event['start'] for event in iter_events(data, time_min, time_max)]
+
+    assert starts and all(time_min <= start <= time_max for start in starts)
+    assert len(starts) == sum(1 for event in iter_events(data) if time_min <= event['start'] <= time_max)
+
+def test_event_without_uid_is_skipped_and_defaults_applied():
+    data = (
+        'BEGIN:VCALENDAR\r\n'
+        'BEGIN:VEVENT\r\nSUMMARY:Без UID\r\nDTSTART:20300101T090000Z\r\nEND:VEVENT\r\n'
+        'BEGIN:VEVENT\r\nUID:day@example\r\nDTSTART;VALUE=DATE:20300102\r\nEND:VEVENT\r\n'
+        'BEGIN:VEVENT\r\nUID:short@example\r\nDTSTART:20300103T090000Z\r\nDURATION:PT30M\r\nEND:VEVENT\r\n'
+        'END:VCALENDAR\r\n'
+    )
+    events = list(iter_events(data))
+
+    assert [event['id'] for event in events] == ['day@example', 'short@example']
+    assert events[0]['summary'] == 'Без названия'
+    assert events[0]['end'] - events[0]['start'] == timedelta(days=1)
+    assert events[1]['end'] - events[1]['start'] == timedelta(minutes=30)
+
+def _select(data, limit):
+    selector = EventSelector(limit)
+    for event in iter_events(data, cutoff=selector.cutoff):
+        selector.offer(event)
+    return selector.result()
+
+def test_selector_matches_full_sort():
+    data = build_response(60)
+    expected = sorted(iter_events(data), key=lambda event: event['start'])[:10]
+
+    assert [(event['id'], event['start']) for event in _select(data, 10)] == \
+        [(event['id'], event['start']) for event in expected]
+
+def test_selector_keeps_series_and_earlier_event_on_tie():
+    data = (
+        'BEGIN:VCALENDAR\r\n'
+        'BEGIN:VEVENT\r\nUID:first\r\nDTSTART:20300101T090000Z\r\nEND:VEVENT\r\n'
+        'BEGIN:VEVENT\r\nUID:second\r\nDTSTART:20300101T090000Z\r\nEND:VEVENT\r\n'
+        'BEGIN:VEVENT\r\nUID:weekly\r\nDTSTART:20300105T090000Z\r\nRRULE:FREQ=WEEKLY\r\nEND:VEVENT\r\n'
+        'BEGIN:VEVENT\r\nUID:late\r\nDTSTART:20300110T090000Z\r\nEND:VEVENT\r\n'
+        'END:VCALENDAR\r\n'
+    )
+    result = _select(data, 1)
+
+    assert [event['id'] for event in result] == ['first', 'weekly']
+    assert 'recurrence' in result[1]
+
+def test_selector_with_zero_limit_keeps_only_series():
+    data = build_response(5)
+    assert _select(data, 0) == []
+
+def test_resource_uid_matches_parsed_event_id():
+    calendar = YandexCalendar()
+    data = (
+        'BEGIN:VCALENDAR\r\n'
+        'BEGIN:VEVENT\r\nUID;X-PARAM=1:long-uid-folded\r\n -tail@example\r\nDTSTART:20300101T090000Z\r\nEND:VEVENT\r\n'
+        'END:VCALENDAR\r\n'
+    )
+    resource = {'href': '/events/1.ics', 'etag': '"1"', 'calendar_data': data}
+
+    uid, events = calendar.parse_resource(resource, datetime(2030, 1, 1), datetime(2030, 1, 2))
+    assert uid == 'long-uid-folded-tail@example'
+    assert [event['id'] for event in events] == [uid]
+
+    # Событие вне диапазона: UID нужен для учета перемещения и удаления ресурса
+    uid, events = calendar.parse_resource(resource, datetime(2031, 1, 1), datetime(2031, 1, 2))
+    assert uid == 'long-uid-folded-tail@example'
+    assert events == []
@@ -0,0 +1,107 @@
+"""Тесты аренды задач и fencing token (job_lease.py)"""
+import asyncio
+
+import pytest
+
+import job_lease
+from parallel_fetch import fetch_collections
+
+NOW = 1_800_000_000
+TTL = 300
+
+@pytest.fixture(autouse=True)
+def lease_db(db, monkeypatch):
+    monkeypatch.setattr(job_lease, 'db', db)
+    return db
+
+def test_lease_is_exclusive_until_expiry(lease_db):
+    assert lease_db.acquire_lease('job', 'a', TTL, NOW) == 1
+    assert lease_db.acquire_lease('job', 'b', TTL, NOW + TTL - 1) is None
+    assert lease_db.acquire_lease('job', 'b', TTL, NOW + TTL) == 2
+
+def test_release_frees_lease_and_next_owner_gets_new_token(lease_db):
+    token = lease_db.acquire_lease('job', 'a', TTL, NOW)
+    lease_db.release_lease('job', 'a', token)
+    assert lease_db.acquire_lease('job', 'b', TTL, NOW + 1) == token + 1
+
+def test_stale_owner_cannot_release_or_renew(lease_db):
+    stale = lease_db.acquire_lease('job', 'a', TTL, NOW)
+    current = lease_db.acquire_lease('job', 'b', TTL, NOW + TTL)
+
+    lease_db.release_lease('job', 'a', stale)
+    assert lease_db.acquire_lease('job', 'c', TTL, NOW + TTL + 1) is None
+    assert not lease_db.renew_lease('job', 'a', stale, TTL, NOW + TTL + 1)
+    assert lease_db.renew_lease('job', 'b', current, TTL, NOW + TTL + 1)
+
+def test_fenced_write_rejected_after_lease_moves(lease_db):
+    stale = lease_db.acquire_lease('job', 'a', TTL, NOW)
+    assert lease_db.set_system_setting_fenced('watermark', '1', 'job', stale, NOW + 1)
+
+    current = lease_db.acquire_lease('job', 'b', TTL, NOW + TTL)
+    assert not lease_db.set_system_setting_fenced('watermark', '2', 'job', stale, NOW + TTL + 1)
+    assert lease_db.get_system_setting('watermark') == '1'
+
+    assert lease_db.set_system_setting_fenced('watermark', '3', 'job', current, NOW + TTL + 1)
+    assert lease_db.get_system_setting('watermark') == '3'
+
+def test_fenced_write_rejected_after_expiry_without_new_owner(lease_db):
+    token = lease_db.acquire_lease('job', 'a', TTL, NOW)
+    assert not lease_db.set_system_setting_fenced('watermark', '1', 'job', token, NOW + TTL)
+
+def test_job_lease_context_skips_while_held():
+    with job_lease.job_lease('job') as first:
+        assert first is not None
+        with job_lease.job_lease('job') as second:
+            assert second is None
+        assert first.renew()
+    with job_lease.job_lease('job') as third:
+        assert third.token == first.token + 1
+
+def test_lost_lease_reports_invalid(lease_db):
+    with job_lease.job_lease('job', ttl_seconds=TTL) as lease:
+        # Другой процесс перехватил аренду после ее истечения
+        lease_db.acquire_lease('job', 'other', TTL, lease.expires_at)
+        assert not lease.renew()
+        assert not lease.is_valid()
+        assert not lease.keep_alive()
+
+def test_holder_id_differs_per_process(monkeypatch):
+    monkeypatch.setattr(job_lease, '_holder_pid', None)
+    monkeypatch.setattr(job_lease, '_holder_id', None)
+    monkeypatch.setattr(job_lease.os, 'getpid', lambda: 100)
+    parent = job_lease.holder_id()
+    assert job_lease.holder_id() == parent
+
+    # Воркер, созданный fork, получает свой идентификатор
+    monkeypatch.setattr(job_lease.os, 'getpid', lambda: 101)
+    assert job_lease.holder_id() != parent
+
+def test_broadcast_completion_is_fenced(lease_db):
+    broadcast_id = lease_db.create_broadcast('Новости')
+    stale = lease_db.acquire_lease('broadcast', 'a', TTL, NOW)
+    assert lease_db.claim_broadcast(broadcast_id)
+
+    current = lease_db.acquire_lease('broadcast', 'b', TTL, NOW + TTL)
+    assert not lease_db.finish_broadcast_fenced(broadcast_id, 'completed', 1, 0, 'broadcast', stale, NOW + TTL + 1)
+    assert lease_db.get_broadcast(broadcast_id)['status'] == 'sending'
+
+    assert lease_db.finish_broadcast_fenced(broadcast_id, 'completed', 2, 0, 'broadcast', current, NOW + TTL + 1)
+    assert lease_db.get_broadcast(broadcast_id)['status'] == 'completed'
+
+def test_ensure_held_raises_after_lease_moves(lease_db):
+    with job_lease.job_lease('sync:1:google', ttl_seconds=TTL) as lease:
+        lease.ensure_held(renew=True)
+        lease_db.acquire_lease('sync:1:google', 'other', TTL, lease.expires_at)
+        with pytest.raises(job_lease.LeaseLostError):
+            lease.ensure_held(renew=True)
+
+def test_fetch_collections_stops_when_lease_lost(lease_db):
+    fetched = []
+
+    with job_lease.job_lease('sync:1:google', ttl_seconds=TTL) as lease:
+        # Срок аренды прошел, пока коллекции ждали загрузки, и ее получил другой процесс
+        lease_db.acquire_lease('sync:1:google', 'other', TTL, lease.expires_at)
+        lease.expires_at = 0
+        with pytest.raises(job_lease.LeaseLostError):
+            asyncio.run(fetch_collections('google', ['a', 'b'], fetched.append, lease=lease))
+    assert fetched == []
@@ -0,0 +1,125 @@
+"""Тесты отправки очереди уведомлений (notification_outbox.drain_outbox)"""
+import asyncio
+import time
+
+import pytest
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+import notification_outbox
+from config import Config
+from rate_limiter import DeadlineExceeded
+
+class FakeBot:
+    """Бот, который отвечает на send_message заданными результатами по очереди"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        self.sent.append((chat_id, text, rate_limit_args))
+
+@pytest.fixture(autouse=True)
+def outbox_db(db, monkeypatch):
+    monkeypatch.setattr(notification_outbox, 'db', db)
+    monkeypatch.setattr(Config, 'OUTBOX_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(Config, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+    monkeypatch.setattr(Config, 'OUTBOX_RETRY_MAX_SECONDS', 3600)
+    return db
+
+def _enqueue(db, key, deadline_at=None, user_id=1):
+    now = int(time.time())
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO notification_outbox (user_id, dedup_key, text, next_attempt_at, created_at, deadline_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, key, f'text {key}', now, now, deadline_at))
+        return cursor.lastrowid
+
+def _row(db, outbox_id):
+    with db.get_connection() as conn:
+        return dict(conn.execute('SELECT * FROM notification_outbox WHERE id = ?', (outbox_id,)).fetchone())
+
+def _drain(bot):
+    return asyncio.run(notification_outbox.drain_outbox(bot))
+
+def test_delivered_in_reminder_lane(outbox_db):
+    deadline = int(time.time()) + 600
+    outbox_id = _enqueue(outbox_db, 'a', deadline_at=deadline)
+    bot = FakeBot()
+
+    assert _drain(bot) == {'delivered': 1, 'retried': 0, 'dead': 0, 'expired': 0}
+    assert bot.sent == [(1, 'text a', {'lane': 'reminder', 'deadline': deadline})]
+    assert _row(outbox_db, outbox_id)['status'] == 'delivered'
+
+def test_temporary_error_is_retried_with_backoff(outbox_db):
+    outbox_id = _enqueue(outbox_db, 'a')
+    started = int(time.time())
+
+    assert _drain(FakeBot(NetworkError('timeout')))['retried'] == 1
+    row = _row(outbox_db, outbox_id)
+    assert row['status'] == 'pending'
+    assert row['attempts'] == 1
+    assert row['next_attempt_at'] >= started + 30
+    assert 'timeout' in row['last_error']
+
+    # До следующей попытки уведомление не захватывается
+    bot = FakeBot()
+    assert _drain(bot)['delivered'] == 0
+    assert bot.sent == []
+
+def test_retry_after_postpones_rest_of_batch_without_counting_attempt(outbox_db):
+    first = _enqueue(outbox_db, 'a')
+    second = _enqueue(outbox_db, 'b')
+    started = int(time.time())
+
+    assert _drain(FakeBot(RetryAfter(20)))['retried'] == 2
+    for outbox_id in (first, second):
+        row = _row(outbox_db, outbox_id)
+        assert row['status'] == 'pending'
+        assert row['attempts'] == 0
+        assert row['next_attempt_at'] >= started + 21
+
+def test_attempts_exhausted_marks_dead(outbox_db):
+    outbox_id = _enqueue(outbox_db, 'a')
+    with outbox_db.get_connection() as conn:
+        conn.execute('UPDATE notification_outbox SET attempts = 2 WHERE id = ?', (outbox_id,))
+
+    assert _drain(FakeBot(NetworkError('timeout')))['dead'] == 1
+    assert _row(outbox_db, outbox_id)['status'] == 'dead'
+
+def test_blocked_user_marks_dead_immediately(outbox_db):
+    outbox_id = _enqueue(outbox_db, 'a')
+
+    assert _drain(FakeBot(Forbidden('bot was blocked by the user')))['dead'] == 1
+    row = _row(outbox_db, outbox_id)
+    assert row['status'] == 'dead'
+    assert row['attempts'] == 1
+
+def test_deadline_passed_before_attempt_expires(outbox_db):
+    outbox_id = _enqueue(outbox_db, 'a', deadline_at=int(time.time()) - 1)
+    bot = FakeBot()
+
+    assert _drain(bot)['expired'] == 1
+    assert bot.sent == []
+    assert _row(outbox_db, outbox_id)['status'] == 'expired'
+
+def test_rate_limiter_deadline_expires(outbox_db):
+    deadline = int(time.time()) + 600
+    outbox_id = _enqueue(outbox_db, 'a', deadline_at=deadline)
+
+    assert _drain(FakeBot(DeadlineExceeded(deadline)))['expired'] == 1
+    assert _row(outbox_db, outbox_id)['status'] == 'expired'
+
+def test_locked_rows_are_not_sent_twice(outbox_db):
+    _enqueue(outbox_db, 'a')
+    claimed = outbox_db.claim_outbox_batch(int(time.time()), 10, Config.OUTBOX_LEASE_SECONDS)
+    assert len(claimed) == 1
+
+    bot = FakeBot()
+    assert _drain(bot)['delivered'] == 0
+    assert bot.sent == []
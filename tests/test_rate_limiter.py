@@ -0,0 +1,87 @@
+"""Тесты общего ограничителя частоты запросов к Telegram (rate_limiter.py)"""
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+import rate_limiter
+from config import Config
+from rate_limiter import (LANE_BROADCAST, LANE_INTERACTIVE, LANE_REMINDER, BotRateLimiter,
+                          DeadlineExceeded, TelegramRateLimiter)
+
+def test_process_share_of_global_rate(monkeypatch):
+    monkeypatch.setattr(Config, 'TELEGRAM_GLOBAL_RATE', 25)
+    monkeypatch.setattr(Config, 'TELEGRAM_SENDER_PROCESSES', 2)
+    assert rate_limiter.process_global_rate() == 12.5
+
+    monkeypatch.setattr(Config, 'TELEGRAM_SENDER_PROCESSES', 0)
+    assert rate_limiter.process_global_rate() == 25
+
+def test_lanes_share_tokens_by_weight():
+    limiter = TelegramRateLimiter(global_rate=100, chat_rate=1, group_chat_per_minute=20)
+    limiter._global.tokens = 0
+    granted = []
+
+    async def request(chat_id, lane):
+        await limiter.acquire(chat_id, lane)
+        granted.append(lane)
+
+    async def run():
+        lanes = [LANE_BROADCAST] * 13 + [LANE_INTERACTIVE] * 13 + [LANE_REMINDER] * 13
+        await asyncio.gather(*(request(chat_id, lane) for chat_id, lane in enumerate(lanes, start=1)))
+
+    asyncio.run(run())
+    # Из первых 13 токенов напоминания получают 8, ответы - 4, рассылки - 1 (веса 8/4/1)
+    first = granted[:13]
+    assert first[0] == LANE_REMINDER
+    assert abs(first.count(LANE_REMINDER) - 8) <= 1
+    assert abs(first.count(LANE_INTERACTIVE) - 4) <= 1
+    assert first.count(LANE_BROADCAST) <= 2
+    assert len(granted) == 39
+
+def test_deadline_expiry_returns_chat_token():
+    limiter = TelegramRateLimiter(global_rate=100, chat_rate=1, group_chat_per_minute=20)
+    limiter.on_retry_after(30)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(limiter.acquire(42, LANE_REMINDER, deadline=time.time() + 1))
+    assert limiter._chats[42].tokens == 1
+    assert not limiter._waiting[LANE_REMINDER]
+
+    # После паузы первое сообщение в чат отправляется без ожидания лимита чата
+    limiter._paused_until = 0
+    limiter._global.tokens = limiter._global.capacity
+    started = time.monotonic()
+    asyncio.run(limiter.acquire(42, LANE_REMINDER))
+    assert time.monotonic() - started < 0.5
+
+def test_retry_after_pauses_and_slows_down():
+    limiter = TelegramRateLimiter(global_rate=20, chat_rate=1, group_chat_per_minute=20)
+    limiter.on_retry_after(0.2)
+    assert limiter._global.rate == 10
+
+    started = time.monotonic()
+    asyncio.run(limiter.acquire(None))
+    assert time.monotonic() - started >= 0.15
+
+    for _ in range(10):
+        limiter.on_retry_after(0)
+    assert limiter._global.rate == pytest.approx(20 * rate_limiter._MIN_SLOWDOWN)
+
+def test_bot_rate_limiter_retries_after_retry_after():
+    limiter = TelegramRateLimiter(global_rate=20, chat_rate=10, group_chat_per_minute=20)
+    calls = []
+
+    async def callback():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RetryAfter(0)
+        return True
+
+    adapter = BotRateLimiter(limiter, max_retries=1)
+    result = asyncio.run(adapter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 7},
+                                                 {'lane': LANE_REMINDER}))
+    assert result is True
+    assert len(calls) == 2
+    assert limiter._global.rate < 20
@@ -0,0 +1,91 @@
+"""Тесты локального развертывания повторяющихся событий (recurrence.py)"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import recurrence
+from config import Config
+from ical_parser import iter_events
+
+USER_ID = 2002
+
+@pytest.fixture(autouse=True)
+def recurrence_db(db, monkeypatch):
+    monkeypatch.setattr(recurrence, 'db', db)
+    monkeypatch.setattr(Config, 'RECURRENCE_HORIZON_DAYS', 7)
+    return db
+
+def _calendar(*vevents):
+    return 'BEGIN:VCALENDAR\r\n' + ''.join(
+        'BEGIN:VEVENT\r\n' + ''.join(f'{line}\r\n' for line in lines) + 'END:VEVENT\r\n' for lines in vevents
+    ) + 'END:VCALENDAR\r\n'
+
+def _ical_time(value):
+    return f'{value:%Y%m%dT%H%M%S}Z'
+
+@pytest.fixture
+def window():
+    now = datetime.utcnow().replace(microsecond=0)
+    first = (now + timedelta(days=1)).replace(hour=9, minute=0, second=0)
+    return now, first, now - timedelta(days=30), now + timedelta(days=90)
+
+def _sync(events, window, full=True, changed_ids=()):
+    _, _, time_min, time_max = window
+    return recurrence.apply_sync(USER_ID, 'yandex', events, time_min, time_max, full=full, changed_ids=changed_ids)
+
+def test_series_expanded_to_horizon_with_exdate_and_override(window):
+    now, first, time_min, time_max = window
+    excluded = first + timedelta(days=2)
+    moved_from = first + timedelta(days=3)
+    data = _calendar(
+        ['UID:daily', 'SUMMARY:Планерка', f'DTSTART:{_ical_time(first)}', f'DTEND:{_ical_time(first + timedelta(minutes=30))}',
+         'RRULE:FREQ=DAILY;COUNT=20', f'EXDATE:{_ical_time(excluded)}'],
+        ['UID:daily', 'SUMMARY:Планерка (перенесена)', f'RECURRENCE-ID:{_ical_time(moved_from)}',
+         f'DTSTART:{_ical_time(moved_from + timedelta(hours=2))}',
+         f'DTEND:{_ical_time(moved_from + timedelta(hours=2, minutes=30))}'],
+        ['UID:single', 'SUMMARY:Разовая встреча', f'DTSTART:{_ical_time(first)}']
+    )
+    events = _sync(list(iter_events(data, time_min, time_max)), window)
+
+    horizon = now + timedelta(days=7)
+    expected = [first + timedelta(days=day) for day in range(20)
+                if first + timedelta(days=day) <= horizon
+                and first + timedelta(days=day) not in (excluded, moved_from)]
+    occurrences = [event for event in events if event['summary'] == 'Планерка']
+    assert [event['start'] for event in occurrences] == expected
+    assert all(event['end'] - event['start'] == timedelta(minutes=30) for event in occurrences)
+    assert [event['start'] for event in events if event['summary'] == 'Планерка (перенесена)'] == \
+        [moved_from + timedelta(hours=2)]
+    assert [event['id'] for event in events if event['summary'] == 'Разовая встреча'] == ['single']
+
+def test_incremental_sync_keeps_saved_series(window):
+    _, first, time_min, time_max = window
+    data = _calendar(['UID:daily', 'SUMMARY:Планерка', f'DTSTART:{_ical_time(first)}', 'RRULE:FREQ=DAILY'])
+    full = _sync(list(iter_events(data, time_min, time_max)), window)
+
+    # Серия не изменилась и не пришла в ответе sync-collection
+    assert _sync([], window, full=False) == full
+
+def test_series_removed_when_event_deleted_or_no_longer_recurring(window):
+    _, first, time_min, time_max = window
+    data = _calendar(['UID:daily', 'SUMMARY:Планерка', f'DTSTART:{_ical_time(first)}', 'RRULE:FREQ=DAILY'])
+    _sync(list(iter_events(data, time_min, time_max)), window)
+
+    assert _sync([], window, full=False, changed_ids=['daily']) == []
+    _sync(list(iter_events(data, time_min, time_max)), window)
+    assert _sync([], window, full=True) == []
+
+def test_occurrences_follow_local_time_across_dst():
+    rule = {
+        'rrule': 'FREQ=WEEKLY;UNTIL=20300317T235959Z',
+        'start': datetime(2030, 3, 3, 9, 0).isoformat(),
+        'tzid': 'America/New_York',
+        'all_day': False,
+        'duration': 3600,
+        'rdates': [],
+        'exdates': []
+    }
+    starts = recurrence.occurrence_starts(rule, datetime(2030, 3, 1), datetime(2030, 4, 1))
+
+    # 9:00 по Нью-Йорку: до перехода на летнее время (10 марта) UTC-5, после - UTC-4
+    assert starts == [datetime(2030, 3, 3, 14, 0), datetime(2030, 3, 10, 13, 0), datetime(2030, 3, 17, 13, 0)]
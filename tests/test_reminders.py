@@ -0,0 +1,137 @@
+"""Тесты выборки наступивших напоминаний и догоняющей отправки после простоя"""
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+import job_lease
+import scheduler
+from config import Config
+
+USER_ID = 1001
+
+def _add_event(db, event_id, start_ts):
+    start = datetime.utcfromtimestamp(start_ts)
+    db.save_or_update_event(USER_ID, 'google', event_id, f'Событие {event_id}', '', '',
+                            start, datetime.utcfromtimestamp(start_ts + 3600))
+
+def _statuses(db):
+    with db.get_connection() as conn:
+        return {row['event_id']: row['status'] for row in conn.execute('SELECT event_id, status FROM reminders')}
+
+@pytest.fixture
+def user(db):
+    db.add_user(USER_ID, 'tester', 'Tester')
+    db.update_notification_settings(USER_ID, 15)
+    return USER_ID
+
+def test_due_reminders_selects_pending_with_past_fire_time(db, user):
+    now = 1_800_000_000
+    _add_event(db, 'soon', now + 5 * 60)       # напоминание наступило 10 минут назад
+    _add_event(db, 'later', now + 60 * 60)     # еще не наступило
+    _add_event(db, 'started', now - 60)        # событие уже началось
+    db.rebuild_reminders(USER_ID, now_ts=now - 20 * 60)
+
+    due = db.get_due_reminders(now)
+    assert [reminder['event_id'] for reminder in due] == ['soon']
+    assert due[0]['summary'] == 'Событие soon'
+
+def test_due_reminders_ignores_sent_reminders(db, user):
+    now = 1_800_000_000
+    _add_event(db, 'soon', now + 5 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now - 20 * 60)
+    reminder = db.get_due_reminders(now)[0]
+    assert db.enqueue_reminder_notification([reminder['id']], USER_ID, 'text', now)
+
+    assert db.get_due_reminders(now) == []
+
+def test_due_reminders_respects_limit(db, user):
+    now = 1_800_000_000
+    for index in range(5):
+        _add_event(db, f'event-{index}', now + 60 + index)
+    db.rebuild_reminders(USER_ID, now_ts=now - 20 * 60)
+
+    assert len(db.get_due_reminders(now, limit=2)) == 2
+
+def test_late_event_is_reminded_immediately(db, user):
+    now = 1_800_000_000
+    # Событие добавлено за 5 минут до начала: время напоминания за 15 минут уже прошло
+    _add_event(db, 'late', now + 5 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now)
+
+    assert [reminder['event_id'] for reminder in db.get_due_reminders(now)] == ['late']
+
+def test_raising_offset_after_reminder_does_not_remind_again(db, user):
+    now = int(time.time())
+    _add_event(db, 'soon', now + 10 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now - 10 * 60)
+    reminder = db.get_due_reminders(now)[0]
+    assert db.enqueue_reminder_notification([reminder['id']], USER_ID, 'text', now)
+
+    # Напоминание за 30 минут уже прошло, а о событии пользователь уже получил напоминание
+    db.update_notification_settings(USER_ID, 30)
+    assert db.get_due_reminders(int(time.time())) == []
+
+@pytest.fixture
+def scheduler_db(db, monkeypatch):
+    """Проверка напоминаний с тестовой базой и без обращений к Telegram"""
+    async def fake_get_bot():
+        return object()
+
+    monkeypatch.setattr(scheduler, 'db', db)
+    monkeypatch.setattr(job_lease, 'db', db)
+    monkeypatch.setattr(scheduler, 'get_bot', fake_get_bot)
+    monkeypatch.setattr(scheduler, 'notify_outbox', lambda: True)
+    monkeypatch.setattr(Config, 'get_telegram_token', staticmethod(lambda: 'test-token'))
+    monkeypatch.setattr(Config, 'REMINDER_MAX_CATCHUP_MINUTES', 120)
+    monkeypatch.setattr(Config, 'is_notification_digest_enabled', staticmethod(lambda: False))
+    db.set_system_setting('reminders_initialized', 'true')
+    return db
+
+def _run_check():
+    asyncio.run(scheduler.check_and_notify_events())
+
+def test_reminder_added_behind_watermark_is_delivered(scheduler_db, user):
+    db = scheduler_db
+    now = int(time.time())
+    # Прошлая проверка была минуту назад, а другой процесс добавил напоминание,
+    # время которого наступило раньше нее
+    db.set_system_setting(scheduler.REMINDER_WATERMARK_KEY, str(now - 60))
+    _add_event(db, 'late', now + 5 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now - 10 * 60)
+
+    _run_check()
+
+    assert _statuses(db) == {'late': 'sent'}
+    assert db.get_outbox_stats().get('pending') == 1
+    assert int(db.get_system_setting(scheduler.REMINDER_WATERMARK_KEY)) >= now
+
+@pytest.mark.parametrize('last_check_ago', [None, 3 * 3600])
+def test_reminder_missed_beyond_catchup_expires(scheduler_db, user, last_check_ago):
+    db = scheduler_db
+    db.update_notification_settings(USER_ID, 240)
+    now = int(time.time())
+    if last_check_ago is not None:
+        db.set_system_setting(scheduler.REMINDER_WATERMARK_KEY, str(now - last_check_ago))
+    # Напоминание за 4 часа до события наступило 3 часа назад (простой дольше 2 часов)
+    _add_event(db, 'stale', now + 60 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now - 3 * 3600)
+
+    _run_check()
+
+    assert _statuses(db) == {'stale': 'expired'}
+    assert not db.get_outbox_stats().get('pending')
+
+def test_old_reminder_is_delivered_without_downtime(scheduler_db, user):
+    db = scheduler_db
+    db.update_notification_settings(USER_ID, 240)
+    now = int(time.time())
+    # Проверки шли без перерыва, а напоминание трехчасовой давности добавил другой процесс
+    db.set_system_setting(scheduler.REMINDER_WATERMARK_KEY, str(now - 60))
+    _add_event(db, 'behind', now + 60 * 60)
+    db.rebuild_reminders(USER_ID, now_ts=now - 3 * 3600)
+
+    _run_check()
+
+    assert _statuses(db) == {'behind': 'sent'}
@@ -0,0 +1,88 @@
+"""Тесты политики планирования синхронизации (sync_planner.py)"""
+import pytest
+
+from config import Config
+from sync_planner import (current_stagger_tick, due_stagger_slots, filter_current_slice,
+                          next_sync_interval, stagger_slot, stagger_slot_count)
+
+MINUTE = 60
+NOW = 1_800_000_000
+
+@pytest.fixture(autouse=True)
+def intervals(monkeypatch):
+    monkeypatch.setattr(Config, 'SYNC_INTERVAL_MINUTES', 15)
+    monkeypatch.setattr(Config, 'SYNC_MIN_INTERVAL_MINUTES', 5)
+    monkeypatch.setattr(Config, 'SYNC_MAX_INTERVAL_MINUTES', 240)
+    monkeypatch.setattr(Config, 'SYNC_TICK_MINUTES', 1)
+
+def test_first_sync_uses_initial_interval():
+    assert next_sync_interval(None, 0, NOW) == 15 * MINUTE
+
+def test_changes_reset_interval_to_minimum():
+    assert next_sync_interval(120 * MINUTE, 3, NOW) == 5 * MINUTE
+
+def test_unchanged_calendar_doubles_interval_up_to_maximum():
+    assert next_sync_interval(15 * MINUTE, 0, NOW) == 30 * MINUTE
+    assert next_sync_interval(200 * MINUTE, 0, NOW) == 240 * MINUTE
+
+def test_interval_shortened_before_next_reminder():
+    # Последняя синхронизация - за минимальный интервал до напоминания
+    assert next_sync_interval(120 * MINUTE, 0, NOW, NOW + 60 * MINUTE) == 55 * MINUTE
+
+def test_imminent_reminder_keeps_minimum_interval():
+    assert next_sync_interval(120 * MINUTE, 0, NOW, NOW + 2 * MINUTE) == 5 * MINUTE
+
+def test_past_reminder_is_ignored():
+    assert next_sync_interval(15 * MINUTE, 0, NOW, NOW - MINUTE) == 30 * MINUTE
+
+def test_push_covered_polls_at_maximum():
+    assert next_sync_interval(None, 4, NOW, push_covered=True) == 240 * MINUTE
+
+def test_push_covered_still_syncs_before_reminder():
+    assert next_sync_interval(None, 0, NOW, NOW + 60 * MINUTE, push_covered=True) == 55 * MINUTE
+
+def _tick_start(tick):
+    return tick * 60
+
+def test_stagger_slot_is_stable_and_in_range():
+    assert stagger_slot_count() == 15
+    slots = {stagger_slot(user_id, 'google', 15) for user_id in range(200)}
+    assert slots <= set(range(15))
+    assert stagger_slot(42, 'yandex', 15) == stagger_slot(42, 'yandex', 15)
+
+def test_first_run_processes_only_current_slot():
+    now = _tick_start(1000) + 30
+    assert due_stagger_slots(None, now, 15) == {1000 % 15}
+
+def test_repeated_run_in_same_tick_stays_on_current_slot():
+    now = _tick_start(1000) + 50
+    assert due_stagger_slots(1000, now, 15) == {1000 % 15}
+
+def test_missed_ticks_are_caught_up():
+    now = _tick_start(1003)
+    assert due_stagger_slots(1000, now, 15) == {1001 % 15, 1002 % 15, 1003 % 15}
+
+def test_long_gap_covers_whole_cycle_once():
+    now = _tick_start(5000)
+    assert due_stagger_slots(1000, now, 15) == set(range(15))
+
+def test_filter_selects_connections_of_due_slots():
+    now = _tick_start(2000)
+    connections = [{'user_id': user_id, 'calendar_type': 'google', 'last_success_at': 1}
+                   for user_id in range(100)]
+    due = due_stagger_slots(1998, now, 15)
+    selected = filter_current_slice(connections, now, last_tick=1998)
+    assert selected == [connection for connection in connections
+                        if stagger_slot(connection['user_id'], 'google', 15) in due]
+
+def test_filter_skips_slot_for_new_and_urgent_connections():
+    now = _tick_start(2000)
+    tick = current_stagger_tick(now)
+    other_slot_user = next(user_id for user_id in range(100)
+                           if stagger_slot(user_id, 'google', 15) != tick % 15)
+    never_synced = {'user_id': other_slot_user, 'calendar_type': 'google', 'last_success_at': None}
+    urgent = {'user_id': other_slot_user, 'calendar_type': 'google', 'last_success_at': 1,
+              'next_event_at': now + 20 * MINUTE, 'notification_minutes': 10}
+    relaxed = {'user_id': other_slot_user, 'calendar_type': 'google', 'last_success_at': 1,
+               'next_event_at': now + 600 * MINUTE, 'notification_minutes': 10}
+    assert filter_current_slice([never_synced, urgent, relaxed], now, last_tick=tick - 1) == [never_synced, urgent]